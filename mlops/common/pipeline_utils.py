@@ -214,6 +214,7 @@ def prepare_and_execute_pipeline(pipeline: PipelineJobConfig):
         cluster_name=compute.name,
         display_name=published_run_name,
         tags=pipeline_job_tags,
+        force_rerun=pipeline_config.get("force_rerun", True),
     )
 
     execute_pipeline(
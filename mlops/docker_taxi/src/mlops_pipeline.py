@@ -15,6 +15,7 @@ import argparse
 from azure.ai.ml.dsl import pipeline
 from azure.ai.ml import Input
 from azure.ai.ml import load_component
+from azure.core.exceptions import ResourceNotFoundError
 import os
 from mlops.common.config_utils import MLOpsConfig
 from mlops.common.naming_utils import generate_model_name
@@ -22,10 +23,64 @@ from mlops.common.pipeline_utils import prepare_and_execute_pipeline
 from mlops.common.pipeline_job_config import PipelineJobConfig
 
 gl_pipeline_components = []
+# Inputs set from the pipeline config of each component of gl_pipeline_components, in the same order
+gl_component_inputs = []
+
+# Number of rows the training reads at a time when it is warm started
+WARM_START_CHUNK_SIZE = 100000
+
+# Pipeline config options passed to the components having an input of the same name, they keep
+# the reference defaults of the components otherwise
+COMPONENT_SETTINGS = ("data_format", "csv_engine", "transform_mode", "max_workers", "output_layout", "prep_outputs")
+
+# Name of the component predicting the test set and scoring the predictions in one step
+FUSED_PREDICT_SCORE_COMPONENT = "predict_score_taxi_fares"
+
+
+def predict_and_score(model_output, test_data):
+    """
+    Add the steps predicting the test set and scoring the predictions to the pipeline being built.
+
+    The fused predict_score component replaces the predict and score components when it is loaded,
+    its predictions output then stays empty as no prediction format is given to it.
+
+    Args:
+        model_output: The model output of the train step.
+        test_data: The test data output of the train step.
+
+    Returns:
+        tuple: The predictions and score report outputs.
+    """
+    if gl_pipeline_components[-2].name == FUSED_PREDICT_SCORE_COMPONENT:
+        predict_score_with_sample_data = gl_pipeline_components[-2](
+            model_input=model_output,
+            test_data=test_data,
+            **gl_component_inputs[-2],
+        )
+        outputs = predict_score_with_sample_data.outputs
+        return outputs.predictions, outputs.score_report
+
+    predict_with_sample_data = gl_pipeline_components[-3](
+        model_input=model_output,
+        test_data=test_data,
+        **gl_component_inputs[-3],
+    )
+    score_with_sample_data = gl_pipeline_components[-2](
+        predictions=predict_with_sample_data.outputs.predictions,
+        model=model_output,
+        **gl_component_inputs[-2],
+    )
+    return predict_with_sample_data.outputs.predictions, score_with_sample_data.outputs.score_report
 
 
 @pipeline()
-def docker_taxi_data_regression(pipeline_job_input: Input, model_name: str, build_reference: str):
+def docker_taxi_data_regression(
+    pipeline_job_input: Input,
+    model_name: str,
+    build_reference: str,
+    previous_model: Input = None,
+    train_chunk_size: int = None,
+):
     """
     Run a pipeline for regression analysis on Docker taxi data.
 
@@ -33,31 +88,34 @@ def docker_taxi_data_regression(pipeline_job_input: Input, model_name: str, buil
         pipeline_job_input (Input): The raw input data for the pipeline.
         model_name (str): The name of the model to be used.
         build_reference (str): A reference identifier for the build.
+        previous_model (Input): The registered model to warm start the training from, optional.
+        train_chunk_size (int): The number of rows the training reads at a time to train out of core, optional.
 
     Returns:
         dict: A dictionary containing the outputs of various stages of the pipeline:
     """
     prepare_sample_data = gl_pipeline_components[0](
         raw_data=pipeline_job_input,
+        **gl_component_inputs[0],
     )
     transform_sample_data = gl_pipeline_components[1](
         clean_data=prepare_sample_data.outputs.prep_data,
+        **gl_component_inputs[1],
     )
     train_with_sample_data = gl_pipeline_components[2](
         training_data=transform_sample_data.outputs.transformed_data,
+        previous_model=previous_model,
+        chunk_size=train_chunk_size,
+        **gl_component_inputs[2],
     )
-    predict_with_sample_data = gl_pipeline_components[3](
-        model_input=train_with_sample_data.outputs.model_output,
-        test_data=train_with_sample_data.outputs.test_data,
-    )
-    score_with_sample_data = gl_pipeline_components[4](
-        predictions=predict_with_sample_data.outputs.predictions,
-        model=train_with_sample_data.outputs.model_output,
+    predictions, score_report = predict_and_score(
+        train_with_sample_data.outputs.model_output,
+        train_with_sample_data.outputs.test_data,
     )
-    gl_pipeline_components[5](
+    gl_pipeline_components[-1](
         model_metadata=train_with_sample_data.outputs.model_metadata,
         model_name=model_name,
-        score_report=score_with_sample_data.outputs.score_report,
+        score_report=score_report,
         build_reference=build_reference,
     )
 
@@ -66,8 +124,59 @@ def docker_taxi_data_regression(pipeline_job_input: Input, model_name: str, buil
         "pipeline_job_transformed_data": transform_sample_data.outputs.transformed_data,
         "pipeline_job_trained_model": train_with_sample_data.outputs.model_output,
         "pipeline_job_test_data": train_with_sample_data.outputs.test_data,
-        "pipeline_job_predictions": predict_with_sample_data.outputs.predictions,
-        "pipeline_job_score_report": score_with_sample_data.outputs.score_report,
+        "pipeline_job_predictions": predictions,
+        "pipeline_job_score_report": score_report,
+    }
+
+
+@pipeline()
+def docker_taxi_data_regression_fused(
+    pipeline_job_input: Input,
+    model_name: str,
+    build_reference: str,
+    previous_model: Input = None,
+    train_chunk_size: int = None,
+):
+    """
+    Run a pipeline for regression analysis on Docker taxi data, preparing and transforming it in one step.
+
+    Args:
+        pipeline_job_input (Input): The raw input data for the pipeline.
+        model_name (str): The name of the model to be used.
+        build_reference (str): A reference identifier for the build.
+        previous_model (Input): The registered model to warm start the training from, optional.
+        train_chunk_size (int): The number of rows the training reads at a time to train out of core, optional.
+
+    Returns:
+        dict: A dictionary containing paths to the transformed data, the model, predictions, and score report.
+    """
+    prepare_transform_sample_data = gl_pipeline_components[0](
+        raw_data=pipeline_job_input,
+        **gl_component_inputs[0],
+    )
+    train_with_sample_data = gl_pipeline_components[1](
+        training_data=prepare_transform_sample_data.outputs.transformed_data,
+        previous_model=previous_model,
+        chunk_size=train_chunk_size,
+        **gl_component_inputs[1],
+    )
+    predictions, score_report = predict_and_score(
+        train_with_sample_data.outputs.model_output,
+        train_with_sample_data.outputs.test_data,
+    )
+    gl_pipeline_components[-1](
+        model_metadata=train_with_sample_data.outputs.model_metadata,
+        model_name=model_name,
+        score_report=score_report,
+        build_reference=build_reference,
+    )
+
+    return {
+        "pipeline_job_transformed_data": prepare_transform_sample_data.outputs.transformed_data,
+        "pipeline_job_trained_model": train_with_sample_data.outputs.model_output,
+        "pipeline_job_test_data": train_with_sample_data.outputs.test_data,
+        "pipeline_job_predictions": predictions,
+        "pipeline_job_score_report": score_report,
     }
 
 
@@ -79,6 +188,34 @@ class DockerTaxi(PipelineJobConfig):
     regression pipeline. It includes methods for constructing the pipeline.
     """
 
+    def __init__(
+        self,
+        fused_prep_transform: bool = False,
+        warm_start: bool = False,
+        fused_predict_score: bool = False,
+        component_settings: dict = None,
+        **kwargs,
+    ):
+        """
+        Initialize the pipeline job configuration.
+
+        Args:
+            fused_prep_transform (bool): Whether to run prep and transform as a single fused step.
+            warm_start (bool): Whether to warm start the training from the latest registered model.
+            fused_predict_score (bool): Whether to run predict and score as a single fused step.
+            component_settings (dict): The inputs set on the components having them, by input name.
+            **kwargs: The common pipeline job properties of PipelineJobConfig.
+        """
+        super().__init__(**kwargs)
+        self.fused_prep_transform = fused_prep_transform
+        self.warm_start = warm_start
+        self.fused_predict_score = fused_predict_score
+        self.component_settings = dict(component_settings or {})
+        if warm_start:
+            # A warm start only skips the training files that didn't change, so the prep step
+            # partitions its output unless told otherwise, a single file changes with any new data
+            self.component_settings.setdefault("output_layout", "partitioned")
+
     def construct_pipeline(self, ml_client):
         """
         Construct a pipeline job for Docker taxi data regression.
@@ -95,24 +232,73 @@ class DockerTaxi(PipelineJobConfig):
 
         parent_dir = os.path.join(os.getcwd(), "mlops/docker_taxi/components")
 
-        components = ["prep", "transform", "train", "predict", "score", "register"]
+        if self.fused_prep_transform:
+            components = ["prep_transform", "train"]
+        else:
+            components = ["prep", "transform", "train"]
+        if self.fused_predict_score:
+            components += ["predict_score", "register"]
+        else:
+            components += ["predict", "score", "register"]
 
         for component in components:
             comp = load_component(source=f"{parent_dir}/{component}.yml")
             comp.environment = self.environment_name
             gl_pipeline_components.append(comp)
+            gl_component_inputs.append(
+                {
+                    name: value
+                    for name, value in self.component_settings.items()
+                    if name in comp.inputs
+                }
+            )
 
-        pipeline_job = docker_taxi_data_regression(
-            Input(type="uri_folder", path=registered_data_asset.id),
-            self.model_name,
-            self.build_reference,
-        )
+        # Warm started runs train out of core, which saves the statistics the next run starts from
+        previous_model = None
+        train_chunk_size = None
+        if self.warm_start:
+            previous_model = self.latest_model(ml_client)
+            train_chunk_size = WARM_START_CHUNK_SIZE
+
+        if self.fused_prep_transform:
+            pipeline_job = docker_taxi_data_regression_fused(
+                Input(type="uri_folder", path=registered_data_asset.id),
+                self.model_name,
+                self.build_reference,
+                previous_model,
+                train_chunk_size,
+            )
+        else:
+            pipeline_job = docker_taxi_data_regression(
+                Input(type="uri_folder", path=registered_data_asset.id),
+                self.model_name,
+                self.build_reference,
+                previous_model,
+                train_chunk_size,
+            )
 
-        # demo how to change pipeline output settings
-        pipeline_job.outputs.pipeline_job_prepped_data.mode = "rw_mount"
+            # demo how to change pipeline output settings
+            pipeline_job.outputs.pipeline_job_prepped_data.mode = "rw_mount"
 
         return pipeline_job
 
+    def latest_model(self, ml_client):
+        """
+        Get the latest registered version of the model to warm start the training from.
+
+        Args:
+            ml_client: The Azure ML client to use for retrieving the model.
+
+        Returns:
+            Input: The model, None when no version is registered yet.
+        """
+        try:
+            model = ml_client.models.get(name=self.model_name, label="latest")
+        except ResourceNotFoundError:
+            print(f"No registered {self.model_name} model to warm start from")
+            return None
+        return Input(type="mlflow_model", path=model.id)
+
 
 def prepare_and_execute(
     model_name: str, build_environment: str, wait_for_completion: str, output_file: str
@@ -140,6 +326,14 @@ def prepare_and_execute(
         wait_for_completion=wait_for_completion,
         output_file=output_file,
         model_name=model_name,
+        fused_prep_transform=pipeline_config.get("fused_prep_transform", False),
+        warm_start=pipeline_config.get("warm_start", False),
+        fused_predict_score=pipeline_config.get("fused_predict_score", False),
+        component_settings={
+            name: pipeline_config[name]
+            for name in COMPONENT_SETTINGS
+            if name in pipeline_config
+        },
     )
 
     prepare_and_execute_pipeline(pipeline_job_config)
@@ -1,10 +1,25 @@
 """This module provides the functionality for initializing and running a machine learning model."""
 import os
 import joblib
+import numpy
 import pandas as pd
 from typing import List
 
 
+class CompactModel:
+    """A linear model loaded from the compact model.npy file written by the train step."""
+
+    def __init__(self, path):
+        """Memory-map the intercept and the coefficients of the model."""
+        weights = numpy.load(path, mmap_mode="r").view("float64")
+        self.intercept = weights[0]
+        self.coef = weights[1:]
+
+    def predict(self, data):
+        """Predict the rows of features."""
+        return numpy.asarray(data, dtype="float64") @ self.coef + self.intercept
+
+
 def init():
     """
     Initialize the service instance on startup.
@@ -13,10 +28,14 @@ def init():
     """
     global model
 
-    model_path = os.path.join(os.getenv("AZUREML_MODEL_DIR"), "model", "model.pkl")
+    model_dir = os.path.join(os.getenv("AZUREML_MODEL_DIR"), "model")
 
-    # deserialize the model file back into a sklearn model
-    model = joblib.load(model_path)
+    # linear models are memory-mapped from their compact file, without unpickling a sklearn model
+    if os.path.isfile(os.path.join(model_dir, "model.npy")):
+        model = CompactModel(os.path.join(model_dir, "model.npy"))
+    else:
+        # deserialize the model file back into a sklearn model
+        model = joblib.load(os.path.join(model_dir, "model.pkl"))
     print("Init complete")
 
 
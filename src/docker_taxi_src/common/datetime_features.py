@@ -0,0 +1,180 @@
+"""
+This module decomposes trip datetimes into the calendar and clock features of the model.
+
+The datetime text is parsed with an explicit format, or with a format inferred once from the
+first value and cached, so the values are not inferred one by one. A batch the cached format
+doesn't parse, e.g. from another vendor or month, has its format inferred again. The features are computed
+with integer arithmetic on the int64 nanosecond epoch values, for all datetime columns in one
+pass, without creating date or time objects per row.
+"""
+
+from datetime import datetime
+import numpy as np
+import pandas as pd
+
+# Formats tried, in order, when no format is given
+CANDIDATE_FORMATS = [
+    "%Y-%m-%d %H:%M:%S",
+    "%Y-%m-%dT%H:%M:%S",
+    "%Y-%m-%d %H:%M:%S.%f",
+    "%Y-%m-%dT%H:%M:%S.%f",
+    "%m/%d/%Y %H:%M:%S",
+    "%m/%d/%Y %I:%M:%S %p",
+    "%m/%d/%Y %H:%M",
+]
+
+# Features derived from each datetime column, in the order they are added
+DATETIME_PARTS = ["weekday", "month", "monthday", "hour", "minute", "second"]
+
+NANOSECONDS_PER_SECOND = 1_000_000_000
+SECONDS_PER_DAY = 86400
+
+_format_cache = {}
+
+
+def infer_format(value):
+    """
+    Find the first candidate format that parses a datetime text.
+
+    Parameters:
+      value (str): a datetime text
+
+    Returns:
+      str: the matching format of CANDIDATE_FORMATS, or None when none matches
+    """
+    for datetime_format in CANDIDATE_FORMATS:
+        try:
+            datetime.strptime(value, datetime_format)
+            return datetime_format
+        except ValueError:
+            continue
+    return None
+
+
+def cached_format(column, values):
+    """
+    Get the format of a datetime column, inferring it on first use.
+
+    Parameters:
+      column (str): name of the datetime column
+      values (numpy.ndarray): datetime texts of the column
+
+    Returns:
+      str: the format, or None to let pandas infer it
+    """
+    if column not in _format_cache:
+        present = values[pd.notna(values)]
+        if len(present) == 0:
+            return None
+        _format_cache[column] = infer_format(str(present[0]))
+        print("datetime format of %s: %s" % (column, _format_cache[column]))
+    return _format_cache[column]
+
+
+def parse_cached_format(column, values):
+    """
+    Parse the datetime texts of a column with its cached format, inferring it again on mismatch.
+
+    Parameters:
+      column (str): name of the datetime column
+      values (numpy.ndarray): datetime texts of the column
+
+    Returns:
+      pandas.DatetimeIndex: the parsed values
+    """
+    try:
+        return pd.to_datetime(values, format=cached_format(column, values))
+    except ValueError:
+        # The format was cached from a batch of another file or vendor
+        _format_cache.pop(column, None)
+        return pd.to_datetime(values, format=cached_format(column, values))
+
+
+def epoch_nanoseconds(data, columns, datetime_format=None):
+    """
+    Parse datetime columns into int64 nanoseconds since the epoch.
+
+    Parameters:
+      data (pandas.DataFrame): data with the datetime columns as text
+      columns (list): names of the datetime columns
+      datetime_format (str): strptime format of the values, a cached inferred format when not set
+
+    Returns:
+      numpy.ndarray: int64 values of the columns one after the other
+    """
+    parsed = []
+    for column in columns:
+        if pd.api.types.is_datetime64_any_dtype(data[column]):
+            # Already parsed, e.g. by the pyarrow csv reader
+            parsed.append(pd.DatetimeIndex(data[column]).as_unit("ns"))
+            continue
+        values = data[column].to_numpy()
+        if datetime_format:
+            parsed.append(pd.to_datetime(values, format=datetime_format).as_unit("ns"))
+        else:
+            parsed.append(parse_cached_format(column, values).as_unit("ns"))
+
+    epoch = np.concatenate([values.asi8 for values in parsed])
+    missing = np.concatenate([values.isna() for values in parsed])
+    if missing.any():
+        raise ValueError(f"Missing datetime values in {list(columns)}")
+    return epoch
+
+
+def civil_from_days(days):
+    """
+    Convert days since the epoch into the month and the day of the month.
+
+    Parameters:
+      days (numpy.ndarray): int64 days since 1970-01-01
+
+    Returns:
+      (numpy.ndarray, numpy.ndarray): month from 1 to 12 and day of the month from 1 to 31
+    """
+    # Proleptic Gregorian calendar arithmetic on 400 year eras starting on March 1st
+    shifted = days + 719468
+    era = shifted // 146097
+    day_of_era = shifted - era * 146097
+    year_of_era = (
+        day_of_era - day_of_era // 1460 + day_of_era // 36524 - day_of_era // 146096
+    ) // 365
+    day_of_year = day_of_era - (365 * year_of_era + year_of_era // 4 - year_of_era // 100)
+    month_index = (5 * day_of_year + 2) // 153
+    monthday = day_of_year - (153 * month_index + 2) // 5 + 1
+    month = np.where(month_index < 10, month_index + 3, month_index - 9)
+    return month, monthday
+
+
+def datetime_features(data, columns, datetime_format=None):
+    """
+    Compute the DATETIME_PARTS features of datetime columns.
+
+    Parameters:
+      data (pandas.DataFrame): data with the datetime columns as text
+      columns (list): names of the datetime columns, e.g. pickup_datetime and dropoff_datetime
+      datetime_format (str): strptime format of the values, a cached inferred format when not set
+
+    Returns:
+      DataFrame: int8 features named after the columns, e.g. pickup_weekday, aligned with the data
+    """
+    seconds = epoch_nanoseconds(data, columns, datetime_format) // NANOSECONDS_PER_SECOND
+    days, second_of_day = np.divmod(seconds, SECONDS_PER_DAY)
+    month, monthday = civil_from_days(days)
+    parts = {
+        # 1970-01-01 was a Thursday, weekday 3 with Monday as 0
+        "weekday": (days + 3) % 7,
+        "month": month,
+        "monthday": monthday,
+        "hour": second_of_day // 3600,
+        "minute": second_of_day % 3600 // 60,
+        "second": second_of_day % 60,
+    }
+
+    rows = len(data)
+    features = {}
+    for position, column in enumerate(columns):
+        prefix = column.replace("_datetime", "")
+        rows_slice = slice(position * rows, (position + 1) * rows)
+        for part in DATETIME_PARTS:
+            features[f"{prefix}_{part}"] = parts[part][rows_slice].astype("int8")
+    return pd.DataFrame(features, index=data.index)
@@ -0,0 +1,476 @@
+"""
+This module accumulates the regression metrics of predictions chunk by chunk.
+
+The state of a set of rows is its row count, the mean and the sum of squared deviations of the
+actual values, the sums of squared and absolute errors, and the counts of a residual histogram.
+MSE, RMSE, MAE and R² are derived from it once all rows are accumulated. States of chunks, files
+or worker processes are merged with the pairwise update of Chan et al. for the deviations and by
+summing the rest, so the metrics don't depend on how the rows were split, the histogram counts
+are merged exactly, and only one chunk is in memory at a time.
+
+The same state is kept for each slice of the test set declared in a slice config, e.g. for each
+vendor or each band of trip distance. The states of all groups of a slice are computed by a single
+grouped pass over a chunk, and merged group by group with the same vectorized update, so the cost
+doesn't grow with the number of groups.
+
+Confidence intervals of the metrics are estimated with the Poisson bootstrap: each resample gives
+each row a Poisson(1) weight instead of drawing rows with replacement, so the same weighted state is
+accumulated for all resamples at once with a matrix product over a block of rows, and merged like
+the others. The weight of a row only depends on its position in the test set, so the intervals don't
+depend on how the rows were split either. Blocks are sized so the weights of all resamples fit in a
+memory cap.
+"""
+
+from functools import lru_cache
+import math
+from pathlib import Path
+from typing import NamedTuple
+import numpy as np
+import pandas as pd
+import yaml
+
+# Edges of the residual histogram, residuals outside of them are counted in the first or last bin
+RESIDUAL_EDGES = np.linspace(-50.0, 50.0, 101)
+
+# Slices of the taxi test sets
+DEFAULT_SLICE_CONFIG = Path(__file__).parent / "slice_config.yml"
+
+# Columns of the state of each group of a slice
+GROUP_STATE = ["rows", "mean_actual", "actual_deviation", "squared_error", "absolute_error"]
+
+# Bootstrap resamples of the scoring metrics, and the memory their weights of a block of rows may take
+DEFAULT_RESAMPLES = 1000
+DEFAULT_BOOTSTRAP_MEMORY_MB = 256
+
+# The weights of the rows are drawn by groups of consecutive positions, each group from its own seed
+BOOTSTRAP_GROUP_ROWS = 1024
+
+# Poisson(1) quantiles of the 16 bit uniform values, weights are drawn by a lookup in this table
+POISSON_WEIGHTS = np.searchsorted(
+    np.cumsum([math.exp(-1) / math.factorial(weight) for weight in range(16)]),
+    (np.arange(2**16) + 0.5) / 2**16,
+    side="right",
+).astype(np.float32)
+
+# Bytes per row and resample: the uniform value and the weight
+BOOTSTRAP_BYTES = 2 + 4
+
+
+class SliceConfig(NamedTuple):
+    """The slices of a test set and the bands of their numeric columns."""
+
+    slices: dict
+    bands: dict
+
+    @property
+    def columns(self):
+        """List the columns the slices group by."""
+        return sorted({column for columns in self.slices.values() for column in columns})
+
+
+@lru_cache(maxsize=None)
+def load_slice_config(config_path):
+    """
+    Read a slice config file.
+
+    Parameters:
+      config_path (str): yaml file with a slices mapping and an optional bands mapping
+
+    Returns:
+      SliceConfig: slice name to its columns, and column name to its band edges
+    """
+    with open(config_path) as config_file:
+        config = yaml.safe_load(config_file)
+
+    bands = {}
+    for column, edges in (config.get("bands") or {}).items():
+        if len(edges) < 2 or list(edges) != sorted(edges):
+            raise ValueError(f"The band edges of {column} must be at least 2 increasing values")
+        bands[column] = tuple(float(edge) for edge in edges)
+    slices = {name: tuple(columns) for name, columns in (config.get("slices") or {}).items()}
+    return SliceConfig(slices, bands)
+
+
+class RegressionMetrics:
+    """Mergeable one-pass accumulator of regression metrics."""
+
+    def __init__(self, edges=RESIDUAL_EDGES):
+        """
+        Initialize the state of an empty set of rows.
+
+        Parameters:
+          edges (numpy.ndarray): increasing edges of the residual histogram
+        """
+        self.edges = np.asarray(edges, dtype="float64")
+        self.rows = 0
+        self.mean_actual = 0.0
+        self.actual_deviation = 0.0
+        self.squared_error = 0.0
+        self.absolute_error = 0.0
+        self.histogram = np.zeros(len(self.edges) + 1, dtype=np.int64)
+
+    def update(self, actual, predicted):
+        """
+        Add a chunk of rows.
+
+        Parameters:
+          actual (numpy.ndarray): actual values
+          predicted (numpy.ndarray): predicted values
+        """
+        actual = np.asarray(actual, dtype="float64")
+        residual = actual - np.asarray(predicted, dtype="float64")
+        chunk = RegressionMetrics(self.edges)
+        chunk.rows = len(actual)
+        if chunk.rows == 0:
+            return
+
+        chunk.mean_actual = actual.mean()
+        deviation = actual - chunk.mean_actual
+        chunk.actual_deviation = deviation @ deviation
+        chunk.squared_error = residual @ residual
+        chunk.absolute_error = np.abs(residual).sum()
+        # Bin 0 counts the residuals below the first edge, the last bin those from the last edge on
+        chunk.histogram = np.bincount(
+            np.searchsorted(self.edges, residual, side="right"), minlength=len(self.histogram)
+        )
+        self.merge(chunk)
+
+    def merge(self, other):
+        """
+        Add the state of other rows, e.g. computed by another process.
+
+        Parameters:
+          other (RegressionMetrics): state with the same histogram edges
+        """
+        if not np.array_equal(self.edges, other.edges):
+            raise ValueError("Can't merge metrics with different residual histogram edges")
+        if other.rows == 0:
+            return
+
+        rows = self.rows + other.rows
+        delta = other.mean_actual - self.mean_actual
+        self.actual_deviation += other.actual_deviation + delta * delta * self.rows * other.rows / rows
+        self.mean_actual += delta * other.rows / rows
+        self.squared_error += other.squared_error
+        self.absolute_error += other.absolute_error
+        self.histogram = self.histogram + other.histogram
+        self.rows = rows
+
+    def results(self):
+        """
+        Derive the metrics of the accumulated rows.
+
+        Returns:
+          dict: mse, rmse, mae and r2
+        """
+        if self.rows == 0:
+            raise ValueError("No rows to compute the metrics of")
+        mse = self.squared_error / self.rows
+        return {
+            "mse": mse,
+            "rmse": float(np.sqrt(mse)),
+            "mae": self.absolute_error / self.rows,
+            "r2": 1 - self.squared_error / self.actual_deviation,
+        }
+
+    def residual_histogram(self):
+        """
+        Describe the residual histogram.
+
+        Returns:
+          dict: the edges and the counts of the bins, counts has one more bin at each end for the
+            residuals outside of the edges
+        """
+        return {"edges": self.edges.tolist(), "counts": self.histogram.tolist()}
+
+
+class SlicedMetrics:
+    """Mergeable one-pass accumulator of regression metrics for each group of each slice."""
+
+    def __init__(self, config):
+        """
+        Initialize the state of an empty set of rows.
+
+        Parameters:
+          config (SliceConfig): the slices
+        """
+        self.config = config
+        self.states = {name: None for name in config.slices}
+
+    def update(self, data):
+        """
+        Add a chunk of rows.
+
+        Parameters:
+          data (pandas.DataFrame): actual_cost, predicted_cost and the columns of the slices
+        """
+        if data.empty:
+            return
+
+        actual = data["actual_cost"].to_numpy(dtype="float64")
+        residual = actual - data["predicted_cost"].to_numpy(dtype="float64")
+        values = pd.DataFrame(
+            {"actual": actual, "squared_error": residual * residual, "absolute_error": np.abs(residual)}
+        )
+        keys = {column: self._group_keys(data, column) for column in self.config.columns}
+
+        chunk = SlicedMetrics(self.config)
+        for name, columns in self.config.slices.items():
+            grouped = values.groupby([keys[column] for column in columns], sort=False, dropna=False)
+            state = grouped.agg(
+                rows=("actual", "size"),
+                mean_actual=("actual", "mean"),
+                variance=("actual", "var"),
+                squared_error=("squared_error", "sum"),
+                absolute_error=("absolute_error", "sum"),
+            )
+            # The sample variance is undefined for a single row, whose deviation is 0
+            state["actual_deviation"] = (state.pop("variance") * (state["rows"] - 1)).fillna(0.0)
+            chunk.states[name] = state[GROUP_STATE]
+        self.merge(chunk)
+
+    def _group_keys(self, data, column):
+        values = data[column].to_numpy()
+        if column in self.config.bands:
+            values = np.searchsorted(self.config.bands[column], values.astype("float64"), side="right")
+        return pd.Series(values, name=column)
+
+    def merge(self, other):
+        """
+        Add the state of other rows, e.g. computed by another process.
+
+        Parameters:
+          other (SlicedMetrics): state with the same slices
+        """
+        for name, state in other.states.items():
+            if state is None:
+                continue
+            if self.states[name] is None:
+                self.states[name] = state
+                continue
+
+            # Align the groups, a group missing on one side has no rows there
+            index = self.states[name].index.union(state.index)
+            left = self.states[name].reindex(index, fill_value=0)
+            right = state.reindex(index, fill_value=0)
+            rows = left["rows"] + right["rows"]
+            delta = right["mean_actual"] - left["mean_actual"]
+            self.states[name] = pd.DataFrame(
+                {
+                    "rows": rows,
+                    "mean_actual": left["mean_actual"] + delta * right["rows"] / rows,
+                    "actual_deviation": left["actual_deviation"]
+                    + right["actual_deviation"]
+                    + delta * delta * left["rows"] * right["rows"] / rows,
+                    "squared_error": left["squared_error"] + right["squared_error"],
+                    "absolute_error": left["absolute_error"] + right["absolute_error"],
+                }
+            )
+
+    def results(self):
+        """
+        Derive the metrics of each group of each slice.
+
+        Returns:
+          dict: slice name to group label to the rows, mse, rmse, mae and r2 of the group, r2 is None
+            when the actual values of the group are all equal
+        """
+        results = {}
+        for name, state in self.states.items():
+            if state is None:
+                results[name] = {}
+                continue
+            state = state.sort_index()
+            mse = state["squared_error"] / state["rows"]
+            deviation = state["actual_deviation"].where(state["actual_deviation"] > 0)
+            metrics = pd.DataFrame(
+                {
+                    "rows": state["rows"].astype(int),
+                    "mse": mse,
+                    "rmse": np.sqrt(mse),
+                    "mae": state["absolute_error"] / state["rows"],
+                    "r2": 1 - state["squared_error"] / deviation,
+                }
+            ).astype(object)
+            metrics = metrics.where(metrics.notna(), None)
+            labels = [self._group_label(state.index.names, key) for key in state.index]
+            results[name] = dict(zip(labels, metrics.to_dict("records")))
+        return results
+
+    def _group_label(self, columns, key):
+        key = key if isinstance(key, tuple) else (key,)
+        parts = []
+        for column, value in zip(columns, key):
+            edges = self.config.bands.get(column)
+            if edges is None:
+                parts.append(str(value))
+            elif value == 0:
+                parts.append(f"<{edges[0]:g}")
+            elif value == len(edges):
+                parts.append(f">={edges[-1]:g}")
+            else:
+                parts.append(f"{edges[value - 1]:g}-{edges[value]:g}")
+        return "|".join(parts)
+
+
+class BootstrapMetrics:
+    """Mergeable one-pass accumulator of the regression metrics of Poisson bootstrap resamples."""
+
+    def __init__(self, resamples=DEFAULT_RESAMPLES, memory_mb=DEFAULT_BOOTSTRAP_MEMORY_MB, seed=0):
+        """
+        Initialize the state of an empty set of rows.
+
+        Parameters:
+          resamples (int): number of bootstrap resamples
+          memory_mb (int): memory the weights of a block of rows may take, in megabytes
+          seed (int): seed of the weights
+        """
+        self.resamples = resamples
+        self.seed = seed
+        self.block_rows = max(
+            BOOTSTRAP_GROUP_ROWS, memory_mb * 2**20 // (BOOTSTRAP_BYTES * resamples)
+        )
+        # Weighted state of each resample, the weight of its rows stands for their count
+        self.weight = np.zeros(resamples)
+        self.mean_actual = np.zeros(resamples)
+        self.actual_deviation = np.zeros(resamples)
+        self.squared_error = np.zeros(resamples)
+
+    def update(self, actual, predicted, first_row):
+        """
+        Add a chunk of rows.
+
+        Parameters:
+          actual (numpy.ndarray): actual values
+          predicted (numpy.ndarray): predicted values
+          first_row (int): position of the first row of the chunk in the test set
+        """
+        actual = np.asarray(actual, dtype="float64")
+        residual = actual - np.asarray(predicted, dtype="float64")
+        for start in range(0, len(actual), self.block_rows):
+            block = slice(start, start + self.block_rows)
+            self._update_block(actual[block], residual[block], first_row + start)
+
+    def _update_block(self, actual, residual, first_row):
+        mean = actual.mean()
+        centered = actual - mean
+        columns = np.column_stack([np.ones_like(actual), centered, centered * centered, residual * residual])
+        # Within a block float32 sums are accurate enough for the intervals, blocks are merged in float64
+        sums = (self._weights(first_row, len(actual)) @ columns.astype(np.float32)).astype("float64")
+
+        chunk = BootstrapMetrics(self.resamples, seed=self.seed)
+        chunk.weight = sums[:, 0]
+        shift = np.divide(sums[:, 1], chunk.weight, out=np.zeros(self.resamples), where=chunk.weight > 0)
+        chunk.mean_actual = mean + shift
+        chunk.actual_deviation = sums[:, 2] - chunk.weight * shift * shift
+        chunk.squared_error = sums[:, 3]
+        self.merge(chunk)
+
+    def _weights(self, first_row, rows):
+        # Draw the whole groups holding the rows, then keep the columns of the rows
+        first_group = first_row // BOOTSTRAP_GROUP_ROWS
+        last_group = (first_row + rows - 1) // BOOTSTRAP_GROUP_ROWS
+        uniform = np.empty(
+            (self.resamples, (last_group - first_group + 1) * BOOTSTRAP_GROUP_ROWS), dtype=np.uint16
+        )
+        for number, group in enumerate(range(first_group, last_group + 1)):
+            # Each raw 64 bit draw gives 4 uniform values
+            bits = np.random.PCG64(np.random.SeedSequence(self.seed, spawn_key=(group,)))
+            draws = bits.random_raw(self.resamples * BOOTSTRAP_GROUP_ROWS // 4)
+            uniform[:, number * BOOTSTRAP_GROUP_ROWS:(number + 1) * BOOTSTRAP_GROUP_ROWS] = draws.view(
+                np.uint16
+            ).reshape(self.resamples, BOOTSTRAP_GROUP_ROWS)
+        offset = first_row - first_group * BOOTSTRAP_GROUP_ROWS
+        return POISSON_WEIGHTS[uniform[:, offset:offset + rows]]
+
+    def merge(self, other):
+        """
+        Add the state of other rows, e.g. computed by another process.
+
+        Parameters:
+          other (BootstrapMetrics): state with the same resamples and seed
+        """
+        if other.resamples != self.resamples or other.seed != self.seed:
+            raise ValueError("Can't merge bootstrap metrics with different resamples")
+
+        weight = self.weight + other.weight
+        ratio = np.divide(other.weight, weight, out=np.zeros(self.resamples), where=weight > 0)
+        delta = other.mean_actual - self.mean_actual
+        self.actual_deviation = self.actual_deviation + other.actual_deviation + delta * delta * self.weight * ratio
+        self.mean_actual = self.mean_actual + delta * ratio
+        self.squared_error = self.squared_error + other.squared_error
+        self.weight = weight
+
+    def results(self, confidence=0.95):
+        """
+        Derive the percentile confidence intervals of the metrics.
+
+        Parameters:
+          confidence (float): confidence level of the intervals
+
+        Returns:
+          dict: the confidence level, the number of resamples, and the [low, high] interval of mse,
+            rmse and r2
+        """
+        if not self.weight.any():
+            raise ValueError("No rows to compute the confidence intervals of")
+        mse = self.squared_error / self.weight
+        r2 = 1 - self.squared_error / self.actual_deviation
+        quantiles = [(1 - confidence) / 2, (1 + confidence) / 2]
+        intervals = {"confidence": confidence, "resamples": self.resamples}
+        for name, values in [("mse", mse), ("rmse", np.sqrt(mse)), ("r2", r2)]:
+            intervals[name] = np.quantile(values, quantiles).tolist()
+        return intervals
+
+
+class ScoreMetrics:
+    """The metrics of the whole test set and of its slices."""
+
+    def __init__(self, slice_config=DEFAULT_SLICE_CONFIG, resamples=0, memory_mb=DEFAULT_BOOTSTRAP_MEMORY_MB):
+        """
+        Initialize the metrics of an empty set of rows.
+
+        Parameters:
+          slice_config (str): slice config file, the test set is not sliced when not set
+          resamples (int): number of bootstrap resamples of the confidence intervals, none when 0
+          memory_mb (int): memory the bootstrap weights of a block of rows may take, in megabytes
+        """
+        self.overall = RegressionMetrics()
+        self.slices = SlicedMetrics(load_slice_config(str(slice_config))) if slice_config else None
+        self.bootstrap = BootstrapMetrics(resamples, memory_mb) if resamples else None
+
+    @property
+    def columns(self):
+        """List the columns the metrics are computed from."""
+        return ["actual_cost", "predicted_cost"] + (self.slices.config.columns if self.slices else [])
+
+    def update(self, data, first_row=None):
+        """
+        Add a chunk of rows.
+
+        Parameters:
+          data (pandas.DataFrame): actual_cost, predicted_cost and the columns of the slices
+          first_row (int): position of the first row of the chunk in the test set, defaults to the
+            number of rows added before, i.e. the chunks are consecutive
+        """
+        first_row = self.overall.rows if first_row is None else first_row
+        actual = data["actual_cost"].to_numpy()
+        predicted = data["predicted_cost"].to_numpy()
+        self.overall.update(actual, predicted)
+        if self.slices:
+            self.slices.update(data)
+        if self.bootstrap:
+            self.bootstrap.update(actual, predicted, first_row)
+
+    def merge(self, other):
+        """
+        Add the metrics of other rows, e.g. computed by another process.
+
+        Parameters:
+          other (ScoreMetrics): metrics with the same slices and bootstrap resamples
+        """
+        self.overall.merge(other.overall)
+        if self.slices:
+            self.slices.merge(other.slices)
+        if self.bootstrap:
+            self.bootstrap.merge(other.bootstrap)
@@ -0,0 +1,74 @@
+"""
+This module measures the memory used by the stages of a step.
+
+Stages are traced with tracemalloc, which counts the allocations of Python objects and of the
+numpy buffers behind pandas columns. The peak of a stage is the highest traced memory reached
+while it runs, counted from the start of profiling, so it includes what the previous stages
+still hold. Data loaded before profiling starts, e.g. the step input, isn't counted.
+"""
+
+import time
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+
+MEGABYTE = 1 << 20
+
+
+class MemoryProfile:
+    """Record the peak traced memory and the duration of named stages."""
+
+    def __init__(self):
+        """Initialize an empty profile, tracing starts with the first stage."""
+        self.stages = {}
+
+    @contextmanager
+    def stage(self, name):
+        """
+        Trace a stage, the stage runs in the body of the with statement.
+
+        Stages run several times, e.g. once per chunk, keep their highest peak and total duration.
+
+        Parameters:
+          name (str): name of the stage
+        """
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+        start = time.perf_counter()
+        yield
+        seconds = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+
+        previous_peak, previous_seconds = self.stages.get(name, (0, 0.0))
+        self.stages[name] = (max(peak, previous_peak), previous_seconds + seconds)
+
+    def high_water_mark(self):
+        """
+        Get the highest peak of all stages.
+
+        Returns:
+          int: bytes
+        """
+        return max((peak for peak, _ in self.stages.values()), default=0)
+
+    def report(self):
+        """Print the peak memory and duration of each stage and stop tracing."""
+        for name, (peak, seconds) in self.stages.items():
+            print("stage %s: peak %.1f MB, %.3fs" % (name, peak / MEGABYTE, seconds))
+        print("high water mark: %.1f MB" % (self.high_water_mark() / MEGABYTE))
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+
+def stage(profile, name):
+    """
+    Trace a stage when profiling is enabled.
+
+    Parameters:
+      profile (MemoryProfile): the profile of the step, None when profiling is disabled
+      name (str): name of the stage
+
+    Returns:
+      context manager: tracing the stage, or doing nothing without a profile
+    """
+    return profile.stage(name) if profile else nullcontext()
@@ -0,0 +1,44 @@
+"""
+This module counts the rows affected by the data quality rules of a step.
+
+The counters are collected from the masks the rules compute anyway, so counting doesn't add a
+pass over the data. Counters of several chunks, partitions or worker processes are summed, and
+the totals are logged as metrics of the step run.
+"""
+
+import mlflow
+
+
+class DataQuality:
+    """Sum named row counters."""
+
+    def __init__(self):
+        """Initialize the counters, they are created as they are first counted."""
+        self.counts = {}
+
+    def count(self, name, rows):
+        """
+        Add rows to a counter.
+
+        Parameters:
+          name (str): name of the counter, e.g. zero_cost_removed
+          rows (int): number of rows
+        """
+        self.counts[name] = self.counts.get(name, 0) + int(rows)
+
+    def merge(self, counts):
+        """
+        Add the counters of another run of the rules, e.g. in a worker process.
+
+        Parameters:
+          counts (dict): counter name to number of rows
+        """
+        for name, rows in counts.items():
+            self.count(name, rows)
+
+    def log(self):
+        """Print the counters and log them as metrics of the active mlflow run."""
+        for name, rows in self.counts.items():
+            print("%s: %d" % (name, rows))
+        if self.counts:
+            mlflow.log_metrics(self.counts)
@@ -0,0 +1,216 @@
+"""
+This module declares the schema of the raw taxi data for each vendor.
+
+Each vendor publishes the same trip attributes under different column names. The registry maps
+every raw column that is kept to its name in the prepared data and to the dtype it is parsed with,
+so readers can project the raw files to the useful columns and skip type inference.
+The raw column names also identify the vendor of a file from its header alone.
+
+The module also holds the dtype plan of the transformed features. Small integer features are
+stored as int8, vendor as a category and measures as float32, the precision the raw coordinates
+are published with. Steps reading the features apply the plan, and widen the columns again
+only for the model so its signature doesn't change.
+"""
+
+from typing import NamedTuple
+import pandas as pd
+
+
+class ColumnSpec(NamedTuple):
+    """A raw column, the name it is renamed to and the dtype it is parsed with."""
+
+    source: str
+    target: str
+    dtype: str
+
+
+# Columns of the prepared data, in the order they are written
+USEFUL_COLUMNS = [
+    "cost",
+    "distance",
+    "dropoff_datetime",
+    "dropoff_latitude",
+    "dropoff_longitude",
+    "passengers",
+    "pickup_datetime",
+    "pickup_latitude",
+    "pickup_longitude",
+    "store_forward",
+    "vendor",
+]
+
+# Integer columns use nullable dtypes so missing values don't fail the parsing,
+# datetimes are kept as text and decomposed in the transform step.
+VENDOR_SCHEMAS = {
+    "green": [
+        ColumnSpec("vendorID", "vendor", "Int64"),
+        ColumnSpec("lpepPickupDatetime", "pickup_datetime", "str"),
+        ColumnSpec("lpepDropoffDatetime", "dropoff_datetime", "str"),
+        ColumnSpec("storeAndFwdFlag", "store_forward", "str"),
+        ColumnSpec("pickupLongitude", "pickup_longitude", "float64"),
+        ColumnSpec("pickupLatitude", "pickup_latitude", "float64"),
+        ColumnSpec("dropoffLongitude", "dropoff_longitude", "float64"),
+        ColumnSpec("dropoffLatitude", "dropoff_latitude", "float64"),
+        ColumnSpec("passengerCount", "passengers", "Int64"),
+        ColumnSpec("fareAmount", "cost", "float64"),
+        ColumnSpec("tripDistance", "distance", "float64"),
+    ],
+    "yellow": [
+        ColumnSpec("vendorID", "vendor", "Int64"),
+        ColumnSpec("tpepPickupDateTime", "pickup_datetime", "str"),
+        ColumnSpec("tpepDropoffDateTime", "dropoff_datetime", "str"),
+        ColumnSpec("storeAndFwdFlag", "store_forward", "str"),
+        ColumnSpec("startLon", "pickup_longitude", "float64"),
+        ColumnSpec("startLat", "pickup_latitude", "float64"),
+        ColumnSpec("endLon", "dropoff_longitude", "float64"),
+        ColumnSpec("endLat", "dropoff_latitude", "float64"),
+        ColumnSpec("passengerCount", "passengers", "Int64"),
+        ColumnSpec("fareAmount", "cost", "float64"),
+        ColumnSpec("tripDistance", "distance", "float64"),
+    ],
+}
+
+
+def read_options(vendor):
+    """
+    Build the read_csv arguments that project a raw file to the useful columns.
+
+    Parameters:
+      vendor (str): a key of VENDOR_SCHEMAS
+
+    Returns:
+      dict: usecols and dtype arguments for pandas.read_csv
+    """
+    schema = VENDOR_SCHEMAS[vendor]
+    return {
+        "usecols": [column.source for column in schema],
+        "dtype": {column.source: column.dtype for column in schema},
+    }
+
+
+def rename_map(vendor):
+    """
+    Map the raw column names of a vendor to the prepared column names.
+
+    Parameters:
+      vendor (str): a key of VENDOR_SCHEMAS
+
+    Returns:
+      dict: raw column name to prepared column name
+    """
+    return {column.source: column.target for column in VENDOR_SCHEMAS[vendor]}
+
+
+def detect_vendor(columns):
+    """
+    Find the vendor whose raw columns are all present in a file header.
+
+    Parameters:
+      columns (list): column names from the header of a raw file
+
+    Returns:
+      str: the matching key of VENDOR_SCHEMAS, or None when no vendor or several vendors match
+    """
+    header = set(columns)
+    matches = [
+        vendor
+        for vendor, schema in VENDOR_SCHEMAS.items()
+        if all(column.source in header for column in schema)
+    ]
+    return matches[0] if len(matches) == 1 else None
+
+
+# Features of the model, in the order it is trained and served with
+FEATURE_COLUMNS = [
+    "distance",
+    "dropoff_latitude",
+    "dropoff_longitude",
+    "passengers",
+    "pickup_latitude",
+    "pickup_longitude",
+    "store_forward",
+    "vendor",
+    "pickup_weekday",
+    "pickup_month",
+    "pickup_monthday",
+    "pickup_hour",
+    "pickup_minute",
+    "pickup_second",
+    "dropoff_weekday",
+    "dropoff_month",
+    "dropoff_monthday",
+    "dropoff_hour",
+    "dropoff_minute",
+    "dropoff_second",
+]
+
+# Dtype plan of the transformed features and of the columns derived from them
+FEATURE_DTYPES = {
+    "cost": "float32",
+    "actual_cost": "float32",
+    "distance": "float32",
+    "dropoff_latitude": "float32",
+    "dropoff_longitude": "float32",
+    "passengers": "int8",
+    "pickup_latitude": "float32",
+    "pickup_longitude": "float32",
+    "store_forward": "int8",
+    "vendor": "category",
+    "pickup_weekday": "int8",
+    "pickup_month": "int8",
+    "pickup_monthday": "int8",
+    "pickup_hour": "int8",
+    "pickup_minute": "int8",
+    "pickup_second": "int8",
+    "dropoff_weekday": "int8",
+    "dropoff_month": "int8",
+    "dropoff_monthday": "int8",
+    "dropoff_hour": "int8",
+    "dropoff_minute": "int8",
+    "dropoff_second": "int8",
+}
+
+
+def apply_dtype_plan(data, inplace=False):
+    """
+    Cast the columns of a data frame to the compact dtypes of FEATURE_DTYPES.
+
+    Parameters:
+      data (pandas.DataFrame): features in any dtypes, e.g. parsed from csv
+      inplace (bool): replace the columns one at a time instead of copying the whole frame
+
+    Returns:
+      DataFrame: the data with the planned columns downcast, other columns are kept as they are
+    """
+    plan = {
+        column: dtype
+        for column, dtype in FEATURE_DTYPES.items()
+        if column in data.columns and str(data[column].dtype) != dtype
+    }
+    if not inplace:
+        return data.astype(plan) if plan else data
+
+    for column, dtype in plan.items():
+        data[column] = data[column].astype(dtype)
+    return data
+
+
+def widen_features(data):
+    """
+    Widen compact features to the int64/float64 dtypes the model is trained and served with.
+
+    Parameters:
+      data (pandas.DataFrame): features cast with apply_dtype_plan
+
+    Returns:
+      DataFrame: the features with categories decoded and numbers widened to 64 bits
+    """
+    wide = {}
+    for column, dtype in data.dtypes.items():
+        if isinstance(dtype, pd.CategoricalDtype):
+            wide[column] = dtype.categories.dtype
+        elif dtype.kind in "iu" and dtype != "int64":
+            wide[column] = "int64"
+        elif dtype.kind == "f" and dtype != "float64":
+            wide[column] = "float64"
+    return data.astype(wide) if wide else data
@@ -0,0 +1,140 @@
+"""
+This module predicts the test set and scores the predictions in a single step.
+
+It is an optional replacement of the predict and score steps. The test set is predicted in chunks,
+optionally in several processes, and the metrics of each chunk are accumulated as its predictions
+are produced, then merged, so the predictions are neither written nor parsed again. The predictions
+file is written only when a format is given for it, and then holds only the row number, slice
+columns, prediction and actual cost of each test row. The predict and score steps remain the reference
+implementation: their functions are applied, so the score report is the same.
+"""
+
+import argparse
+from src.docker_taxi_src.common.compact_model import load_model
+from src.docker_taxi_src.common.data_io import DATA_FORMATS
+from src.docker_taxi_src.common.metrics import (
+    DEFAULT_BOOTSTRAP_MEMORY_MB,
+    DEFAULT_RESAMPLES,
+    DEFAULT_SLICE_CONFIG,
+    ScoreMetrics,
+)
+from src.docker_taxi_src.predict.predict import predict_chunked
+from src.docker_taxi_src.score.score import write_results
+
+# Number of test rows predicted at a time
+DEFAULT_CHUNK_SIZE = 100000
+
+
+def main(
+    model_input,
+    test_data,
+    score_report,
+    predictions=None,
+    prediction_format=None,
+    chunk_size=DEFAULT_CHUNK_SIZE,
+    max_workers=1,
+    slice_config=DEFAULT_SLICE_CONFIG,
+    resamples=DEFAULT_RESAMPLES,
+    bootstrap_memory_mb=DEFAULT_BOOTSTRAP_MEMORY_MB,
+):
+    """
+    Predict the test data and write the score report of the model.
+
+    Parameters:
+      model_input (str): an input folder with the model
+      test_data (str): test data folder
+      score_report (str): a folder for the score report
+      predictions (str): a folder for the predictions file
+      prediction_format (str): format of the predictions file, no file is written when not set
+      chunk_size (int): number of rows predicted at a time
+      max_workers (int): number of processes predicting chunks, 0 uses the number of cores
+      slice_config (str): slice config file, the test set is not sliced when not set
+      resamples (int): number of bootstrap resamples of the confidence intervals, none when 0
+      bootstrap_memory_mb (int): memory the bootstrap weights of a block of rows may take, in megabytes
+    """
+    lines = [
+        f"Model path: {model_input}",
+        f"Test data path: {test_data}",
+        f"Predictions path: {predictions if prediction_format else None}",
+        f"Scoring output path: {score_report}",
+    ]
+
+    for line in lines:
+        print(line)
+
+    metrics = ScoreMetrics(slice_config, resamples, bootstrap_memory_mb)
+    part_metrics = predict_chunked(
+        model_input,
+        test_data,
+        predictions if prediction_format else None,
+        chunk_size,
+        max_workers,
+        prediction_format,
+        metrics=metrics,
+        slice_config=slice_config,
+    )
+
+    # The metrics of the parts are merged in the order of the test rows
+    for part in part_metrics:
+        metrics.merge(part)
+    write_results(load_model(model_input), metrics, score_report)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser("predict_score")
+    parser.add_argument("--model_input", type=str, help="Path of input model")
+    parser.add_argument("--test_data", type=str, help="Path to test data")
+    parser.add_argument("--score_report", type=str, help="Path to score report")
+    parser.add_argument("--predictions", type=str, default=None, help="Path of predictions")
+    parser.add_argument(
+        "--prediction_format",
+        type=str,
+        choices=DATA_FORMATS,
+        default=None,
+        help="Format of the predictions file, no predictions file is written when not set",
+    )
+    parser.add_argument(
+        "--chunk_size",
+        type=int,
+        default=DEFAULT_CHUNK_SIZE,
+        help="Number of rows predicted at a time",
+    )
+    parser.add_argument(
+        "--max_workers",
+        type=int,
+        default=1,
+        help="Number of processes predicting chunks, 0 uses the number of cores",
+    )
+    parser.add_argument(
+        "--slice_config",
+        type=str,
+        default=DEFAULT_SLICE_CONFIG,
+        help="Slice config file, the test set is not sliced when set to an empty string",
+    )
+    parser.add_argument(
+        "--bootstrap_resamples",
+        type=int,
+        default=DEFAULT_RESAMPLES,
+        help="Number of bootstrap resamples of the confidence intervals of the metrics, none when 0",
+    )
+    parser.add_argument(
+        "--bootstrap_memory_mb",
+        type=int,
+        default=DEFAULT_BOOTSTRAP_MEMORY_MB,
+        help="Memory the bootstrap weights of a block of rows may take, in megabytes",
+    )
+
+    args = parser.parse_args()
+
+    main(
+        args.model_input,
+        args.test_data,
+        args.score_report,
+        args.predictions,
+        args.prediction_format,
+        args.chunk_size,
+        args.max_workers,
+        args.slice_config,
+        args.bootstrap_resamples,
+        args.bootstrap_memory_mb,
+    )
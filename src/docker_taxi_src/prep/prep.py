@@ -8,18 +8,68 @@ the datasets. The output is saved as prepared data files for subsequent analysis
 """
 
 import argparse
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 import os
+import time
 import pandas as pd
-
-
-def main(raw_data, prep_data):
+from src.docker_taxi_src.common.cache import cache_key, restore_outputs, store_outputs
+from src.docker_taxi_src.common.data_io import (
+    CSV_ENGINES,
+    DATA_FORMATS,
+    DataWriter,
+    read_data,
+    report_throughput,
+    set_reader_threads,
+    write_data,
+    write_index,
+)
+from src.docker_taxi_src.common.partitions import PartitionedWriter
+from src.docker_taxi_src.common.schema import (
+    USEFUL_COLUMNS,
+    VENDOR_SCHEMAS,
+    detect_vendor,
+    read_options,
+    rename_map,
+)
+
+# Version of the prep logic, increment it when a change alters the outputs to invalidate cached runs
+PREP_VERSION = "1"
+
+# Outputs prep can write, and the name of the file written for each of them
+PREP_OUTPUTS = {
+    "green": "green_prep_data",
+    "yellow": "yellow_prep_data",
+    "merged": "merged_data",
+}
+
+
+def main(
+    raw_data,
+    prep_data,
+    chunk_size=None,
+    data_format="csv",
+    max_workers=None,
+    outputs=("merged",),
+    cache_dir=None,
+    partitioned=False,
+    csv_engine="c",
+    reader_threads=None,
+):
     """
     Read existing csv files and invoke preprocessing step.
 
     Parameters:
-      raw_data (str): a folder to read csv files
+      raw_data (str): a folder to read csv files, other files are skipped
       prep_data (str): a folder for preprocessed data
+      chunk_size (int): number of raw rows to process at a time, reads whole files when not set
+      data_format (str): format of the preprocessed data files
+      max_workers (int): number of processes parsing raw files, defaults to the number of cores
+      outputs (list): names of PREP_OUTPUTS to write
+      cache_dir (str): a folder caching the outputs by raw data content, disabled when not set
+      partitioned (bool): write each output as a folder partitioned by vendor and pickup month
+      csv_engine (str): parser of the raw files when they are read whole, c or pyarrow
+      reader_threads (int): number of threads of the pyarrow reader in each process
     """
     print("hello training world...")
 
@@ -31,142 +81,310 @@ def main(raw_data, prep_data):
     for line in lines:
         print(line)
 
+    if cache_dir:
+        # Skip the step when the same raw data was already prepared
+        options = {
+            "data_format": data_format,
+            "outputs": sorted(outputs),
+            "partitioned": partitioned,
+            "csv_engine": csv_engine,
+        }
+        key = cache_key("prep", PREP_VERSION, raw_data, options)
+        if restore_outputs(cache_dir, key, prep_data):
+            return
+
+    shards = classify_shards(raw_data)
+
+    if chunk_size:
+        # Stream the green and yellow taxi data
+        data_prep_streaming(
+            shards["green"],
+            shards["yellow"],
+            prep_data,
+            chunk_size,
+            data_format,
+            outputs,
+            partitioned,
+        )
+    else:
+        # Prep the green and yellow taxi data
+        vendor_data = read_shards(shards, max_workers, csv_engine, reader_threads)
+        green_data = vendor_data["green"]
+        yellow_data = vendor_data["yellow"]
+
+        data_prep(
+            green_data, yellow_data, prep_data, data_format, outputs, partitioned
+        )
+
+    if cache_dir:
+        store_outputs(cache_dir, key, prep_data)
+
+
+def classify_shards(raw_data):
+    """
+    Group the raw files by vendor using the column names in their header.
+
+    Parameters:
+      raw_data (str): a folder to read csv files, other files are skipped
+
+    Returns:
+      dict: vendor name to the sorted list of its raw files
+    """
     print("mounted_path files: ")
-    arr = os.listdir(raw_data)
+    arr = sorted(os.listdir(raw_data))
     print(arr)
 
-    df_list = []
+    shards = {vendor: [] for vendor in VENDOR_SCHEMAS}
     for filename in arr:
-        print("reading file: %s ..." % filename)
-        input_df = pd.read_csv((Path(raw_data) / filename))
-        df_list.append(input_df)
+        path = Path(raw_data) / filename
+        if path.suffix.lower() != ".csv" or not path.is_file():
+            print("skipping non csv file: %s" % filename)
+            continue
+        vendor = detect_vendor(pd.read_csv(path, nrows=0).columns)
+        if vendor is None:
+            print("skipping file with unknown header: %s" % filename)
+            continue
+        print("%s file: %s" % (vendor, filename))
+        shards[vendor].append(path)
+
+    return shards
 
-    # Prep the green and yellow taxi data
-    green_data = df_list[0]
-    yellow_data = df_list[1]
 
-    data_prep(green_data, yellow_data, prep_data)
+def read_shard(path, vendor, csv_engine="c", reader_threads=None):
+    """
+    Read the useful columns of a raw file with the dtypes declared in the vendor schema.
+
+    Parameters:
+      path (Path): raw csv file
+      vendor (str): the vendor schema of the file
+      csv_engine (str): parser of the file, c or pyarrow
+      reader_threads (int): number of threads of the pyarrow reader
+
+    Returns:
+      DataFrame: the projected raw data
+    """
+    print("reading file: %s ..." % path)
+    set_reader_threads(reader_threads)
+    return read_data(path, csv_engine, **read_options(vendor))
 
 
-def data_prep(green_data, yellow_data, prep_data):
+def read_shards(shards, max_workers=None, csv_engine="c", reader_threads=None):
+    """
+    Parse all raw files concurrently, one process per file.
+
+    Parameters:
+      shards (dict): vendor name to the list of its raw files
+      max_workers (int): number of processes, defaults to the number of cores
+      csv_engine (str): parser of the files, c or pyarrow
+      reader_threads (int): number of threads of the pyarrow reader in each process
+
+    Returns:
+      dict: vendor name to the concatenated raw data of its files, in file name order
+    """
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            vendor: [
+                executor.submit(read_shard, path, vendor, csv_engine, reader_threads)
+                for path in paths
+            ]
+            for vendor, paths in shards.items()
+        }
+        vendor_data = {
+            vendor: concat_shards([future.result() for future in vendor_futures], vendor)
+            for vendor, vendor_futures in futures.items()
+        }
+
+    rows = sum(len(data) for data in vendor_data.values())
+    report_throughput(rows, time.perf_counter() - start, "raw files")
+    return vendor_data
+
+
+def concat_shards(frames, vendor):
+    """
+    Concatenate the raw data of several files of a vendor.
+
+    Parameters:
+      frames (list): data frames read with the vendor schema
+      vendor (str): the vendor schema of the files
+
+    Returns:
+      DataFrame: the concatenated data, empty with the schema columns when there are no files
+    """
+    if not frames:
+        options = read_options(vendor)
+        return pd.DataFrame(
+            {
+                column: pd.Series(dtype=options["dtype"][column])
+                for column in options["usecols"]
+            }
+        )
+    if len(frames) == 1:
+        return frames[0]
+    return pd.concat(frames, ignore_index=True)
+
+
+def data_prep(
+    green_data,
+    yellow_data,
+    prep_data,
+    data_format="csv",
+    outputs=("merged",),
+    partitioned=False,
+):
     """
     Merge two data sets for different taxi vendors.
 
     The method maps columns in two data sets and remove distinct columns
-     saving results as a csv file.
+     saving the requested outputs and an index file naming them.
 
     Parameters:
       green_data (pandas.DataFrame): incoming data frame for green taxi
       yellow_data (pandas.DataFrame): incoming data frame for yellow taxi
       prep_data (str): a folder for preprocessed data
+      data_format (str): format of the preprocessed data files
+      outputs (list): names of PREP_OUTPUTS to write
+      partitioned (bool): write each output as a folder partitioned by vendor and pickup month
     """
-    # Define useful columns needed for the Azure Machine Learning London Taxi tutorial
-    useful_columns = str(
-        [
-            "cost",
-            "distance",
-            "dropoff_datetime",
-            "dropoff_latitude",
-            "dropoff_longitude",
-            "passengers",
-            "pickup_datetime",
-            "pickup_latitude",
-            "pickup_longitude",
-            "store_forward",
-            "vendor",
-        ]
-    ).replace(",", ";")
-    print(useful_columns)
-
-    # Rename columns as per Azure Machine Learning London Taxi tutorial
-    green_columns = str(
-        {
-            "vendorID": "vendor",
-            "lpepPickupDatetime": "pickup_datetime",
-            "lpepDropoffDatetime": "dropoff_datetime",
-            "storeAndFwdFlag": "store_forward",
-            "pickupLongitude": "pickup_longitude",
-            "pickupLatitude": "pickup_latitude",
-            "dropoffLongitude": "dropoff_longitude",
-            "dropoffLatitude": "dropoff_latitude",
-            "passengerCount": "passengers",
-            "fareAmount": "cost",
-            "tripDistance": "distance",
-        }
-    ).replace(",", ";")
-
-    yellow_columns = str(
-        {
-            "vendorID": "vendor",
-            "tpepPickupDateTime": "pickup_datetime",
-            "tpepDropoffDateTime": "dropoff_datetime",
-            "storeAndFwdFlag": "store_forward",
-            "startLon": "pickup_longitude",
-            "startLat": "pickup_latitude",
-            "endLon": "dropoff_longitude",
-            "endLat": "dropoff_latitude",
-            "passengerCount": "passengers",
-            "fareAmount": "cost",
-            "tripDistance": "distance",
-        }
-    ).replace(",", ";")
+    prepared = {
+        "green": cleansedata(green_data, "green"),
+        "yellow": cleansedata(yellow_data, "yellow"),
+    }
+
+    if "merged" in outputs:
+        # Append yellow data to green data
+        combined_df = pd.concat(
+            [prepared["green"], prepared["yellow"]], ignore_index=True
+        )
+        combined_df.reset_index(inplace=True, drop=True)
+        prepared["merged"] = combined_df
+
+    written = {}
+    for name in outputs:
+        if partitioned:
+            writer = PartitionedWriter(prep_data, PREP_OUTPUTS[name], data_format)
+            writer.write(prepared[name])
+            writer.close()
+            path = writer.path
+        else:
+            path = write_data(prepared[name], prep_data, PREP_OUTPUTS[name], data_format)
+        written[name] = path.name
+    write_index(prep_data, written)
+
+    print("Finish")
 
-    print("green_columns: " + green_columns)
-    print("yellow_columns: " + yellow_columns)
 
-    green_data_clean = cleansedata(green_data, green_columns, useful_columns)
-    yellow_data_clean = cleansedata(yellow_data, yellow_columns, useful_columns)
+def data_prep_streaming(
+    green_files,
+    yellow_files,
+    prep_data,
+    chunk_size,
+    data_format="csv",
+    outputs=("merged",),
+    partitioned=False,
+):
+    """
+    Merge two data sets for different taxi vendors reading them in bounded chunks.
 
-    # Append yellow data to green data
-    combined_df = pd.concat([green_data_clean, yellow_data_clean], ignore_index=True)
-    combined_df.reset_index(inplace=True, drop=True)
+    Produces the same files as data_prep, but only holds one chunk of raw data in memory
+    at a time. Each cleaned chunk is appended to the vendor file and to the merged file.
+    Outputs that got no rows, e.g. a vendor without raw files, are left out of the index.
 
-    green_data_clean.to_csv(os.path.join(prep_data, "green_prep_data.csv"))
-    yellow_data_clean.to_csv(os.path.join(prep_data, "yellow_prep_data.csv"))
-    combined_df.to_csv(os.path.join(prep_data, "merged_data.csv"))
+    Parameters:
+      green_files (list): raw csv files for green taxi
+      yellow_files (list): raw csv files for yellow taxi
+      prep_data (str): a folder for preprocessed data
+      chunk_size (int): number of raw rows to read at a time
+      data_format (str): format of the preprocessed data files
+      outputs (list): names of PREP_OUTPUTS to write
+      partitioned (bool): write each output as a folder partitioned by vendor and pickup month
+    """
+    writers = {
+        name: output_writer(prep_data, name, data_format, partitioned)
+        for name in outputs
+    }
+    start = time.perf_counter()
+    raw_rows = 0
+    for raw_files, vendor in [(green_files, "green"), (yellow_files, "yellow")]:
+        targets = [writers[name] for name in [vendor, "merged"] if name in writers]
+        for raw_file in raw_files:
+            print("streaming file: %s ..." % raw_file)
+            for chunk in pd.read_csv(
+                raw_file, chunksize=chunk_size, **read_options(vendor)
+            ):
+                raw_rows += len(chunk)
+                clean_chunk = cleansedata(chunk, vendor)
+                for writer in targets:
+                    writer.write(clean_chunk)
+    report_throughput(raw_rows, time.perf_counter() - start, "raw files")
+
+    written = {}
+    for name, writer in writers.items():
+        writer.close()
+        print("%s: %d rows" % (writer.path.name, writer.rows))
+        # A writer creates its file with the first rows, outputs without rows aren't indexed
+        if writer.rows:
+            written[name] = writer.path.name
+    write_index(prep_data, written)
 
     print("Finish")
 
 
-# These functions ensure that null data is removed from the dataset,
-# which will help increase machine learning model accuracy.
-def get_dict(dict_str):
+def output_writer(prep_data, name, data_format, partitioned=False):
+    """
+    Create the writer of a prep output.
+
+    Parameters:
+      prep_data (str): a folder for preprocessed data
+      name (str): a name of PREP_OUTPUTS
+      data_format (str): format of the preprocessed data files
+      partitioned (bool): write a folder partitioned by vendor and pickup month instead of one file
+
+    Returns:
+      DataWriter or PartitionedWriter: the writer of the output
     """
-    Ensure that null data is removed from the dataset to increase machine learning model accuracy.
+    if partitioned:
+        return PartitionedWriter(prep_data, PREP_OUTPUTS[name], data_format)
+    return DataWriter(prep_data, PREP_OUTPUTS[name], data_format)
+
+
+def parse_outputs(value):
+    """
+    Parse a comma separated list of prep outputs.
 
     Parameters:
-      dict_str (Dictionary): a string with separated elements
+      value (str): names of PREP_OUTPUTS separated by commas
 
     Returns:
-      Dictionary: an updated dictionary
+      list: the output names
     """
-    pairs = dict_str.strip("{}").split(";")
-    new_dict = {}
-    for pair in pairs:
-        print(pair)
-        key, value = pair.strip().split(":")
-        new_dict[key.strip().strip("'")] = value.strip().strip("'")
-    return new_dict
+    outputs = [name.strip() for name in value.split(",") if name.strip()]
+    unknown = [name for name in outputs if name not in PREP_OUTPUTS]
+    if unknown or not outputs:
+        raise argparse.ArgumentTypeError(
+            f"Outputs must be a subset of {list(PREP_OUTPUTS)}, got: {value}"
+        )
+    return outputs
+
+
+# These functions ensure that null data is removed from the dataset,
+# which will help increase machine learning model accuracy.
 
 
-def cleansedata(data, columns, useful_columns):
+def cleansedata(data, vendor):
     """
     Clean dataset removing NA values.
 
     Parameters:
-      data (pandas.DataFrame): initial data
-      columns (str): a list of columns in initial dataset
-      useful_columns (str): columns to retain
+      data (pandas.DataFrame): initial data read with the vendor schema
+      vendor (str): the vendor schema used to rename the columns
 
     Returns:
       DataFrame: an updated data set
     """
-    useful_columns = [
-        s.strip().strip("'") for s in useful_columns.strip("[]").split(";")
+    new_df = (data.dropna(how="all").rename(columns=rename_map(vendor)))[
+        USEFUL_COLUMNS
     ]
-    new_columns = get_dict(columns)
-
-    new_df = (data.dropna(how="all").rename(columns=new_columns))[useful_columns]
 
     new_df.reset_index(inplace=True, drop=True)
     return new_df
@@ -183,7 +401,70 @@ if __name__ == "__main__":
     parser.add_argument(
         "--prep_data", type=str, default="../data/prep_data", help="Path to prep data"
     )
+    parser.add_argument(
+        "--chunk_size",
+        type=int,
+        default=None,
+        help="Number of raw rows to process at a time, enables streaming mode",
+    )
+    parser.add_argument(
+        "--data_format",
+        type=str,
+        choices=DATA_FORMATS,
+        default="csv",
+        help="Format of the data written for the next step",
+    )
+    parser.add_argument(
+        "--max_workers",
+        type=int,
+        default=None,
+        help="Number of processes parsing raw files, defaults to the number of cores",
+    )
+    parser.add_argument(
+        "--outputs",
+        type=parse_outputs,
+        default=["merged"],
+        help="Comma separated outputs to write: green, yellow, merged",
+    )
+    parser.add_argument(
+        "--cache_dir",
+        type=str,
+        default=None,
+        help="Local folder caching outputs by input content for runs on the same machine, "
+        "disabled when not set",
+    )
+    parser.add_argument(
+        "--output_layout",
+        type=str,
+        choices=["file", "partitioned"],
+        default="file",
+        help="Write each output as one file, or partitioned by vendor and pickup year/month",
+    )
+    parser.add_argument(
+        "--csv_engine",
+        type=str,
+        choices=CSV_ENGINES,
+        default="c",
+        help="Parser of raw csv files, pyarrow parses with multiple threads, streaming always uses c",
+    )
+    parser.add_argument(
+        "--reader_threads",
+        type=int,
+        default=None,
+        help="Number of threads of the pyarrow reader in each process, defaults to the number of cores",
+    )
 
     args = parser.parse_args()
 
-    main(args.raw_data, args.prep_data)
+    main(
+        args.raw_data,
+        args.prep_data,
+        args.chunk_size,
+        args.data_format,
+        args.max_workers,
+        args.outputs,
+        args.cache_dir,
+        args.output_layout == "partitioned",
+        args.csv_engine,
+        args.reader_threads,
+    )
@@ -0,0 +1,241 @@
+"""
+This module exports linear taxi models as a compact file that is loaded without scikit-learn.
+
+The file is a .npy array holding a single record: the intercept, then the coefficient of each
+input feature of the model, named after the feature. A model fitted on a subset of the features
+gets a zero coefficient for the others, so the file always takes the full feature rows. Loading
+the file memory-maps it: no pickle is executed, scikit-learn isn't imported, and a prediction is
+a single matrix product.
+
+Run as a script, the module benchmarks the time to load a model and to make its first prediction
+from the pickle and from the compact file, each in a fresh interpreter so the imports are
+counted, and checks that both predict the same.
+"""
+
+import argparse
+import json
+from pathlib import Path
+import subprocess
+import sys
+import numpy as np
+
+COMPACT_MODEL_FILE = "model.npy"
+PICKLE_MODEL_FILE = "model.sav"
+
+# The benchmark interpreters import this package from the root of the repository
+REPO_ROOT = Path(__file__).parents[3]
+
+# Loaders timed by the benchmark, {path} is the model file
+LOADERS = {
+    "pickle": "import pickle\nmodel = pickle.load(open({path!r}, 'rb'))",
+    "compact": "from src.london_src.common.compact_model import CompactModel\nmodel = CompactModel({path!r})",
+}
+
+BENCHMARK_SCRIPT = """
+import json
+import time
+import warnings
+import pandas as pd
+warnings.filterwarnings("ignore")
+features = pd.DataFrame([[1.0] * {features}], columns={columns!r})
+start = time.perf_counter()
+{loader}
+loaded = time.perf_counter()
+model.predict(features)
+predicted = time.perf_counter()
+print(json.dumps({{"load_seconds": loaded - start, "first_prediction_seconds": predicted - loaded}}))
+"""
+
+
+class CompactModel:
+    """A linear model loaded from a compact file, predicting like the scikit-learn model it was exported from."""
+
+    def __init__(self, path):
+        """
+        Memory-map a compact model file.
+
+        Parameters:
+          path (str): file written by export_compact_model
+        """
+        record = np.load(path, mmap_mode="r")
+        weights = record.view("float64")
+        self.feature_names_in_ = np.array(record.dtype.names[1:], dtype=object)
+        self.intercept_ = weights[0]
+        self.coef_ = weights[1:]
+
+    def predict(self, features):
+        """
+        Predict the cost of trips.
+
+        Parameters:
+          features (pandas.DataFrame or numpy.ndarray): the input features of the model, a data frame
+            may hold other columns and the features in any order
+
+        Returns:
+          numpy.ndarray: the predictions
+        """
+        if hasattr(features, "columns"):
+            features = features[list(self.feature_names_in_)]
+        return np.asarray(features, dtype="float64") @ self.coef_ + self.intercept_
+
+    def __repr__(self):
+        """Describe the model."""
+        return "CompactModel(features=%d)" % len(self.coef_)
+
+
+def linear_weights(model):
+    """
+    Get the intercept and the coefficient of each input feature of a linear model.
+
+    Parameters:
+      model (estimator): a fitted model, possibly a pipeline selecting the features of its last step
+
+    Returns:
+      (float, pandas.Series): the intercept and the coefficients indexed by input feature, None when
+        the model is not linear or was not fitted on named features
+    """
+    import pandas as pd
+
+    estimator = model.steps[-1][1] if hasattr(model, "steps") else model
+    coef = getattr(estimator, "coef_", None)
+    names = getattr(model, "feature_names_in_", None)
+    if coef is None or names is None or np.ndim(coef) != 1:
+        return None
+
+    used = model[:-1].get_feature_names_out() if hasattr(model, "steps") else names
+    coefficients = pd.Series(0.0, index=list(names))
+    coefficients[list(used)] = coef
+    return float(estimator.intercept_), coefficients
+
+
+def export_compact_model(model, model_output, check_rows=1000):
+    """
+    Write the compact file of a linear model and check it predicts like the model.
+
+    Parameters:
+      model (estimator): the fitted model
+      model_output (str): a folder to store model files
+      check_rows (int): number of random feature rows the predictions are compared on
+
+    Returns:
+      Path: the written file, None when the model is not linear
+    """
+    import pandas as pd
+
+    weights = linear_weights(model)
+    if weights is None:
+        print("the model is not linear, no compact model is exported")
+        return None
+
+    intercept, coefficients = weights
+    dtype = [("intercept", "float64")] + [(name, "float64") for name in coefficients.index]
+    record = np.array([(intercept, *coefficients)], dtype=dtype)
+    path = Path(model_output) / COMPACT_MODEL_FILE
+    np.save(path, record)
+
+    # A linear function is checked on any input, the random rows cover every coefficient
+    rows = np.random.default_rng(0).normal(size=(check_rows, len(coefficients)))
+    features = pd.DataFrame(rows, columns=coefficients.index)
+    expected = model.predict(features)
+    predictions = CompactModel(path).predict(features)
+    difference = np.abs(predictions - expected).max()
+    print("compact model max prediction difference: %g" % difference)
+    if not np.allclose(predictions, expected):
+        raise ValueError(f"The compact model predicts differently from the model, up to {difference}")
+    return path
+
+
+def load_model(model_input):
+    """
+    Load a model, from its compact file when it was exported, from its pickle otherwise.
+
+    Parameters:
+      model_input (str): a folder with the model files
+
+    Returns:
+      CompactModel or estimator: the model
+    """
+    path = Path(model_input) / COMPACT_MODEL_FILE
+    if path.is_file():
+        return CompactModel(path)
+
+    import pickle
+
+    with open(Path(model_input) / PICKLE_MODEL_FILE, "rb") as model_file:
+        return pickle.load(model_file)
+
+
+def benchmark(model_input, repeat=5):
+    """
+    Time loading a model and its first prediction from the pickle and from the compact file.
+
+    Each measure runs in a fresh interpreter, the best of several runs is kept.
+
+    Parameters:
+      model_input (str): a folder with both model files
+      repeat (int): number of runs of each loader
+
+    Returns:
+      dict: loader name to its load_seconds and first_prediction_seconds
+    """
+    compact = CompactModel(Path(model_input) / COMPACT_MODEL_FILE)
+    columns = list(compact.feature_names_in_)
+    files = {"pickle": PICKLE_MODEL_FILE, "compact": COMPACT_MODEL_FILE}
+
+    timings = {}
+    for name, loader in LOADERS.items():
+        script = BENCHMARK_SCRIPT.format(
+            features=len(columns),
+            columns=columns,
+            loader=loader.format(path=str(Path(model_input) / files[name])),
+        )
+        runs = [
+            json.loads(
+                subprocess.run(
+                    [sys.executable, "-c", script], capture_output=True, check=True, cwd=REPO_ROOT
+                ).stdout
+            )
+            for _ in range(repeat)
+        ]
+        timings[name] = {measure: min(run[measure] for run in runs) for measure in runs[0]}
+        print(
+            "%s: load %.1f ms, first prediction %.2f ms"
+            % (name, timings[name]["load_seconds"] * 1000, timings[name]["first_prediction_seconds"] * 1000)
+        )
+    return timings
+
+
+def check_equivalence(model_input, features):
+    """
+    Compare the predictions of the pickle and of the compact file of a model.
+
+    Parameters:
+      model_input (str): a folder with both model files
+      features (pandas.DataFrame): input features
+
+    Returns:
+      float: the largest absolute difference between the predictions
+    """
+    import pickle
+
+    with open(Path(model_input) / PICKLE_MODEL_FILE, "rb") as model_file:
+        model = pickle.load(model_file)
+    compact = CompactModel(Path(model_input) / COMPACT_MODEL_FILE)
+    difference = np.abs(compact.predict(features) - model.predict(features)).max()
+    print("max prediction difference on %d rows: %g" % (len(features), difference))
+    return difference
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser("compact_model")
+    parser.add_argument("--model_input", type=str, help="Path of the model with both model files")
+    parser.add_argument("--test_data", type=str, default=None, help="Path to test data to compare predictions on")
+    parser.add_argument("--repeat", type=int, default=5, help="Number of runs of each loader")
+    args = parser.parse_args()
+
+    benchmark(args.model_input, args.repeat)
+    if args.test_data:
+        from src.london_src.predict.predict import load_test_data
+
+        test_x, _ = load_test_data(args.test_data)
+        check_equivalence(args.model_input, test_x)
@@ -0,0 +1,138 @@
+"""
+This module fits an ordinary least squares regression from statistics accumulated chunk by chunk.
+
+The statistics of a set of rows are its row count, the means of the features and of the label,
+and the sums of products of the centered values, i.e. XᵀX and Xᵀy of the centered data. The
+statistics of chunks, files or worker processes are merged with the pairwise update of Chan et
+al., so they don't depend on how the rows were split, and only one chunk is in memory at a time.
+Centering keeps the normal equations well conditioned. They are solved with the pseudo inverse,
+which, like the least squares solver of LinearRegression, gives the minimum norm solution when
+features are constant or collinear.
+"""
+
+import numpy as np
+
+
+class LeastSquares:
+    """Mergeable sufficient statistics of a linear regression with an intercept."""
+
+    def __init__(self, features):
+        """
+        Initialize the statistics of an empty set of rows.
+
+        Parameters:
+          features (int): number of features
+        """
+        self.rows = 0
+        self.mean_x = np.zeros(features)
+        self.mean_y = 0.0
+        self.xx = np.zeros((features, features))
+        self.xy = np.zeros(features)
+        self.yy = 0.0
+
+    def update(self, x, y):
+        """
+        Add a chunk of rows.
+
+        Parameters:
+          x (numpy.ndarray): features, one row per sample
+          y (numpy.ndarray): labels
+        """
+        x = np.asarray(x, dtype="float64")
+        y = np.asarray(y, dtype="float64")
+        chunk = LeastSquares(self.mean_x.shape[0])
+        chunk.rows = len(x)
+        if chunk.rows == 0:
+            return
+
+        chunk.mean_x = x.mean(axis=0)
+        chunk.mean_y = y.mean()
+        centered_x = x - chunk.mean_x
+        centered_y = y - chunk.mean_y
+        chunk.xx = centered_x.T @ centered_x
+        chunk.xy = centered_x.T @ centered_y
+        chunk.yy = centered_y @ centered_y
+        self.merge(chunk)
+
+    def merge(self, other):
+        """
+        Add the statistics of other rows, e.g. computed by another process.
+
+        Parameters:
+          other (LeastSquares): statistics with the same features
+        """
+        if other.rows == 0:
+            return
+
+        rows = self.rows + other.rows
+        weight = self.rows * other.rows / rows
+        delta_x = other.mean_x - self.mean_x
+        delta_y = other.mean_y - self.mean_y
+        self.xx = self.xx + other.xx + np.outer(delta_x, delta_x) * weight
+        self.xy = self.xy + other.xy + delta_x * delta_y * weight
+        self.yy = self.yy + other.yy + delta_y * delta_y * weight
+        self.mean_x = self.mean_x + delta_x * other.rows / rows
+        self.mean_y = self.mean_y + delta_y * other.rows / rows
+        self.rows = rows
+
+    def solve(self):
+        """
+        Solve the normal equations.
+
+        Returns:
+          (numpy.ndarray, float): the coefficients and the intercept
+        """
+        if self.rows == 0:
+            raise ValueError("No rows to fit the regression with")
+        coef = np.linalg.pinv(self.xx, hermitian=True) @ self.xy
+        intercept = self.mean_y - self.mean_x @ coef
+        return coef, intercept
+
+    def r2_score(self, coef):
+        """
+        Compute the coefficient of determination of coefficients on the accumulated rows.
+
+        Parameters:
+          coef (numpy.ndarray): coefficients, the intercept is the one of solve
+
+        Returns:
+          float: the R² score
+        """
+        residual = self.yy - 2 * coef @ self.xy + coef @ self.xx @ coef
+        return 1 - residual / self.yy
+
+    def to_dict(self):
+        """
+        Convert the statistics into json serializable values.
+
+        Returns:
+          dict: the statistics, floats are kept exactly by json
+        """
+        return {
+            "rows": self.rows,
+            "mean_x": self.mean_x.tolist(),
+            "mean_y": float(self.mean_y),
+            "xx": self.xx.tolist(),
+            "xy": self.xy.tolist(),
+            "yy": float(self.yy),
+        }
+
+    @classmethod
+    def from_dict(cls, values):
+        """
+        Restore statistics converted with to_dict.
+
+        Parameters:
+          values (dict): the converted statistics
+
+        Returns:
+          LeastSquares: the statistics
+        """
+        statistics = cls(len(values["mean_x"]))
+        statistics.rows = values["rows"]
+        statistics.mean_x = np.array(values["mean_x"], dtype="float64")
+        statistics.mean_y = values["mean_y"]
+        statistics.xx = np.array(values["xx"], dtype="float64")
+        statistics.xy = np.array(values["xy"], dtype="float64")
+        statistics.yy = values["yy"]
+        return statistics
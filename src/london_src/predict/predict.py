@@ -9,22 +9,62 @@ values for further analysis.
 The module can be executed as a script with command-line arguments specifying paths for the model,
 test data, and the location to save predictions. It is designed to be used in a machine learning
 operations (MLOps) context, where automated scoring of models is a key step in the model evaluation process.
+
+With a chunk size, the test set is instead predicted in chunks, optionally in several processes,
+and only the row number, the slice columns, prediction and actual cost of each test row are written,
+so memory is bounded by the chunk size and the step stays bound by reading the test data. Csv test
+data is read once, sequentially, and its chunks are handed to the workers, parquet test data is read
+by the workers a range of row groups each. The row number, row_id, is the position of the row in the
+test set, the test data files following each other in path order.
 """
 
 import argparse
-import pandas as pd
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import copy
+from functools import lru_cache, partial
 import os
-from pathlib import Path
-import pickle
+import time
+import numpy as np
+import pandas as pd
+from src.london_src.common.compact_model import load_model
+from src.london_src.common.data_io import (
+    CSV_ENGINES,
+    DATA_FORMATS,
+    dataset_files,
+    read_data_chunks,
+    read_dataset,
+    read_row_groups,
+    row_group_parts,
+    write_data,
+)
+from src.london_src.common.metrics import DEFAULT_SLICE_CONFIG, load_slice_config
+from src.london_src.common.schema import FEATURE_COLUMNS, apply_dtype_plan, widen_features
 
 
-def main(model_input, test_data, prediction_path):
+def main(
+    model_input,
+    test_data,
+    prediction_path,
+    data_format="csv",
+    csv_engine="c",
+    reader_threads=None,
+    chunk_size=None,
+    max_workers=1,
+    slice_config=DEFAULT_SLICE_CONFIG,
+):
     """Load test data, call predict function.
 
     Args:
-        model_input (string): path to model pickle file
+        model_input (string): path to the model folder
         test_data (string): path to test data
         prediction_path (string): path to which to write prediction
+        data_format (string): format of the predictions file
+        csv_engine (string): parser of csv files, c or pyarrow
+        reader_threads (int): number of threads of the pyarrow readers, defaults to the number of cores
+        chunk_size (int): number of rows predicted at a time, predicts all rows at once when not set
+        max_workers (int): number of processes predicting chunks, 0 uses the number of cores
+        slice_config (string): slice config file, whose columns are written with chunked predictions
     """
     lines = [
         f"Model path: {model_input}",
@@ -35,86 +75,218 @@ def main(model_input, test_data, prediction_path):
     for line in lines:
         print(line)
 
-    test_x, testy = load_test_data(test_data)
-    predict(test_x, testy, model_input, prediction_path)
+    if chunk_size:
+        predict_chunked(
+            model_input, test_data, prediction_path, chunk_size, max_workers, data_format, slice_config=slice_config
+        )
+        return
+
+    test_x, testy = load_test_data(test_data, csv_engine, reader_threads)
+    predict(test_x, testy, model_input, prediction_path, data_format)
 
 
 # Load and split the test data
-def load_test_data(test_data):
+def load_test_data(test_data, csv_engine="c", reader_threads=None):
     """
     Load test data and store it in two data frames.
 
     Parameters:
       test_data (pandas.DataFrame): input data
+      csv_engine (str): parser of csv files, c or pyarrow
+      reader_threads (int): number of threads of the pyarrow readers, defaults to the number of cores
 
     Returns:
       (DataFrame, DataFrame): input data with no expected results and expected results in te second frame
     """
-    print("mounted_path files: ")
-    arr = os.listdir(test_data)
-
-    print(arr)
-    df_list = []
-    for filename in arr:
-        print("reading file: %s ..." % filename)
-        input_df = pd.read_csv((Path(test_data) / filename))
-        df_list.append(input_df)
-
-    test_data = df_list[0]
+    test_data = apply_dtype_plan(read_dataset(test_data, csv_engine, reader_threads))
     testy = test_data["cost"]
-    test_x = test_data[
-        [
-            "distance",
-            "dropoff_latitude",
-            "dropoff_longitude",
-            "passengers",
-            "pickup_latitude",
-            "pickup_longitude",
-            "store_forward",
-            "vendor",
-            "pickup_weekday",
-            "pickup_month",
-            "pickup_monthday",
-            "pickup_hour",
-            "pickup_minute",
-            "pickup_second",
-            "dropoff_weekday",
-            "dropoff_month",
-            "dropoff_monthday",
-            "dropoff_hour",
-            "dropoff_minute",
-            "dropoff_second",
-        ]
-    ]
+    test_x = test_data[FEATURE_COLUMNS]
     print(test_x.shape)
     print(test_x.columns)
     return test_x, testy
 
 
-def predict(test_x, testy, model_input, prediction_path):
+def predict(test_x, testy, model_input, prediction_path, data_format="csv"):
     """
-    Predict results on a batch and save them into csv file altogether wit expected results.
+    Predict results on a batch and save them into a file altogether wit expected results.
 
     Parameters:
       test_x (pandas.DataFrame): input data to predict
       testy (pandas.DataFrame): expected results
       model_input (str): an input folder with the model
       prediction_path (str): a resulting folder
+      data_format (str): format of the predictions file
     """
     # Load the model from input port
-    model = pickle.load(open((Path(model_input) / "model.sav"), "rb"))
+    model = load_model(model_input)
 
     # Make predictions on test_x data and record them in a column named predicted_cost
-    predictions = model.predict(test_x)
-    test_x["predicted_cost"] = predictions
-    print(test_x.shape)
+    predictions = model.predict(widen_features(test_x))
 
     # Compare predictions to actuals (testy)
-    output_data = pd.DataFrame(test_x)
-    output_data["actual_cost"] = testy
+    output_data = test_x.assign(predicted_cost=predictions, actual_cost=testy)
+    print(output_data.shape)
+
+    # Save the output data with feature columns, predicted cost, and actual cost
+    write_data(output_data, prediction_path, "predictions", data_format)
+
+
+def predict_chunked(
+    model_input,
+    test_data,
+    prediction_path,
+    chunk_size,
+    max_workers=1,
+    data_format="csv",
+    metrics=None,
+    slice_config=DEFAULT_SLICE_CONFIG,
+):
+    """
+    Predict the test set in chunks and save the row number, slice columns, prediction and actual cost of each row.
+
+    The test set is split into parts by prediction_parts, each job predicts a part and writes its own
+    predictions file. The jobs run in parallel with several workers.
+
+    Parameters:
+      model_input (str): an input folder with the model
+      test_data (str): test data folder
+      prediction_path (str): a resulting folder, no predictions file is written when not set
+      chunk_size (int): number of rows predicted at a time
+      max_workers (int): number of processes, 0 uses the number of cores
+      data_format (str): format of the predictions files
+      metrics (ScoreMetrics): empty metrics each job accumulates its rows into a copy of, the jobs
+        are not evaluated when not set
+      slice_config (str): slice config file, whose columns are written
+
+    Returns:
+      list: the ScoreMetrics of each job when evaluating, None otherwise
+    """
+    start = time.perf_counter()
+    parts = prediction_parts(test_data, chunk_size)
+    predict_job = partial(predict_part, model_input, prediction_path, data_format, metrics, slice_config)
+    workers = max_workers or os.cpu_count()
+    if workers == 1:
+        results = [predict_job(*part) for part in parts]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            # The parts read in this process wait for a worker, at most two per worker are kept in memory
+            results = list(ordered_results(executor, predict_job, parts, 2 * workers))
+
+    rows = sum(part_rows for part_rows, _ in results)
+    seconds = time.perf_counter() - start
+    rate = rows / seconds if seconds > 0 else float("inf")
+    print(
+        "predicted %d rows in %d jobs with %d workers in %.2fs (%.0f rows/sec)"
+        % (rows, len(results), workers, seconds, rate)
+    )
+    return [part_metrics for _, part_metrics in results]
+
+
+def prediction_parts(test_data, chunk_size):
+    """
+    Split the test set into the parts predicted by predict_part.
+
+    A csv file is read once, sequentially, in chunks that are the parts. A parquet file is split
+    into ranges of row groups, which the jobs read themselves.
+
+    Parameters:
+      test_data (str): test data folder
+      chunk_size (int): number of rows predicted at a time
+
+    Yields:
+      (int, int, DataFrame or tuple): the part number, the position of its first row in the test
+        set, and its rows or the parquet file and row group numbers holding them
+    """
+    files = dataset_files(test_data)
+    if not files:
+        raise FileNotFoundError(f"No data files in {test_data}")
+
+    number = 0
+    first_row = 0
+    for path in files:
+        if path.suffix == ".parquet":
+            parts = [((path, groups), rows) for groups, rows in row_group_parts(path, chunk_size)]
+        else:
+            parts = ((chunk, len(chunk)) for chunk in read_data_chunks(path, chunk_size))
+        for part, rows in parts:
+            yield number, first_row, part
+            number += 1
+            first_row += rows
+
+
+def ordered_results(executor, function, parts, pending_parts):
+    """
+    Run a function on parts in an executor, submitting a part only when few are pending.
+
+    Parameters:
+      executor (Executor): the executor
+      function (callable): the function, called with the items of each part
+      parts (iterator): argument tuples, read as the pending parts complete
+      pending_parts (int): maximum number of parts submitted and not completed
+
+    Yields:
+      the results, in the order of the parts
+    """
+    pending = deque()
+    for part in parts:
+        pending.append(executor.submit(function, *part))
+        if len(pending) >= pending_parts:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+@lru_cache(maxsize=None)
+def cached_model(model_input):
+    """
+    Load a model once per process.
+
+    Parameters:
+      model_input (str): an input folder with the model
+
+    Returns:
+      CompactModel or estimator: the model
+    """
+    return load_model(model_input)
+
+
+def predict_part(model_input, prediction_path, data_format, metrics, slice_config, number, first_row, part):
+    """
+    Predict a part of the test set and save the row number, slice columns, prediction and actual cost of its rows.
+
+    Parameters:
+      model_input (str): an input folder with the model
+      prediction_path (str): a resulting folder, no predictions file is written when not set
+      data_format (str): format of the predictions file
+      metrics (ScoreMetrics): empty metrics the rows are accumulated into a copy of, not evaluated when not set
+      slice_config (str): slice config file, whose columns are written
+      number (int): part number, names the predictions file
+      first_row (int): position of the first row of the part in the test set
+      part (DataFrame or tuple): the rows, or the parquet file and row group numbers holding them
+
+    Returns:
+      (int, ScoreMetrics): the number of rows predicted, and their metrics when evaluating
+    """
+    model = cached_model(model_input)
+    slice_columns = load_slice_config(str(slice_config)).columns if slice_config else []
+    if not isinstance(part, pd.DataFrame):
+        part = read_row_groups(*part)
 
-    # Save the output data with feature columns, predicted cost, and actual cost in csv file
-    output_data = output_data.to_csv((Path(prediction_path) / "predictions.csv"))
+    chunk = apply_dtype_plan(part)
+    predictions = pd.DataFrame(
+        {
+            "row_id": np.arange(first_row, first_row + len(chunk)),
+            **{column: chunk[column].to_numpy() for column in slice_columns},
+            "predicted_cost": model.predict(widen_features(chunk[FEATURE_COLUMNS])),
+            "actual_cost": chunk["cost"].to_numpy(),
+        }
+    )
+    if prediction_path:
+        write_data(predictions, prediction_path, "predictions-%05d" % number, data_format)
+    metrics = copy.deepcopy(metrics)
+    if metrics is not None:
+        metrics.update(predictions, first_row)
+    return len(predictions), metrics
 
 
 if __name__ == "__main__":
@@ -122,6 +294,44 @@ if __name__ == "__main__":
     parser.add_argument("--model_input", type=str, help="Path of input model")
     parser.add_argument("--test_data", type=str, help="Path to test data")
     parser.add_argument("--predictions", type=str, help="Path of predictions")
+    parser.add_argument(
+        "--data_format",
+        type=str,
+        choices=DATA_FORMATS,
+        default="csv",
+        help="Format of the data written for the next step",
+    )
+    parser.add_argument(
+        "--csv_engine",
+        type=str,
+        choices=CSV_ENGINES,
+        default="c",
+        help="Parser of csv files, pyarrow parses with multiple threads",
+    )
+    parser.add_argument(
+        "--reader_threads",
+        type=int,
+        default=None,
+        help="Number of threads of the pyarrow readers, defaults to the number of cores",
+    )
+    parser.add_argument(
+        "--chunk_size",
+        type=int,
+        default=None,
+        help="Number of rows predicted at a time, writes only row ids, slice columns, predictions and actuals when set",
+    )
+    parser.add_argument(
+        "--max_workers",
+        type=int,
+        default=1,
+        help="Number of processes predicting chunks, 0 uses the number of cores",
+    )
+    parser.add_argument(
+        "--slice_config",
+        type=str,
+        default=DEFAULT_SLICE_CONFIG,
+        help="Slice config file, whose columns are written with chunked predictions",
+    )
 
     args = parser.parse_args()
 
@@ -130,4 +340,14 @@ if __name__ == "__main__":
     model_input = args.model_input
     test_data = args.test_data
     prediction_path = args.predictions
-    main(model_input, test_data, prediction_path)
+    main(
+        model_input,
+        test_data,
+        prediction_path,
+        args.data_format,
+        args.csv_engine,
+        args.reader_threads,
+        args.chunk_size,
+        args.max_workers,
+        args.slice_config,
+    )
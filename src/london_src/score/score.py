@@ -3,20 +3,37 @@ This module provides functionality for scoring a machine learning model.
 
 It allows users to load a trained model and a dataset containing actual and predicted values,
 then evaluates the model's performance by calculating metrics such as Mean Squared Error (MSE)
-and the Coefficient of Determination (R^2). The module also supports logging these metrics
-using MLflow and outputs a score report.
+and the Coefficient of Determination (R^2) in one pass over the predictions, read whole or in
+chunks, for the whole test set and for each group of its slices, e.g. each vendor or pickup hour,
+with bootstrap confidence intervals of the metrics. The module also supports logging these
+metrics using MLflow and outputs a score report.
 """
 import argparse
-import pandas as pd
-import os
 from pathlib import Path
-import pickle
-from sklearn.metrics import mean_squared_error, r2_score
 import mlflow
 import json
-
-
-def main(predictions, model, score_report):
+from src.london_src.common.compact_model import load_model
+from src.london_src.common.data_io import CSV_ENGINES, dataset_files, read_data_chunks, read_dataset
+from src.london_src.common.metrics import (
+    DEFAULT_BOOTSTRAP_MEMORY_MB,
+    DEFAULT_RESAMPLES,
+    DEFAULT_SLICE_CONFIG,
+    ScoreMetrics,
+)
+from src.london_src.common.schema import apply_dtype_plan
+
+
+def main(
+    predictions,
+    model,
+    score_report,
+    csv_engine="c",
+    reader_threads=None,
+    chunk_size=None,
+    slice_config=DEFAULT_SLICE_CONFIG,
+    resamples=DEFAULT_RESAMPLES,
+    bootstrap_memory_mb=DEFAULT_BOOTSTRAP_MEMORY_MB,
+):
     """
     Load the test data and model, and write the results of the model scoring.
 
@@ -24,6 +41,12 @@ def main(predictions, model, score_report):
     predictions (str): Path to the predictions.
     model (str): Path to the model.
     score_report (str): Path to the score report.
+    csv_engine (str): Parser of csv files, c or pyarrow.
+    reader_threads (int): Number of threads of the pyarrow readers, defaults to the number of cores.
+    chunk_size (int): Number of rows read at a time, reads all rows when not set.
+    slice_config (str): Slice config file, the test set is not sliced when not set.
+    resamples (int): Number of bootstrap resamples of the confidence intervals, none when 0.
+    bootstrap_memory_mb (int): Memory the bootstrap weights of a block of rows may take, in megabytes.
 
     Returns:
     None
@@ -39,65 +62,107 @@ def main(predictions, model, score_report):
     for line in lines:
         print(line)
 
-    # Load the test data with predicted values
+    # Accumulate the metrics of the test data with predicted values
+    metrics = ScoreMetrics(slice_config, resamples, bootstrap_memory_mb)
+    if chunk_size:
+        for path in dataset_files(predictions):
+            print("streaming file: %s ..." % path)
+            for chunk in read_data_chunks(path, chunk_size, metrics.columns):
+                update_metrics(metrics, chunk)
+    else:
+        update_metrics(metrics, read_dataset(predictions, csv_engine, reader_threads, metrics.columns))
 
-    print("mounted_path files: ")
-    arr = os.listdir(predictions)
+    # Load the model from input port
+    model = load_model(model)
+    write_results(model, metrics, score_report)
 
-    print(arr)
-    df_list = []
-    for filename in arr:
-        print("reading file: %s ..." % filename)
-        input_df = pd.read_csv((Path(predictions) / filename))
-        df_list.append(input_df)
 
-    test_data = df_list[0]
+def update_metrics(metrics, test_data):
+    """
+    Add the actual and predicted values of test data to the metrics.
 
-    # Load the model from input port
-    model = pickle.load(open((Path(model) / "model.sav"), "rb"))
-    write_results(model, predictions, test_data, score_report)
+    Parameters:
+    metrics (ScoreMetrics): The metrics.
+    test_data (DataFrame): The test data with actual_cost, predicted_cost and the slice columns.
+
+    Returns:
+    None
+    """
+    metrics.update(apply_dtype_plan(test_data))
+
+
+def model_coefficients(model):
+    """
+    Get the coefficients of a model.
+
+    Parameters:
+    model (sklearn model): The trained model, possibly a pipeline selecting its features.
+
+    Returns:
+    ndarray: The coefficients, None when the model is not linear.
+    """
+    estimator = model.steps[-1][1] if hasattr(model, "steps") else model
+    return getattr(estimator, "coef_", None)
 
 
 # Print the results of scoring the predictions against actual values in the test data
-def write_results(model, predictions, test_data, score_report):
+def write_results(model, metrics, score_report):
     """
-    Calculate and log the model's mean squared error and coefficient of determination.
+    Log the model's metrics and write them in the score report.
 
     Parameters:
     model (sklearn model): The trained model.
-    predictions (DataFrame): The model's predictions.
-    test_data (DataFrame): The test data.
+    metrics (ScoreMetrics): The metrics accumulated over the test data.
     score_report (str): Path to the score report.
 
     Returns:
     None
     """
     # The coefficients
-    print("Coefficients: \n", model.coef_)
-
-    actuals = test_data["actual_cost"]
-    predictions = test_data["predicted_cost"]
-
-    mse = mean_squared_error(actuals, predictions)
-    r2 = r2_score(actuals, predictions)
-
-    mlflow.log_metric("scoring_mse", mse)
-    mlflow.log_metric("scoring_r2", r2)
+    print("Coefficients: \n", model_coefficients(model))
+
+    # Each metric is computed once, for the logs and the report
+    results = metrics.overall.results()
+    mlflow.log_metric("scoring_mse", results["mse"])
+    mlflow.log_metric("scoring_r2", results["r2"])
+    mlflow.log_metric("scoring_rmse", results["rmse"])
+    mlflow.log_metric("scoring_mae", results["mae"])
+    mlflow.log_dict(metrics.overall.residual_histogram(), "residual_histogram.json")
+    # A single artifact holds the metrics of all slices, however many groups they have
+    slices = metrics.slices.results() if metrics.slices else {}
+    if slices:
+        mlflow.log_dict(slices, "slice_metrics.json")
+    intervals = metrics.bootstrap.results() if metrics.bootstrap else {}
+    if intervals:
+        for name in ["mse", "r2", "rmse"]:
+            mlflow.log_metric(f"scoring_{name}_low", intervals[name][0])
+            mlflow.log_metric(f"scoring_{name}_high", intervals[name][1])
 
     # The mean squared error
-    print("Mean squared error: %.2f" % mse)
+    print("Mean squared error: %.2f" % results["mse"])
     # The coefficient of determination: 1 is perfect prediction
-    print("Coefficient of determination: %.2f" % r2)
+    print("Coefficient of determination: %.2f" % results["r2"])
+    if intervals:
+        print(
+            "%d%% confidence intervals from %d resamples: mse [%.2f, %.2f], r2 [%.4f, %.4f]"
+            % (intervals["confidence"] * 100, intervals["resamples"], *intervals["mse"], *intervals["r2"])
+        )
     print("Model: ", model)
 
     # Print score report to a text file
     model_score = {
-        "mse": mean_squared_error(actuals, predictions),
-        "coff": str(model.coef_),
-        "cod": r2_score(actuals, predictions),
+        "mse": results["mse"],
+        "coff": str(model_coefficients(model)),
+        "cod": results["r2"],
+        "rmse": results["rmse"],
+        "mae": results["mae"],
+        "slices": slices,
+        "confidence_intervals": intervals,
     }
     with open((Path(score_report) / "score.txt"), "w") as json_file:
         json.dump(model_score, json_file, indent=4)
+    with open((Path(score_report) / "residual_histogram.json"), "w") as json_file:
+        json.dump(metrics.overall.residual_histogram(), json_file)
 
 
 if __name__ == "__main__":
@@ -107,6 +172,43 @@ if __name__ == "__main__":
     )
     parser.add_argument("--model", type=str, help="Path to model")
     parser.add_argument("--score_report", type=str, help="Path to score report")
+    parser.add_argument(
+        "--csv_engine",
+        type=str,
+        choices=CSV_ENGINES,
+        default="c",
+        help="Parser of csv files, pyarrow parses with multiple threads",
+    )
+    parser.add_argument(
+        "--reader_threads",
+        type=int,
+        default=None,
+        help="Number of threads of the pyarrow readers, defaults to the number of cores",
+    )
+    parser.add_argument(
+        "--chunk_size",
+        type=int,
+        default=None,
+        help="Number of rows read at a time, reads all rows when not set",
+    )
+    parser.add_argument(
+        "--slice_config",
+        type=str,
+        default=DEFAULT_SLICE_CONFIG,
+        help="Slice config file, the test set is not sliced when set to an empty string",
+    )
+    parser.add_argument(
+        "--bootstrap_resamples",
+        type=int,
+        default=DEFAULT_RESAMPLES,
+        help="Number of bootstrap resamples of the confidence intervals of the metrics, none when 0",
+    )
+    parser.add_argument(
+        "--bootstrap_memory_mb",
+        type=int,
+        default=DEFAULT_BOOTSTRAP_MEMORY_MB,
+        help="Memory the bootstrap weights of a block of rows may take, in megabytes",
+    )
 
     args = parser.parse_args()
 
@@ -114,4 +216,14 @@ if __name__ == "__main__":
     model = args.model
     score_report = args.score_report
 
-    main(predictions, model, score_report)
+    main(
+        predictions,
+        model,
+        score_report,
+        args.csv_engine,
+        args.reader_threads,
+        args.chunk_size,
+        args.slice_config,
+        args.bootstrap_resamples,
+        args.bootstrap_memory_mb,
+    )
@@ -5,20 +5,73 @@ The module uses Linear Regression from scikit-learn for model training and lever
 MLflow for experiment tracking. The data is split into training and test sets, with the
 model being trained on the training set. The test data and model outputs are saved for
 further evaluation and deployment.
+
+With a chunk size, the model is trained out of core instead: the training files are read in
+chunks, optionally in several processes, and only the sufficient statistics of the least
+squares fit are kept in memory, so memory is bounded by the chunk size whatever the data size.
+The statistics and the test rows of each file are saved with the model, so a retraining warm
+started from it only reads the files that are new or changed since.
+
+With a sweep config, the model is instead selected among several estimators, hyperparameters
+and feature sets evaluated in parallel, see sweep.py.
 """
 
 import argparse
-from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
 import os
-import pandas as pd
+from pathlib import Path, PurePosixPath
+import shutil
+import zlib
+import numpy as np
 from sklearn.linear_model import LinearRegression
 from sklearn.model_selection import train_test_split
 import pickle
 import mlflow
 import json
-
-
-def main(training_data, test_data, model_output, model_metadata):
+from src.london_src.common.cache import file_hash
+from src.london_src.common.compact_model import export_compact_model
+from src.london_src.common.data_io import (
+    CSV_ENGINES,
+    DATA_FORMATS,
+    DataWriter,
+    dataset_files,
+    read_data_chunks,
+    read_dataset,
+    write_data,
+)
+from src.london_src.common.least_squares import LeastSquares
+from src.london_src.common.schema import FEATURE_COLUMNS, apply_dtype_plan, widen_features
+from src.london_src.train.sweep import run_sweep
+
+TEST_SIZE = 0.3
+SPLIT_SEED = 42
+
+# Key of the out of core split, saved with the training state so a split made differently isn't reused
+SPLIT_KEY = "path-without-suffix"
+
+# Number of rows read at a time when warm starting without a chunk size
+DEFAULT_CHUNK_SIZE = 100000
+
+# Statistics of each training file, saved with out of core models
+TRAINING_STATE_FILE = "training_state.json"
+
+# Folder of the test files of the training files, saved with out of core models
+TEST_FILES_FOLDER = "test_data"
+
+
+def main(
+    training_data,
+    test_data,
+    model_output,
+    model_metadata,
+    data_format="csv",
+    csv_engine="c",
+    reader_threads=None,
+    chunk_size=None,
+    max_workers=1,
+    previous_model=None,
+    sweep_config=None,
+):
     """
     Read training data, split data and initiate training.
 
@@ -27,6 +80,15 @@ def main(training_data, test_data, model_output, model_metadata):
       test_data (str): test data folder
       model_output (str): a folder to store model files
       model_metadata (str): a file to store information about thr model
+      data_format (str): format of the test data file
+      csv_engine (str): parser of csv files, c or pyarrow
+      reader_threads (int): number of threads of the pyarrow readers, defaults to the number of cores
+      chunk_size (int): number of rows read at a time to train out of core, reads all rows when not set
+      max_workers (int): number of processes reading training files out of core or evaluating
+        sweep candidates, 0 uses the number of cores
+      previous_model (str): folder of a model trained out of core to warm start from, out of core
+        training reads only the files that are new or changed since
+      sweep_config (str): sweep config file, the model is selected among its candidates when set
     """
     print("Hello training world...")
 
@@ -40,72 +102,60 @@ def main(training_data, test_data, model_output, model_metadata):
     for line in lines:
         print(line)
 
-    print("mounted_path files: ")
-    arr = os.listdir(training_data)
-    print(arr)
-
-    df_list = []
-    for filename in arr:
-        print("reading file: %s ..." % filename)
-        input_df = pd.read_csv((Path(training_data) / filename))
-        df_list.append(input_df)
-
-    train_data = df_list[0]
+    if sweep_config and (chunk_size or previous_model):
+        raise ValueError("A sweep trains in memory, it can't be combined with out of core training")
+
+    if chunk_size or previous_model:
+        train_streaming(
+            training_data,
+            test_data,
+            model_output,
+            model_metadata,
+            chunk_size or DEFAULT_CHUNK_SIZE,
+            max_workers,
+            data_format,
+            previous_model,
+        )
+        return
+
+    # A partitioned transform output holds one file per partition
+    train_data = apply_dtype_plan(
+        read_dataset(training_data, csv_engine, reader_threads)
+    )
     print(train_data.columns)
 
-    train_x, test_x, trainy, testy = split(train_data)
-    write_test_data(test_x, testy)
-    train_model(train_x, trainy)
+    train_rows, test_rows = split(train_data)
+    write_test_data(train_data, test_rows, data_format)
+
+    # The model is fitted on 64 bit features, as it is served with them
+    train_x = widen_features(train_data[FEATURE_COLUMNS].take(train_rows))
+    trainy = train_data["cost"].take(train_rows).astype("float64")
+    if sweep_config:
+        train_sweep(train_x, trainy, sweep_config, max_workers)
+    else:
+        train_model(train_x, trainy)
 
 
 def split(train_data):
     """
-    Split the input data into training and testing sets.
+    Split the input data into training and testing rows.
 
     Parameters:
     train_data (DataFrame): The input data.
 
     Returns:
-    trainX (DataFrame): The training data.
-    testX (DataFrame): The testing data.
-    trainy (Series): The training labels.
-    testy (Series): The testing labels.
-    """
-    # Split the data into input(X) and output(y)
-    y = train_data["cost"]
-    x = train_data[
-        [
-            "distance",
-            "dropoff_latitude",
-            "dropoff_longitude",
-            "passengers",
-            "pickup_latitude",
-            "pickup_longitude",
-            "store_forward",
-            "vendor",
-            "pickup_weekday",
-            "pickup_month",
-            "pickup_monthday",
-            "pickup_hour",
-            "pickup_minute",
-            "pickup_second",
-            "dropoff_weekday",
-            "dropoff_month",
-            "dropoff_monthday",
-            "dropoff_hour",
-            "dropoff_minute",
-            "dropoff_second",
-        ]
-    ]
-
-    # Split the data into train and test sets
-    train_x, test_x, trainy, testy = train_test_split(
-        x, y, test_size=0.3, random_state=42
+    train_rows (ndarray): The numbers of the training rows, in random order.
+    test_rows (ndarray): The numbers of the testing rows, in file order.
+    """
+    # Split the row numbers, the rows themselves are not copied
+    train_rows, test_rows = train_test_split(
+        np.arange(len(train_data)), test_size=TEST_SIZE, random_state=SPLIT_SEED
     )
-    print(train_x.shape)
-    print(train_x.columns)
+    # In file order, a chunk of the test rows is read from the few row groups holding it
+    test_rows = np.sort(test_rows)
+    print("training rows: %d, testing rows: %d" % (len(train_rows), len(test_rows)))
 
-    return train_x, test_x, trainy, testy
+    return train_rows, test_rows
 
 
 def train_model(train_x, trainy):
@@ -113,8 +163,8 @@ def train_model(train_x, trainy):
     Train a Linear Regression model and save the model and its metadata.
 
     Parameters:
-    trainX (DataFrame): The training data.
-    trainy (Series): The training labels.
+    trainX (DataFrame): The training data, widened to 64 bits.
+    trainy (Series): The training labels, widened to 64 bits.
 
     Returns:
     None
@@ -126,29 +176,335 @@ def train_model(train_x, trainy):
         print(model.score(train_x, trainy))
 
         # Output the model, metadata and test data
-        run_id = mlflow.active_run().info.run_id
-        model_uri = f"runs:/{run_id}/model"
-        model_data = {"run_id": run.info.run_id, "run_uri": model_uri}
-        with open(args.model_metadata, "w") as json_file:
-            json.dump(model_data, json_file, indent=4)
+        save_model(model, run, args.model_output, args.model_metadata)
+
+
+def train_sweep(train_x, trainy, sweep_config, max_workers=1):
+    """
+    Select the model among the candidates of a sweep config and save the model and its metadata.
+
+    Each evaluated candidate is logged as a nested run of the training run.
+
+    Parameters:
+      train_x (DataFrame): The training data, widened to 64 bits.
+      trainy (Series): The training labels, widened to 64 bits.
+      sweep_config (str): sweep config file
+      max_workers (int): number of processes evaluating candidates, 0 uses the number of cores
+    """
+    with mlflow.start_run() as run:
+        model, best, results = run_sweep(train_x, trainy, sweep_config, max_workers)
+        for result in results:
+            with mlflow.start_run(run_name=result.candidate.name, nested=True):
+                mlflow.log_params(
+                    {
+                        "estimator": result.candidate.estimator,
+                        "feature_set": result.candidate.feature_set,
+                        **result.candidate.params,
+                    }
+                )
+                mlflow.log_metric("validation_r2", result.score)
+                mlflow.log_metric("fit_seconds", result.seconds)
+
+        score = model.score(train_x, trainy)
+        print(score)
+        mlflow.log_param("best_candidate", best.name)
+        mlflow.log_metric("training_score", score)
+        mlflow.log_metric("candidates_evaluated", len(results))
+        mlflow.sklearn.log_model(model, "model")
+        save_model(model, run, args.model_output, args.model_metadata)
+
+
+def save_model(model, run, model_output, model_metadata):
+    """
+    Save a trained model and the metadata of its run.
+
+    A linear model is also exported as a compact file, logged with the model of the run.
+
+    Parameters:
+      model (estimator): the trained model
+      run (mlflow.ActiveRun): the training run, the model is logged in it as model
+      model_output (str): a folder to store model files
+      model_metadata (str): a file to store information about the model
+    """
+    run_id = run.info.run_id
+    model_uri = f"runs:/{run_id}/model"
+    model_data = {"run_id": run_id, "run_uri": model_uri}
+    with open(model_metadata, "w") as json_file:
+        json.dump(model_data, json_file, indent=4)
+
+    pickle.dump(model, open((Path(model_output) / "model.sav"), "wb"))
+
+    # Linear models are also served from a compact file, loaded without scikit-learn
+    compact_path = export_compact_model(model, model_output)
+    if compact_path:
+        mlflow.log_artifact(str(compact_path), "model")
+
+
+def train_streaming(
+    training_data,
+    test_data,
+    model_output,
+    model_metadata,
+    chunk_size,
+    max_workers=1,
+    data_format="csv",
+    previous_model=None,
+):
+    """
+    Train the Linear Regression model out of core.
+
+    Each training file is read in chunks. The test rows of a chunk are written to the test data,
+    and the other rows are added to the least squares statistics of the file. The statistics of
+    all files are merged and solved into the same coefficients LinearRegression fits on the
+    training rows. The files are read in parallel with several workers.
+
+    The statistics and the test file of each training file are saved with the model. When warm
+    starting, those of the previous model are reused for the files whose content didn't change,
+    which are not read: their test files are copied from the previous model. The test data always
+    holds the test rows of every file, and the model is the same as the one trained from scratch.
+
+    Parameters:
+      training_data (str): training data folder
+      test_data (str): test data folder, a test file is written for each training file
+      model_output (str): a folder to store model files
+      model_metadata (str): a file to store information about the model
+      chunk_size (int): number of rows read at a time
+      max_workers (int): number of processes reading the files, 0 uses the number of cores
+      data_format (str): format of the test data files
+      previous_model (str): folder of the model to warm start from, trains from scratch when not set
+    """
+    files = dataset_files(training_data)
+    print([str(path.relative_to(training_data)) for path in files])
+    if not files:
+        raise FileNotFoundError(f"No data files in {training_data}")
+
+    previous = read_training_state(previous_model) if previous_model else {}
+    state = {}
+    jobs = []
+    for path in files:
+        name = path.relative_to(training_data).as_posix()
+        state[name] = {"hash": file_hash(path)}
+        if name in previous and previous[name]["hash"] == state[name]["hash"]:
+            state[name].update(previous[name])
+            copy_test_file(Path(previous_model) / TEST_FILES_FOLDER, test_data, state[name]["test_file"])
+        else:
+            jobs.append((path, name, test_data, chunk_size, data_format))
+    print("reusing the statistics and test rows of %d files, reading %d files" % (len(files) - len(jobs), len(jobs)))
+
+    for job, (file_statistics, test_file) in zip(jobs, accumulate_files(jobs, max_workers)):
+        state[job[1]].update(statistics=file_statistics.to_dict(), test_file=test_file)
+
+    # The files are merged in the same order whether their statistics are reused or not
+    statistics = LeastSquares(len(FEATURE_COLUMNS))
+    for name in state:
+        statistics.merge(LeastSquares.from_dict(state[name]["statistics"]))
+    coef, intercept = statistics.solve()
+    score = statistics.r2_score(coef)
+    print("trained on %d rows" % statistics.rows)
+    print(score)
+
+    model = linear_model(coef, intercept)
+    state_path = write_training_state(model_output, state)
+    test_files = Path(model_output) / TEST_FILES_FOLDER
+    test_files.mkdir(exist_ok=True)
+    for name in state:
+        copy_test_file(test_data, test_files, state[name]["test_file"])
+    with mlflow.start_run() as run:
+        mlflow.log_metric("training_score", score)
+        mlflow.log_metric("training_rows", statistics.rows)
+        mlflow.log_metric("training_files_read", len(jobs))
+        mlflow.sklearn.log_model(model, "model")
+        # Registered with the model, so the next retraining can warm start from it
+        mlflow.log_artifact(str(state_path), "model")
+        mlflow.log_artifacts(str(test_files), f"model/{TEST_FILES_FOLDER}")
+        save_model(model, run, model_output, model_metadata)
+
+
+def accumulate_files(jobs, max_workers=1):
+    """
+    Run accumulate_file for several files, in parallel with several workers.
+
+    Parameters:
+      jobs (list): arguments of accumulate_file for each file
+      max_workers (int): number of processes, 0 uses the number of cores
+
+    Returns:
+      list: the LeastSquares statistics and the test file name of each file, in the order of the jobs
+    """
+    workers = max(1, min(max_workers or os.cpu_count(), len(jobs)))
+    if workers == 1:
+        return [accumulate_file(*job) for job in jobs]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(accumulate_file, *zip(*jobs)))
+
+
+def read_training_state(previous_model):
+    """
+    Read the statistics of each training file saved with a previous model.
+
+    Parameters:
+      previous_model (str): folder of the previous model
+
+    Returns:
+      dict: relative training file path to its content hash, statistics and test file name, empty
+        when the model has no state or was trained with other features or another split
+    """
+    path = Path(previous_model) / TRAINING_STATE_FILE
+    if not path.is_file():
+        print("no training state in %s, training from scratch" % previous_model)
+        return {}
+
+    with open(path) as json_file:
+        state = json.load(json_file)
+    if state["features"] != FEATURE_COLUMNS or state["split"] != [TEST_SIZE, SPLIT_SEED, SPLIT_KEY]:
+        print("the previous model was trained differently, training from scratch")
+        return {}
+    # A file saved without its test file is read again
+    return {name: file_state for name, file_state in state["files"].items() if "test_file" in file_state}
+
 
-        pickle.dump(model, open((Path(args.model_output) / "model.sav"), "wb"))
+def write_training_state(model_output, state):
+    """
+    Save the statistics of each training file with the model.
+
+    Parameters:
+      model_output (str): a folder to store model files
+      state (dict): relative training file path to its content hash, statistics and test file name
+
+    Returns:
+      Path: the written file
+    """
+    path = Path(model_output) / TRAINING_STATE_FILE
+    with open(path, "w") as json_file:
+        json.dump(
+            {"features": FEATURE_COLUMNS, "split": [TEST_SIZE, SPLIT_SEED, SPLIT_KEY], "files": state},
+            json_file,
+        )
+    return path
+
+
+def accumulate_file(path, name, test_data, chunk_size, data_format="csv"):
+    """
+    Split the rows of a training file and accumulate the least squares statistics of its training rows.
+
+    Parameters:
+      path (Path): training file
+      name (str): path of the file relative to the training data, selects its test rows and names its test file
+      test_data (str): test data folder
+      chunk_size (int): number of rows read at a time
+      data_format (str): format of the test data file
+
+    Returns:
+      (LeastSquares, str): the statistics of the training rows of the file, and the name of its test
+        file, None when the file has no test rows
+    """
+    print("reading file: %s ..." % path)
+    statistics = LeastSquares(len(FEATURE_COLUMNS))
+    writer = DataWriter(test_data, test_file_name(name), data_format)
+    first_row = 0
+    for chunk in read_data_chunks(path, chunk_size):
+        chunk = apply_dtype_plan(chunk)
+        test = holdout_rows(name, first_row, len(chunk))
+        first_row += len(chunk)
+
+        train = chunk[~test]
+        statistics.update(
+            widen_features(train[FEATURE_COLUMNS]).to_numpy(dtype="float64"),
+            train["cost"].to_numpy(dtype="float64"),
+        )
+        writer.write(chunk.loc[test, FEATURE_COLUMNS + ["cost"]])
+    writer.close()
+    return statistics, writer.path.name if writer.rows else None
+
+
+def copy_test_file(source, destination, test_file):
+    """
+    Copy the test file of a training file between folders, e.g. from the previous model to the test data.
+
+    Parameters:
+      source (str): folder holding the test file
+      destination (str): folder to copy it to
+      test_file (str): name of the test file, nothing is copied when None
+    """
+    if test_file:
+        shutil.copy(Path(source) / test_file, Path(destination) / test_file)
+
+
+def test_file_name(name):
+    """
+    Name the test file of a training file after its path, so it doesn't change when files are added.
+
+    Parameters:
+      name (str): path of the file relative to the training data
+
+    Returns:
+      str: the test file name without extension
+    """
+    return "test_data-" + PurePosixPath(name).with_suffix("").as_posix().replace("/", "--")
+
+
+def holdout_rows(name, first_row, rows):
+    """
+    Select the test rows of a chunk from a hash of their file path and row numbers.
+
+    The selection of a row doesn't depend on the chunk it is read in, nor on the other files,
+    so the split is the same whatever the chunk size, the number of workers, and the files
+    added to the training data since a previous training. The path is hashed without its
+    extension, so the split doesn't change with the format of the training data either.
+
+    Parameters:
+      name (str): path of the file relative to the training data
+      first_row (int): row number of the first row of the chunk in the file
+      rows (int): number of rows of the chunk
+
+    Returns:
+      numpy.ndarray: the mask of the test rows, about TEST_SIZE of them
+    """
+    keys = np.arange(first_row, first_row + rows, dtype=np.uint64)
+    key = PurePosixPath(name).with_suffix("").as_posix()
+    keys += np.uint64((zlib.crc32(key.encode()) << 32) + SPLIT_SEED)
+    # splitmix64 finalizer, multiplications wrap around as intended
+    keys += np.uint64(0x9E3779B97F4A7C15)
+    keys = (keys ^ (keys >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    keys = (keys ^ (keys >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    keys ^= keys >> np.uint64(31)
+    return (keys >> np.uint64(11)) < np.uint64(TEST_SIZE * (1 << 53))
+
+
+def linear_model(coef, intercept):
+    """
+    Build a LinearRegression model from solved coefficients.
+
+    Parameters:
+      coef (numpy.ndarray): coefficients of FEATURE_COLUMNS
+      intercept (float): the intercept
+
+    Returns:
+      LinearRegression: a model predicting like a fitted one
+    """
+    model = LinearRegression()
+    model.coef_ = coef
+    model.intercept_ = intercept
+    model.n_features_in_ = len(FEATURE_COLUMNS)
+    model.feature_names_in_ = np.array(FEATURE_COLUMNS, dtype=object)
+    return model
 
 
-def write_test_data(test_x, testy):
+def write_test_data(train_data, test_rows, data_format="csv"):
     """
-    Write the testing data to a CSV file.
+    Write the features and labels of the testing rows, in their compact dtypes, for the next steps.
 
     Parameters:
-    testX (DataFrame): The testing data.
-    testy (Series): The testing labels.
+    train_data (DataFrame): The input data.
+    test_rows (ndarray): The numbers of the testing rows.
+    data_format (str): The format of the test data file.
 
     Returns:
     None
     """
-    test_x["cost"] = testy
-    print(test_x.shape)
-    test_x.to_csv((Path(args.test_data) / "test_data.csv"))
+    test_data = train_data[FEATURE_COLUMNS + ["cost"]].take(test_rows)
+    print(test_data.shape)
+    write_data(test_data, args.test_data, "test_data", data_format, row_group_size=DEFAULT_CHUNK_SIZE)
 
 
 if __name__ == "__main__":
@@ -157,6 +513,51 @@ if __name__ == "__main__":
     parser.add_argument("--test_data", type=str, help="Path to test data")
     parser.add_argument("--model_output", type=str, help="Path of output model")
     parser.add_argument("--model_metadata", type=str, help="Path of model metadata")
+    parser.add_argument(
+        "--data_format",
+        type=str,
+        choices=DATA_FORMATS,
+        default="csv",
+        help="Format of the data written for the next step",
+    )
+    parser.add_argument(
+        "--csv_engine",
+        type=str,
+        choices=CSV_ENGINES,
+        default="c",
+        help="Parser of csv files, pyarrow parses with multiple threads",
+    )
+    parser.add_argument(
+        "--reader_threads",
+        type=int,
+        default=None,
+        help="Number of threads of the pyarrow readers, defaults to the number of cores",
+    )
+    parser.add_argument(
+        "--chunk_size",
+        type=int,
+        default=None,
+        help="Number of rows read at a time to train out of core, reads all rows when not set",
+    )
+    parser.add_argument(
+        "--max_workers",
+        type=int,
+        default=1,
+        help="Number of processes reading training files out of core or evaluating sweep candidates, "
+        "0 uses the number of cores",
+    )
+    parser.add_argument(
+        "--previous_model",
+        type=str,
+        default=None,
+        help="Folder of a model trained out of core to warm start from, trains out of core when set",
+    )
+    parser.add_argument(
+        "--sweep_config",
+        type=str,
+        default=None,
+        help="Sweep config file, the model is selected among its candidates when set",
+    )
 
     args = parser.parse_args()
 
@@ -165,4 +566,16 @@ if __name__ == "__main__":
     model_output = args.model_output
     model_metadata = args.model_metadata
 
-    main(training_data, test_data, model_output, model_metadata)
+    main(
+        training_data,
+        test_data,
+        model_output,
+        model_metadata,
+        args.data_format,
+        args.csv_engine,
+        args.reader_threads,
+        args.chunk_size,
+        args.max_workers,
+        args.previous_model,
+        args.sweep_config,
+    )
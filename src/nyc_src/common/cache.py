@@ -0,0 +1,158 @@
+"""
+This module caches the outputs of the data preparation steps by content.
+
+A step computes a key from the content hashes of its input files, the version of its
+logic and the options it runs with. When a previous run with the same key stored its
+outputs in the cache folder, the step restores them instead of processing the data again.
+Each cache entry holds a copy of the step outputs and a manifest listing them.
+The cache folder is a local path, so only runs on the same machine reuse it, e.g. local runs
+of the steps. The Azure ML pipelines do not set it, their steps run on fresh compute nodes.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+from pathlib import Path
+
+MANIFEST_FILE = "manifest.json"
+
+
+def file_hash(path, block_size=1 << 20):
+    """
+    Compute the sha256 of a file reading it in blocks.
+
+    Parameters:
+      path (str): file to hash
+      block_size (int): number of bytes read at a time
+
+    Returns:
+      str: hex digest of the file content
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as stream:
+        for block in iter(lambda: stream.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def folder_files(folder):
+    """
+    List the files of a folder and its sub folders.
+
+    Parameters:
+      folder (str): folder to list
+
+    Returns:
+      list: file paths relative to the folder, sorted
+    """
+    root = Path(folder)
+    return sorted(path.relative_to(root) for path in root.rglob("*") if path.is_file())
+
+
+def cache_key(step, version, input_folder, options=None):
+    """
+    Compute the cache key of a step run.
+
+    Parameters:
+      step (str): name of the step
+      version (str): version of the step logic, changing it invalidates the cache
+      input_folder (str): folder with the step inputs
+      options (dict): step options that change the outputs
+
+    Returns:
+      str: hex digest identifying the run
+    """
+    hashes = {
+        relative_path.as_posix(): file_hash(Path(input_folder) / relative_path)
+        for relative_path in folder_files(input_folder)
+    }
+    return hashes_key(step, version, hashes, options)
+
+
+def hashes_key(step, version, hashes, options=None):
+    """
+    Compute the cache key of a step run from the known content hashes of its inputs.
+
+    Parameters:
+      step (str): name of the step
+      version (str): version of the step logic, changing it invalidates the cache
+      hashes (dict): relative input path to the hash of its content
+      options (dict): step options that change the outputs
+
+    Returns:
+      str: hex digest identifying the run
+    """
+    digest = hashlib.sha256()
+    header = {"step": step, "version": version, "options": options or {}}
+    digest.update(json.dumps(header, sort_keys=True).encode())
+    for relative_path in sorted(hashes):
+        digest.update(relative_path.encode())
+        digest.update(hashes[relative_path].encode())
+    return digest.hexdigest()
+
+
+def restore_outputs(cache_dir, key, output_folder):
+    """
+    Copy the cached outputs of a run into the output folder.
+
+    Parameters:
+      cache_dir (str): cache folder
+      key (str): cache key of the run
+      output_folder (str): folder to restore the outputs to
+
+    Returns:
+      bool: True when the outputs were restored, False on a cache miss
+    """
+    entry = Path(cache_dir) / key
+    manifest_path = entry / MANIFEST_FILE
+    if not manifest_path.exists():
+        print("cache miss: %s" % key)
+        return False
+
+    with open(manifest_path) as json_file:
+        manifest = json.load(json_file)
+    for relative_path in manifest["files"]:
+        target = Path(output_folder) / relative_path
+        target.parent.mkdir(parents=True, exist_ok=True)
+        shutil.copyfile(entry / relative_path, target)
+
+    print("cache hit: %s, restored %d files" % (key, len(manifest["files"])))
+    return True
+
+
+def store_outputs(cache_dir, key, output_folder):
+    """
+    Copy the outputs of a run into the cache.
+
+    The entry is staged in a temporary folder and renamed once complete, so concurrent
+    runs never restore a partially written entry.
+
+    Parameters:
+      cache_dir (str): cache folder
+      key (str): cache key of the run
+      output_folder (str): folder with the outputs to cache
+    """
+    entry = Path(cache_dir) / key
+    if entry.exists():
+        return
+
+    staging = Path(cache_dir) / f"{key}.{os.getpid()}.tmp"
+    shutil.rmtree(staging, ignore_errors=True)
+    staging.mkdir(parents=True)
+    files = folder_files(output_folder)
+    for relative_path in files:
+        target = staging / relative_path
+        target.parent.mkdir(parents=True, exist_ok=True)
+        shutil.copyfile(Path(output_folder) / relative_path, target)
+
+    manifest = {"files": [relative_path.as_posix() for relative_path in files]}
+    with open(staging / MANIFEST_FILE, "w") as json_file:
+        json.dump(manifest, json_file, indent=4)
+
+    try:
+        os.rename(staging, entry)
+        print("cached %d files: %s" % (len(files), key))
+    except OSError:
+        # Another run stored the same entry first
+        shutil.rmtree(staging, ignore_errors=True)
@@ -0,0 +1,391 @@
+"""
+This module handles the data handoff between the taxi pipeline steps.
+
+Every step writes its outputs either as csv (the original format) or as parquet.
+Parquet keeps the column types between steps, so the next step neither re-parses
+text nor re-infers dtypes, and it doesn't carry the row index as an extra column.
+The compact dtypes of the features are kept too: narrow numbers are stored with their
+width, and categorical columns dictionary encoded, which the readers read back as
+categories. Csv stores text, so the compact dtypes are only kept in memory with it.
+Readers pick the format from the file extension, so a step can consume the
+outputs of a previous step regardless of the format it was configured with.
+A step can also publish an index file naming each of its outputs, so the next
+step opens the file it needs by name instead of listing the folder.
+
+Csv files are parsed either with the pandas C parser, one thread per file, or with
+the multi-threaded pyarrow parser. The pyarrow thread pool is shared by the csv and
+parquet readers and can be bounded per process, e.g. when several processes read
+files concurrently.
+"""
+
+import json
+import time
+from pathlib import Path
+import numpy as np
+import pandas as pd
+
+DATA_FORMATS = ["csv", "parquet"]
+CSV_ENGINES = ["c", "pyarrow"]
+INDEX_FILE = "data_index.json"
+
+# The strings pandas.read_csv reads as missing values by default, the pyarrow parser is given the same
+CSV_NA_VALUES = [
+    "",
+    "#N/A",
+    "#N/A N/A",
+    "#NA",
+    "-1.#IND",
+    "-1.#QNAN",
+    "-NaN",
+    "-nan",
+    "1.#IND",
+    "1.#QNAN",
+    "<NA>",
+    "N/A",
+    "NA",
+    "NULL",
+    "NaN",
+    "None",
+    "n/a",
+    "nan",
+    "null",
+]
+
+
+def data_file_name(name, data_format):
+    """
+    Build the file name for a step output.
+
+    Parameters:
+      name (str): output name without extension
+      data_format (str): one of DATA_FORMATS
+
+    Returns:
+      str: the file name
+    """
+    if data_format not in DATA_FORMATS:
+        raise ValueError(f"Unsupported data format: {data_format}")
+    return f"{name}.{data_format}"
+
+
+def set_reader_threads(threads):
+    """
+    Bound the number of threads the pyarrow readers use in this process.
+
+    Parameters:
+      threads (int): number of threads, the pyarrow default (number of cores) is kept when not set
+    """
+    if threads:
+        import pyarrow as pa
+
+        pa.set_cpu_count(threads)
+
+
+def report_throughput(rows, seconds, source):
+    """
+    Print the number of rows read per second.
+
+    Parameters:
+      rows (int): number of rows read
+      seconds (float): time spent reading
+      source (str): what was read
+    """
+    rate = rows / seconds if seconds > 0 else float("inf")
+    print("read %d rows from %s in %.2fs (%.0f rows/sec)" % (rows, source, seconds, rate))
+
+
+def read_data(path, engine="c", columns=None, **options):
+    """
+    Read a step output choosing the reader by file extension.
+
+    Parameters:
+      path (str): csv or parquet file
+      engine (str): one of CSV_ENGINES, the parser of csv files
+      columns (list): columns to read, all columns when not set
+      options: other pandas.read_csv arguments, e.g. dtype
+
+    Returns:
+      DataFrame: file content
+    """
+    if Path(path).suffix == ".parquet":
+        import pyarrow.parquet as pq
+
+        return _parquet_to_pandas(pq.read_table(path, columns=columns))
+    if columns is not None:
+        options["usecols"] = columns
+    if engine == "pyarrow":
+        return _read_csv_pyarrow(path, **options)
+    return pd.read_csv(path, **options)
+
+
+def read_data_chunks(path, chunk_size, columns=None):
+    """
+    Read a step output in chunks of rows, choosing the reader by file extension.
+
+    Parameters:
+      path (str): csv or parquet file
+      chunk_size (int): number of rows per chunk
+      columns (list): columns to read, all columns when not set
+
+    Returns:
+      iterator: data frames of at most chunk_size rows, in file order
+    """
+    if Path(path).suffix == ".parquet":
+        import pyarrow.parquet as pq
+
+        parquet_file = pq.ParquetFile(path)
+        batches = parquet_file.iter_batches(batch_size=chunk_size, columns=columns)
+        return (_parquet_to_pandas(batch, parquet_file.schema_arrow) for batch in batches)
+    return pd.read_csv(path, chunksize=chunk_size, usecols=columns)
+
+
+def row_group_parts(path, chunk_size):
+    """
+    Group the consecutive row groups of a parquet file into parts of about chunk_size rows.
+
+    A part holds whole row groups, so it is larger than chunk_size when a row group is.
+
+    Parameters:
+      path (str): parquet file
+      chunk_size (int): number of rows per part
+
+    Returns:
+      list: the row group numbers and the number of rows of each part, in file order
+    """
+    import pyarrow.parquet as pq
+
+    metadata = pq.ParquetFile(path).metadata
+    parts = []
+    groups, rows = [], 0
+    for group in range(metadata.num_row_groups):
+        groups.append(group)
+        rows += metadata.row_group(group).num_rows
+        if rows >= chunk_size:
+            parts.append((groups, rows))
+            groups, rows = [], 0
+    if groups:
+        parts.append((groups, rows))
+    return parts
+
+
+def read_row_groups(path, groups, columns=None):
+    """
+    Read row groups of a parquet file.
+
+    Parameters:
+      path (str): parquet file
+      groups (list): numbers of the row groups
+      columns (list): columns to read, all columns when not set
+
+    Returns:
+      DataFrame: the rows of the row groups, in file order
+    """
+    import pyarrow.parquet as pq
+
+    return _parquet_to_pandas(pq.ParquetFile(path).read_row_groups(groups, columns=columns))
+
+
+def _parquet_to_pandas(data, schema=None):
+    # Categorical columns are stored dictionary encoded, but pyarrow reads the dictionaries of
+    # non text values back as plain values: the pandas metadata of the file restores their dtype
+    frame = data.to_pandas()
+    metadata = (schema or data.schema).pandas_metadata or {}
+    categories = {
+        column["name"]: "category"
+        for column in metadata.get("columns", [])
+        if column["pandas_type"] == "categorical"
+        and column["name"] in frame.columns
+        and not isinstance(frame[column["name"]].dtype, pd.CategoricalDtype)
+    }
+    return frame.astype(categories) if categories else frame
+
+
+def _read_csv_pyarrow(path, usecols=None, dtype=None):
+    import pyarrow as pa
+    import pyarrow.csv as pv
+
+    # Name the columns as the c parser does, pyarrow keeps unnamed index columns empty
+    header = pd.read_csv(path, nrows=0).columns
+    dtype = dtype or {}
+    text_columns = {column: pa.string() for column, kind in dtype.items() if kind == "str"}
+    table = pv.read_csv(
+        path,
+        read_options=pv.ReadOptions(column_names=list(header), skip_rows=1),
+        # Missing text is read as null, as the c parser reads it as NaN rather than an empty string
+        convert_options=pv.ConvertOptions(
+            include_columns=usecols,
+            column_types=text_columns,
+            null_values=CSV_NA_VALUES,
+            strings_can_be_null=True,
+        ),
+    )
+    data = table.to_pandas()
+    # Missing text is None in the pyarrow conversion, and NaN from the c parser
+    for column in data.columns[data.dtypes == object]:
+        data[column] = data[column].where(data[column].notna(), np.nan)
+    cast = {column: kind for column, kind in dtype.items() if column not in text_columns}
+    return data.astype(cast) if cast else data
+
+
+def read_dataset(folder, engine="c", threads=None, columns=None):
+    """
+    Read all data files of a step output folder into one data frame.
+
+    Index files and other non data files are skipped, partition sub folders are included.
+
+    Parameters:
+      folder (str): output folder of the previous step
+      engine (str): one of CSV_ENGINES, the parser of csv files
+      threads (int): number of threads of the pyarrow readers, defaults to the number of cores
+      columns (list): columns to read, all columns when not set
+
+    Returns:
+      DataFrame: the rows of all files, in file path order
+    """
+    set_reader_threads(threads)
+    start = time.perf_counter()
+
+    print("mounted_path files: ")
+    files = dataset_files(folder)
+    print([str(path.relative_to(folder)) for path in files])
+    if not files:
+        raise FileNotFoundError(f"No data files in {folder}")
+
+    frames = []
+    for path in files:
+        print("reading file: %s ..." % path)
+        frames.append(read_data(path, engine, columns))
+    data = frames[0] if len(frames) == 1 else pd.concat(frames, ignore_index=True)
+
+    report_throughput(len(data), time.perf_counter() - start, folder)
+    return data
+
+
+def dataset_files(folder):
+    """
+    List the data files of a step output folder, including those of partition sub folders.
+
+    Parameters:
+      folder (str): output folder of the previous step
+
+    Returns:
+      list: csv and parquet files, sorted by path
+    """
+    suffixes = {f".{data_format}" for data_format in DATA_FORMATS}
+    return sorted(
+        path
+        for path in Path(folder).rglob("*")
+        if path.is_file() and path.suffix in suffixes
+    )
+
+
+def write_data(data, folder, name, data_format, row_group_size=None):
+    """
+    Write a data frame as a step output.
+
+    Parameters:
+      data (pandas.DataFrame): data to write
+      folder (str): output folder
+      name (str): output name without extension
+      data_format (str): one of DATA_FORMATS
+      row_group_size (int): maximum number of rows of a parquet row group, the pyarrow default when not set
+
+    Returns:
+      Path: the written file
+    """
+    path = Path(folder) / data_file_name(name, data_format)
+    if data_format == "parquet":
+        data.to_parquet(path, index=False, row_group_size=row_group_size)
+    else:
+        data.to_csv(path)
+    return path
+
+
+def write_index(folder, outputs):
+    """
+    Write the index file naming the outputs of a step.
+
+    Parameters:
+      folder (str): output folder
+      outputs (dict): output name to the file written for it
+    """
+    with open(Path(folder) / INDEX_FILE, "w") as json_file:
+        json.dump(outputs, json_file, indent=4)
+
+
+def read_index(folder):
+    """
+    Read the index file of a step output folder.
+
+    Parameters:
+      folder (str): output folder of the previous step
+
+    Returns:
+      dict: output name to the path of its file
+    """
+    with open(Path(folder) / INDEX_FILE) as json_file:
+        outputs = json.load(json_file)
+    return {name: Path(folder) / file_name for name, file_name in outputs.items()}
+
+
+class DataWriter:
+    """
+    Append data frames to a single step output chunk by chunk.
+
+    Csv output keeps a continuous row index, so it is identical to writing all rows at once.
+    Parquet output stores each chunk as a row group using the schema of the first chunk.
+    """
+
+    def __init__(self, folder, name, data_format):
+        """
+        Initialize the writer, the file is created with the first chunk.
+
+        Parameters:
+          folder (str): output folder
+          name (str): output name without extension
+          data_format (str): one of DATA_FORMATS
+        """
+        self.path = Path(folder) / data_file_name(name, data_format)
+        self.data_format = data_format
+        self.rows = 0
+        self._parquet_writer = None
+
+    def write(self, data):
+        """
+        Append a chunk of rows.
+
+        Parameters:
+          data (pandas.DataFrame): rows to append
+        """
+        if data.empty:
+            return
+
+        if self.data_format == "parquet":
+            self._write_parquet(data)
+        else:
+            data.index = pd.RangeIndex(self.rows, self.rows + len(data))
+            data.to_csv(
+                self.path,
+                mode="w" if self.rows == 0 else "a",
+                header=self.rows == 0,
+            )
+        self.rows += len(data)
+
+    def _write_parquet(self, data):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        if self._parquet_writer is None:
+            table = pa.Table.from_pandas(data, preserve_index=False)
+            self._parquet_writer = pq.ParquetWriter(self.path, table.schema)
+        else:
+            table = pa.Table.from_pandas(
+                data, schema=self._parquet_writer.schema, preserve_index=False
+            )
+        self._parquet_writer.write_table(table)
+
+    def close(self):
+        """Finish the output file."""
+        if self._parquet_writer is not None:
+            self._parquet_writer.close()
+            self._parquet_writer = None
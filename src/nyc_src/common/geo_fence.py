@@ -0,0 +1,189 @@
+"""
+This module filters trips with the geo-fences declared in the transform config of a pipeline.
+
+A fence applies to one pair of longitude/latitude columns and is either a list of boxes, which
+a point passes when it is within any of them, or a simple polygon. A row is kept when it passes
+every fence. All fences are evaluated together in one vectorized expression that yields, for
+each row, 0 when it is kept or the number of the first fence it fails, so the rows removed by
+each fence are counted from the same result. The expression runs in a single pass with numexpr
+when it is installed, and with numpy one fence at a time otherwise.
+"""
+
+from functools import lru_cache
+from typing import NamedTuple
+import numpy as np
+import yaml
+
+try:
+    import numexpr
+except ImportError:  # numexpr is optional
+    numexpr = None
+
+
+class GeoFence(NamedTuple):
+    """An area the coordinates of a point must be within."""
+
+    name: str
+    longitude: str
+    latitude: str
+    boxes: tuple = ()
+    polygon: tuple = ()
+
+
+@lru_cache(maxsize=None)
+def load_geo_fences(config_path):
+    """
+    Read the geo-fences of a transform config file.
+
+    Parameters:
+      config_path (str): yaml file with a geo_fences list
+
+    Returns:
+      tuple: the GeoFence of each entry, in the order they are declared
+    """
+    with open(config_path) as config_file:
+        config = yaml.safe_load(config_file)
+
+    fences = []
+    for entry in config.get("geo_fences") or []:
+        name = entry.get("name", f"fence_{len(fences)}")
+        boxes = tuple(
+            (box["min_longitude"], box["max_longitude"], box["min_latitude"], box["max_latitude"])
+            for box in entry.get("boxes") or []
+        )
+        polygon = tuple(tuple(vertex) for vertex in entry.get("polygon") or [])
+        if bool(boxes) == bool(polygon):
+            raise ValueError(f"Geo-fence {name} must declare either boxes or a polygon")
+        if polygon and len(polygon) < 3:
+            raise ValueError(f"The polygon of geo-fence {name} needs at least 3 vertices")
+        fences.append(
+            GeoFence(name, entry["longitude"], entry["latitude"], boxes, polygon)
+        )
+    return tuple(fences)
+
+
+def fence_bounds(fences):
+    """
+    Compute the range of each coordinate column a row can have and pass the fences.
+
+    Parameters:
+      fences (tuple): GeoFence list
+
+    Returns:
+      dict: column name to its (min, max)
+    """
+    bounds = {}
+    for fence in fences:
+        if fence.boxes:
+            longitudes = [value for box in fence.boxes for value in box[:2]]
+            latitudes = [value for box in fence.boxes for value in box[2:]]
+        else:
+            longitudes = [vertex[0] for vertex in fence.polygon]
+            latitudes = [vertex[1] for vertex in fence.polygon]
+        for column, values in [(fence.longitude, longitudes), (fence.latitude, latitudes)]:
+            low, high = min(values), max(values)
+            if column in bounds:
+                # Every fence must pass, the column range is the intersection
+                low, high = max(low, bounds[column][0]), min(high, bounds[column][1])
+            bounds[column] = (low, high)
+    return bounds
+
+
+def _box_expression(fence, box):
+    min_lon, max_lon, min_lat, max_lat = (repr(float(value)) for value in box)
+    return (
+        f"(({fence.longitude} >= {min_lon}) & ({fence.longitude} <= {max_lon})"
+        f" & ({fence.latitude} >= {min_lat}) & ({fence.latitude} <= {max_lat}))"
+    )
+
+
+def _polygon_expression(fence):
+    # Even-odd rule: a point is inside when a ray cast from it crosses an odd number of edges
+    lon, lat = fence.longitude, fence.latitude
+    crossings = []
+    vertices = fence.polygon
+    for (x1, y1), (x2, y2) in zip(vertices, vertices[1:] + vertices[:1]):
+        if y1 == y2:
+            continue
+        x1, y1, x2, y2 = (repr(float(value)) for value in (x1, y1, x2, y2))
+        crossings.append(
+            f"((({y1} > {lat}) ^ ({y2} > {lat}))"
+            f" & ({lon} < ({x2} - {x1}) * ({lat} - {y1}) / ({y2} - {y1}) + {x1}))"
+        )
+    return "(" + " ^ ".join(crossings) + ")"
+
+
+def fence_expression(fence):
+    """
+    Build the boolean expression of the rows passing a fence.
+
+    Parameters:
+      fence (GeoFence): the fence
+
+    Returns:
+      str: a numexpr expression over the coordinate column names
+    """
+    if fence.boxes:
+        return "(" + " | ".join(_box_expression(fence, box) for box in fence.boxes) + ")"
+    return _polygon_expression(fence)
+
+
+def fence_mask(fence, values):
+    """
+    Evaluate a fence with numpy.
+
+    Parameters:
+      fence (GeoFence): the fence
+      values (dict): column name to its float64 values
+
+    Returns:
+      numpy.ndarray: the mask of the rows passing the fence
+    """
+    lon, lat = values[fence.longitude], values[fence.latitude]
+    if fence.boxes:
+        passed = np.zeros(len(lon), dtype=bool)
+        for min_lon, max_lon, min_lat, max_lat in fence.boxes:
+            passed |= (lon >= min_lon) & (lon <= max_lon) & (lat >= min_lat) & (lat <= max_lat)
+        return passed
+
+    inside = np.zeros(len(lon), dtype=bool)
+    vertices = fence.polygon
+    for (x1, y1), (x2, y2) in zip(vertices, vertices[1:] + vertices[:1]):
+        if y1 == y2:
+            continue
+        inside ^= ((y1 > lat) ^ (y2 > lat)) & (lon < (x2 - x1) * (lat - y1) / (y2 - y1) + x1)
+    return inside
+
+
+def geo_fence_mask(data, fences):
+    """
+    Evaluate the fences on a data frame.
+
+    Parameters:
+      data (pandas.DataFrame): trips with the coordinate columns of the fences
+      fences (tuple): GeoFence list
+
+    Returns:
+      (numpy.ndarray, dict): the mask of the rows passing every fence, and the number of rows
+        each fence removed, counting a row against the first fence it fails
+    """
+    if not fences:
+        return np.ones(len(data), dtype=bool), {}
+
+    columns = {fence.longitude for fence in fences} | {fence.latitude for fence in fences}
+    values = {column: data[column].to_numpy(dtype="float64") for column in columns}
+
+    # 0 when all fences pass, otherwise the 1-based number of the first failing fence
+    if numexpr is not None:
+        expression = "0"
+        for number in range(len(fences), 0, -1):
+            expression = f"where({fence_expression(fences[number - 1])}, {expression}, {number})"
+        failed_fence = numexpr.evaluate(expression, local_dict=values)
+    else:
+        failed_fence = np.zeros(len(data), dtype=np.int32)
+        for number in range(len(fences), 0, -1):
+            failed_fence[~fence_mask(fences[number - 1], values)] = number
+
+    counts = np.bincount(failed_fence, minlength=len(fences) + 1)
+    removed = {fence.name: int(counts[number + 1]) for number, fence in enumerate(fences)}
+    return failed_fence == 0, removed
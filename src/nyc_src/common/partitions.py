@@ -0,0 +1,174 @@
+"""
+This module writes and reads hive partitioned taxi data.
+
+Prepared trips can be split by vendor and by pickup year and month, one folder per partition
+(e.g. vendor=2/pickup_year=2016/pickup_month=1). Next to the partitions the writer stores the
+row count, the content hash and the min/max of every coordinate column of each partition, so
+readers can skip partitions that can't pass a bounding box filter, or that didn't change since
+a previous run, without opening them.
+"""
+
+import json
+from pathlib import Path
+import pandas as pd
+from src.nyc_src.common.cache import file_hash
+from src.nyc_src.common.data_io import DataWriter
+
+PARTITION_STATS_FILE = "_partition_stats.json"
+PARTITION_COLUMNS = ["vendor", "pickup_year", "pickup_month"]
+STATS_COLUMNS = [
+    "pickup_longitude",
+    "pickup_latitude",
+    "dropoff_longitude",
+    "dropoff_latitude",
+]
+NULL_PARTITION = "__HIVE_DEFAULT_PARTITION__"
+
+
+def partition_keys(data):
+    """
+    Compute the partition columns of prepared trips.
+
+    Parameters:
+      data (pandas.DataFrame): prepared trips with vendor and pickup_datetime columns
+
+    Returns:
+      list: vendor, pickup year and pickup month series aligned with the data
+    """
+    pickup = pd.to_datetime(data["pickup_datetime"], errors="coerce")
+    return [
+        data["vendor"].astype("Int64").rename("vendor"),
+        pickup.dt.year.astype("Int64").rename("pickup_year"),
+        pickup.dt.month.astype("Int64").rename("pickup_month"),
+    ]
+
+
+def partition_path(values):
+    """
+    Build the relative folder of a partition.
+
+    Parameters:
+      values (tuple): values of PARTITION_COLUMNS
+
+    Returns:
+      str: the hive style folder, e.g. vendor=2/pickup_year=2016/pickup_month=1
+    """
+    return "/".join(
+        f"{column}={NULL_PARTITION if pd.isna(value) else int(value)}"
+        for column, value in zip(PARTITION_COLUMNS, values)
+    )
+
+
+def merge_range(current, values):
+    """
+    Extend a [min, max] range with the values of a column, ignoring missing values.
+
+    Parameters:
+      current (list): the range so far, [None, None] when empty
+      values (pandas.Series): new values
+
+    Returns:
+      list: the extended range
+    """
+    low, high = values.min(), values.max()
+    if pd.isna(low):
+        return current
+    if current[0] is None:
+        return [float(low), float(high)]
+    return [min(current[0], float(low)), max(current[1], float(high))]
+
+
+def may_pass_bounds(stats, bounds):
+    """
+    Check whether a partition may contain rows within the bounds of every column.
+
+    Parameters:
+      stats (dict): statistics of the partition from the stats file
+      bounds (dict): column name to the (min, max) it is filtered with
+
+    Returns:
+      bool: False when no row of the partition can pass the filter
+    """
+    for column, (low, high) in bounds.items():
+        column_min, column_max = stats["ranges"].get(column, [None, None])
+        if column_min is None or column_max < low or column_min > high:
+            return False
+    return True
+
+
+def read_partition_stats(folder):
+    """
+    Read the statistics of a partitioned data set.
+
+    Parameters:
+      folder (str): root folder of the partitioned data set
+
+    Returns:
+      dict: partition folder to its file, hash, row count and coordinate ranges
+    """
+    with open(Path(folder) / PARTITION_STATS_FILE) as json_file:
+        return json.load(json_file)
+
+
+class PartitionedWriter:
+    """
+    Append prepared trips to a hive partitioned step output chunk by chunk.
+
+    Every partition is written with its own DataWriter, so the rows of a partition are
+    stored in one file whatever the chunking. The statistics file is written on close.
+    """
+
+    def __init__(self, folder, name, data_format):
+        """
+        Initialize the writer, partitions are created as their first rows arrive.
+
+        Parameters:
+          folder (str): output folder
+          name (str): name of the data set folder
+          data_format (str): format of the partition files
+        """
+        self.path = Path(folder) / name
+        self.data_format = data_format
+        self.rows = 0
+        self._writers = {}
+        self._stats = {}
+
+    def write(self, data):
+        """
+        Append a chunk of rows to their partitions.
+
+        Parameters:
+          data (pandas.DataFrame): prepared trips
+        """
+        if data.empty:
+            return
+
+        for values, part in data.groupby(partition_keys(data), sort=True, dropna=False):
+            partition = partition_path(values)
+            if partition not in self._writers:
+                (self.path / partition).mkdir(parents=True, exist_ok=True)
+                self._writers[partition] = DataWriter(
+                    self.path / partition, "part-0", self.data_format
+                )
+                self._stats[partition] = {
+                    "ranges": {column: [None, None] for column in STATS_COLUMNS}
+                }
+
+            self._writers[partition].write(part)
+            ranges = self._stats[partition]["ranges"]
+            for column in STATS_COLUMNS:
+                ranges[column] = merge_range(ranges[column], part[column])
+
+        self.rows += len(data)
+
+    def close(self):
+        """Finish the partition files and write the statistics file."""
+        for partition, writer in self._writers.items():
+            writer.close()
+            self._stats[partition]["file"] = writer.path.relative_to(self.path).as_posix()
+            self._stats[partition]["rows"] = writer.rows
+            self._stats[partition]["hash"] = file_hash(writer.path)
+
+        self.path.mkdir(parents=True, exist_ok=True)
+        with open(self.path / PARTITION_STATS_FILE, "w") as json_file:
+            json.dump(self._stats, json_file, indent=4, sort_keys=True)
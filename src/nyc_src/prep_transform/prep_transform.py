@@ -0,0 +1,177 @@
+"""
+This module prepares and transforms the raw taxi data in a single pass.
+
+It is an optional replacement of the prep and transform steps. Each chunk of raw rows is
+renamed, cleaned, filtered and decomposed into the training features while it is in memory,
+and only the final features are written, so no intermediate data set is written and parsed again.
+The prep and transform steps remain the reference implementation: their functions are applied
+to every chunk, so the features are the same as the ones of the two steps.
+"""
+
+import argparse
+import time
+import pandas as pd
+from src.nyc_src.common.data_io import (
+    CSV_ENGINES,
+    DATA_FORMATS,
+    DataWriter,
+    report_throughput,
+    set_reader_threads,
+)
+from src.nyc_src.common.geo_fence import load_geo_fences
+from src.nyc_src.common.quality import DataQuality
+from src.nyc_src.common.schema import read_options
+from src.nyc_src.prep.prep import classify_shards, cleansedata, read_shard
+from src.nyc_src.transform.transform import (
+    DEFAULT_TRANSFORM_CONFIG,
+    TRANSFORM_MODES,
+    transform_data,
+)
+
+
+def main(
+    raw_data,
+    transformed_data,
+    chunk_size=None,
+    data_format="csv",
+    csv_engine="c",
+    reader_threads=None,
+    datetime_format=None,
+    transform_mode="reference",
+    transform_config=DEFAULT_TRANSFORM_CONFIG,
+):
+    """
+    Read the raw csv files and write the training features.
+
+    Parameters:
+      raw_data (str): a folder to read csv files
+      transformed_data (str): a folder for the transformed data
+      chunk_size (int): number of raw rows to process at a time, processes whole files when not set
+      data_format (str): format of the transformed data file
+      csv_engine (str): parser of the raw files when they are read whole, c or pyarrow
+      reader_threads (int): number of threads of the pyarrow reader
+      datetime_format (str): strptime format of the trip datetimes, inferred once when not set
+      transform_mode (str): implementation of the transform, reference or low_copy
+      transform_config (str): yaml file declaring the geo-fences of the city border filter
+    """
+    lines = [
+        f"Raw data path: {raw_data}",
+        f"Transformed data output path: {transformed_data}",
+    ]
+
+    for line in lines:
+        print(line)
+
+    set_reader_threads(reader_threads)
+    geo_fences = load_geo_fences(str(transform_config))
+    quality = DataQuality()
+    shards = classify_shards(raw_data)
+
+    # Green rows are written before yellow rows, in the order of the merged prep output
+    writer = DataWriter(transformed_data, "transformed_data", data_format)
+    start = time.perf_counter()
+    raw_rows = 0
+    for vendor, raw_files in shards.items():
+        for raw_file in raw_files:
+            for chunk in read_chunks(raw_file, vendor, chunk_size, csv_engine):
+                raw_rows += len(chunk)
+                clean_chunk = cleansedata(chunk, vendor)
+                writer.write(
+                    transform_data(
+                        clean_chunk,
+                        datetime_format,
+                        transform_mode,
+                        geo_fences=geo_fences,
+                        quality=quality,
+                    )
+                )
+    writer.close()
+
+    report_throughput(raw_rows, time.perf_counter() - start, "raw files")
+    print("%s: %d rows" % (writer.path.name, writer.rows))
+    quality.log()
+
+
+def read_chunks(raw_file, vendor, chunk_size=None, csv_engine="c"):
+    """
+    Read a raw file with the vendor schema, in chunks of rows or whole.
+
+    Parameters:
+      raw_file (Path): raw csv file
+      vendor (str): the vendor schema of the file
+      chunk_size (int): number of rows per chunk, the file is read whole when not set
+      csv_engine (str): parser of the file when it is read whole, c or pyarrow
+
+    Returns:
+      iterator: data frames of raw rows
+    """
+    if chunk_size:
+        print("streaming file: %s ..." % raw_file)
+        return pd.read_csv(raw_file, chunksize=chunk_size, **read_options(vendor))
+    return iter([read_shard(raw_file, vendor, csv_engine)])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser("prep_transform")
+    parser.add_argument("--raw_data", type=str, help="Path to raw data")
+    parser.add_argument("--transformed_data", type=str, help="Path of output data")
+    parser.add_argument(
+        "--chunk_size",
+        type=int,
+        default=None,
+        help="Number of raw rows to process at a time, processes whole files when not set",
+    )
+    parser.add_argument(
+        "--data_format",
+        type=str,
+        choices=DATA_FORMATS,
+        default="csv",
+        help="Format of the data written for the next step",
+    )
+    parser.add_argument(
+        "--csv_engine",
+        type=str,
+        choices=CSV_ENGINES,
+        default="c",
+        help="Parser of raw csv files, pyarrow parses with multiple threads, streaming always uses c",
+    )
+    parser.add_argument(
+        "--reader_threads",
+        type=int,
+        default=None,
+        help="Number of threads of the pyarrow reader, defaults to the number of cores",
+    )
+    parser.add_argument(
+        "--datetime_format",
+        type=str,
+        default=None,
+        help="strptime format of the trip datetimes, inferred from the first value when not set",
+    )
+
+    parser.add_argument(
+        "--transform_mode",
+        type=str,
+        choices=TRANSFORM_MODES,
+        default="reference",
+        help="Implementation of the transform, low_copy gives the same output with fewer copies",
+    )
+    parser.add_argument(
+        "--transform_config",
+        type=str,
+        default=str(DEFAULT_TRANSFORM_CONFIG),
+        help="yaml file declaring the geo-fences of the city border filter",
+    )
+
+    args = parser.parse_args()
+
+    main(
+        args.raw_data,
+        args.transformed_data,
+        args.chunk_size,
+        args.data_format,
+        args.csv_engine,
+        args.reader_threads,
+        args.datetime_format,
+        args.transform_mode,
+        args.transform_config,
+    )
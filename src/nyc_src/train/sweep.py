@@ -0,0 +1,231 @@
+"""
+This module selects the model of the train step with a parallel sweep over candidate models.
+
+The candidates are the combinations of the estimators, hyperparameter values and feature sets
+of a sweep config file. The training features are written once to a .npy file that the worker
+processes memory-map, so they share one copy of the matrix instead of receiving their own.
+Each candidate is fitted on the first rows of the training data and scored on the last ones.
+Candidates are started until the time budget is spent, then the best one is fitted again on
+all training rows.
+"""
+
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from itertools import product
+import os
+from pathlib import Path
+import tempfile
+import time
+from typing import NamedTuple
+import numpy as np
+import yaml
+from sklearn.compose import ColumnTransformer
+from sklearn.ensemble import HistGradientBoostingRegressor
+from sklearn.linear_model import Lasso, LinearRegression, Ridge
+from sklearn.metrics import r2_score
+from sklearn.pipeline import Pipeline
+from threadpoolctl import threadpool_limits
+
+# Estimators a sweep config can name
+ESTIMATORS = {
+    "LinearRegression": LinearRegression,
+    "Ridge": Ridge,
+    "Lasso": Lasso,
+    "HistGradientBoostingRegressor": HistGradientBoostingRegressor,
+}
+
+# Sweep config of the taxi models
+DEFAULT_SWEEP_CONFIG = Path(__file__).parent / "sweep_config.yml"
+
+
+class Candidate(NamedTuple):
+    """A model evaluated by the sweep."""
+
+    name: str
+    estimator: str
+    params: dict
+    feature_set: str
+    features: tuple
+
+
+class SweepResult(NamedTuple):
+    """The validation score of a candidate."""
+
+    candidate: Candidate
+    score: float
+    seconds: float
+
+
+def load_sweep_config(config_path, feature_columns):
+    """
+    Read a sweep config file and list its candidates.
+
+    Parameters:
+      config_path (str): yaml file with the models, feature_sets, validation_size and
+        time_budget_seconds of the sweep
+      feature_columns (list): names of all features
+
+    Returns:
+      (dict, list): the config and its Candidate list
+    """
+    with open(config_path) as config_file:
+        config = yaml.safe_load(config_file)
+
+    feature_sets = {}
+    for set_name, columns in (config.get("feature_sets") or {"all": "all"}).items():
+        columns = list(feature_columns) if columns == "all" else columns
+        unknown = set(columns) - set(feature_columns)
+        if unknown:
+            raise ValueError(f"Unknown features in feature set {set_name}: {sorted(unknown)}")
+        feature_sets[set_name] = tuple(columns)
+
+    candidates = []
+    for model in config["models"]:
+        if model["estimator"] not in ESTIMATORS:
+            raise ValueError(
+                f"Unknown estimator {model['estimator']}, expected one of {list(ESTIMATORS)}"
+            )
+        grid = model.get("grid") or {}
+        for values, (set_name, columns) in product(product(*grid.values()), feature_sets.items()):
+            params = dict(zip(grid, values))
+            name = "-".join(
+                [model["name"], set_name] + [f"{key}={value}" for key, value in params.items()]
+            )
+            candidates.append(Candidate(name, model["estimator"], params, set_name, columns))
+    return config, candidates
+
+
+def build_model(candidate, feature_columns):
+    """
+    Build the unfitted model of a candidate.
+
+    Parameters:
+      candidate (Candidate): the candidate
+      feature_columns (list): names of all features, the model is given all of them
+
+    Returns:
+      estimator: the estimator, behind a selection of its features when it uses a subset
+    """
+    estimator = ESTIMATORS[candidate.estimator](**candidate.params)
+    if list(candidate.features) == list(feature_columns):
+        return estimator
+    select = ColumnTransformer(
+        [("features", "passthrough", list(candidate.features))], verbose_feature_names_out=False
+    )
+    return Pipeline([("features", select), ("model", estimator)])
+
+
+def evaluate_candidate(candidate, columns, matrix_path, labels_path, fit_rows, threads=None):
+    """
+    Fit a candidate on the first rows of the memory-mapped training data and score it on the others.
+
+    Parameters:
+      candidate (Candidate): the candidate
+      columns (slice or list): positions of the features of the candidate in the matrix
+      matrix_path (Path): .npy file of the float64 feature matrix
+      labels_path (Path): .npy file of the labels
+      fit_rows (int): number of rows the candidate is fitted on
+      threads (int): number of threads of the estimator, e.g. of gradient boosting
+
+    Returns:
+      (float, float): the R² score on the validation rows and the seconds spent
+    """
+    features = np.load(matrix_path, mmap_mode="r")
+    labels = np.load(labels_path, mmap_mode="r")
+    start = time.perf_counter()
+    with threadpool_limits(limits=threads):
+        model = ESTIMATORS[candidate.estimator](**candidate.params)
+        model.fit(features[:fit_rows, columns], labels[:fit_rows])
+        predictions = model.predict(features[fit_rows:, columns])
+    return r2_score(labels[fit_rows:], predictions), time.perf_counter() - start
+
+
+def run_sweep(features, labels, config_path=DEFAULT_SWEEP_CONFIG, max_workers=1):
+    """
+    Evaluate the candidates of a sweep config in a process pool and fit the best one.
+
+    Parameters:
+      features (pandas.DataFrame): float64 training features, in random order
+      labels (pandas.Series): training labels
+      config_path (str): sweep config file
+      max_workers (int): number of processes, 0 uses the number of cores
+
+    Returns:
+      (estimator, Candidate, list): the best model fitted on all rows, its candidate and
+        the SweepResult of each evaluated candidate, in config order
+    """
+    feature_columns = list(features.columns)
+    config, candidates = load_sweep_config(config_path, feature_columns)
+    fit_rows = int(len(features) * (1 - config.get("validation_size", 0.2)))
+    workers = max(1, min(max_workers or os.cpu_count(), len(candidates)))
+    print("sweeping %d candidates with %d workers" % (len(candidates), workers))
+
+    with tempfile.TemporaryDirectory() as folder:
+        matrix_path = Path(folder) / "features.npy"
+        labels_path = Path(folder) / "labels.npy"
+        np.save(matrix_path, features.to_numpy(dtype="float64"))
+        np.save(labels_path, labels.to_numpy(dtype="float64"))
+        arguments = (matrix_path, labels_path, fit_rows, max(1, os.cpu_count() // workers))
+        results = sweep_candidates(
+            candidates,
+            feature_columns,
+            arguments,
+            workers,
+            config.get("time_budget_seconds"),
+        )
+
+    if not results:
+        raise RuntimeError("No candidate was evaluated within the time budget")
+    best = max(results, key=lambda result: result.score)
+    print("best candidate: %s, validation R² %.4f" % (best.candidate.name, best.score))
+    model = build_model(best.candidate, feature_columns).fit(features, labels)
+    return model, best.candidate, results
+
+
+def sweep_candidates(candidates, feature_columns, arguments, workers, time_budget=None):
+    """
+    Evaluate candidates in a process pool until the time budget is spent.
+
+    No candidate is started once the budget is spent, the running ones are completed.
+
+    Parameters:
+      candidates (list): Candidate list
+      feature_columns (list): names of the columns of the feature matrix
+      arguments (tuple): the other arguments of evaluate_candidate, from matrix_path on
+      workers (int): number of processes
+      time_budget (float): seconds to start candidates in, unlimited when not set
+
+    Returns:
+      list: the SweepResult of each evaluated candidate, in the order of the candidates
+    """
+    start = time.perf_counter()
+    pending = iter(enumerate(candidates))
+    results = {}
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        running = {}
+        while True:
+            while len(running) < workers and not (
+                time_budget and time.perf_counter() - start > time_budget
+            ):
+                number, candidate = next(pending, (None, None))
+                if candidate is None:
+                    break
+                columns = (
+                    slice(None)
+                    if list(candidate.features) == feature_columns
+                    else [feature_columns.index(column) for column in candidate.features]
+                )
+                future = executor.submit(evaluate_candidate, candidate, columns, *arguments)
+                running[future] = (number, candidate)
+            if not running:
+                break
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                number, candidate = running.pop(future)
+                score, seconds = future.result()
+                print("candidate %s: validation R² %.4f in %.1fs" % (candidate.name, score, seconds))
+                results[number] = SweepResult(candidate, score, seconds)
+
+    if len(results) < len(candidates):
+        print("time budget spent, %d candidates skipped" % (len(candidates) - len(results)))
+    return [results[number] for number in sorted(results)]
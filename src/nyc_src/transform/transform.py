@@ -1,5 +1,5 @@
 """
-This module is responsible for transforming pre-processed data for the London Taxi dataset.
+This module is responsible for transforming pre-processed data for the NYC Taxi dataset.
 
 The module includes a main function that orchestrates the reading of cleaned data,
 performs further transformations, and outputs the transformed data for model training.
@@ -9,19 +9,89 @@ filtering out outliers in the dataset.
 """
 
 import argparse
-from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
 import os
+import time
+from pathlib import Path
 import pandas as pd
 import numpy as np
-
-
-def main(clean_data, transformed_data):
+from src.nyc_src.common.cache import (
+    cache_key,
+    hashes_key,
+    restore_outputs,
+    store_outputs,
+)
+from src.nyc_src.common.data_io import (
+    CSV_ENGINES,
+    DATA_FORMATS,
+    read_data,
+    read_index,
+    report_throughput,
+    set_reader_threads,
+    write_data,
+)
+from src.nyc_src.common.datetime_features import datetime_features
+from src.nyc_src.common.geo_fence import fence_bounds, geo_fence_mask, load_geo_fences
+from src.nyc_src.common.partitions import (
+    STATS_COLUMNS,
+    may_pass_bounds,
+    read_partition_stats,
+)
+from src.nyc_src.common.profiling import MemoryProfile, stage
+from src.nyc_src.common.quality import DataQuality
+from src.nyc_src.common.schema import apply_dtype_plan
+
+# Version of the transform logic, increment it when a change alters the outputs to invalidate cached runs
+TRANSFORM_VERSION = "1"
+
+# Implementations of transform_data, reference is the original sequence of pandas operations
+TRANSFORM_MODES = ["reference", "low_copy"]
+
+DATETIME_COLUMNS = ["pickup_datetime", "dropoff_datetime"]
+
+COORDINATE_COLUMNS = [
+    "pickup_longitude",
+    "pickup_latitude",
+    "dropoff_longitude",
+    "dropoff_latitude",
+]
+
+# Columns read by the quality rules, their missing values are counted
+QUALITY_COLUMNS = COORDINATE_COLUMNS + ["store_forward", "distance", "cost"]
+
+# Geo-fences of the city border filter, used when no transform config is given
+DEFAULT_TRANSFORM_CONFIG = Path(__file__).parents[1] / "common" / "transform_config.yml"
+
+
+def main(
+    clean_data,
+    transformed_data,
+    data_format="csv",
+    cache_dir=None,
+    csv_engine="c",
+    reader_threads=None,
+    datetime_format=None,
+    transform_mode="reference",
+    profile_memory=False,
+    transform_config=DEFAULT_TRANSFORM_CONFIG,
+    max_workers=1,
+):
     """
     Initiate transformation and save results into csv file.
 
     Parameters:
       clean_data (str): a folder to store results
       transformed_data (DataFrame): an initial data frame for transformation
+      data_format (str): format of the transformed data file
+      cache_dir (str): a folder caching the output by prepared data content, disabled when not set
+      csv_engine (str): parser of csv files, c or pyarrow
+      reader_threads (int): number of threads of the pyarrow readers, defaults to the number of cores
+      datetime_format (str): strptime format of the trip datetimes, inferred once when not set
+      transform_mode (str): one of TRANSFORM_MODES
+      profile_memory (bool): print the peak memory of each transform stage
+      transform_config (str): yaml file declaring the geo-fences of the city border filter
+      max_workers (int): number of processes transforming row ranges or partitions,
+        0 uses the number of cores, 1 transforms serially
     """
     lines = [
         f"Clean data path: {clean_data}",
@@ -31,22 +101,247 @@ def main(clean_data, transformed_data):
     for line in lines:
         print(line)
 
-    print("mounted_path files: ")
-    arr = os.listdir(clean_data)
-    print(arr)
+    geo_fences = load_geo_fences(str(transform_config))
+    if cache_dir:
+        # Skip the step when the same prepared data was already transformed
+        options = {
+            "data_format": data_format,
+            "csv_engine": csv_engine,
+            "geo_fences": geo_fences,
+        }
+        key = cache_key("transform", TRANSFORM_VERSION, clean_data, options)
+        if restore_outputs(cache_dir, key, transformed_data):
+            return
+
+    transform_options = {
+        "datetime_format": datetime_format,
+        "mode": transform_mode,
+        "profile": MemoryProfile() if profile_memory else None,
+        "geo_fences": geo_fences,
+        "quality": DataQuality(),
+    }
+
+    # Read the merged output of the prep step
+    set_reader_threads(reader_threads)
+    prep_outputs = read_index(clean_data)
+    if "merged" not in prep_outputs:
+        raise ValueError(
+            f"The prep output {clean_data} has no merged data, only {list(prep_outputs)}: "
+            "run the prep step with merged in its --outputs"
+        )
+    merged_path = prep_outputs["merged"]
+    if merged_path.is_dir():
+        transform_partitions(
+            merged_path,
+            transformed_data,
+            data_format,
+            cache_dir,
+            csv_engine,
+            max_workers,
+            **transform_options,
+        )
+    else:
+        print("reading file: %s ..." % merged_path)
+        start = time.perf_counter()
+        combined_df = read_data(merged_path, csv_engine)
+        report_throughput(len(combined_df), time.perf_counter() - start, merged_path)
+
+        # Transform the data
+        final_df = transform_parallel(combined_df, max_workers, **transform_options)
+
+        # Output data
+        write_data(final_df, transformed_data, "transformed_data", data_format)
+
+    if transform_options["profile"]:
+        transform_options["profile"].report()
+    transform_options["quality"].log()
+
+    if cache_dir:
+        store_outputs(cache_dir, key, transformed_data)
+
+
+def transform_partitions(
+    dataset,
+    transformed_data,
+    data_format="csv",
+    cache_dir=None,
+    csv_engine="c",
+    max_workers=1,
+    **transform_options,
+):
+    """
+    Transform a partitioned prep output one partition at a time.
+
+    Partitions whose coordinate ranges can't pass the geo-fences are skipped without being read.
+    With a cache, partitions whose content didn't change since a previous run are restored
+    instead of transformed. Each partition is written to the same relative folder of the output,
+    so the output is the same whether the partitions are transformed serially or in parallel.
+
+    Parameters:
+      dataset (Path): folder of the partitioned prep output
+      transformed_data (str): a folder for the transformed partitions
+      data_format (str): format of the transformed data files
+      cache_dir (str): a folder caching the transformed partitions, disabled when not set
+      csv_engine (str): parser of csv files, c or pyarrow
+      max_workers (int): number of processes transforming partitions, 0 uses the number of cores
+      transform_options: other arguments of transform_data
+    """
+    # Only the coordinate columns with statistics can prune partitions
+    bounds = fence_bounds(transform_options["geo_fences"])
+    bounds = {column: bounds[column] for column in STATS_COLUMNS if column in bounds}
+    jobs = {}
+    for partition, stats in read_partition_stats(dataset).items():
+        if not may_pass_bounds(stats, bounds):
+            print("pruned partition: %s" % partition)
+            continue
+
+        output_folder = Path(transformed_data) / partition
+        output_folder.mkdir(parents=True, exist_ok=True)
+        key = None
+        if cache_dir:
+            options = {
+                "data_format": data_format,
+                "csv_engine": csv_engine,
+                "geo_fences": transform_options["geo_fences"],
+            }
+            key = hashes_key(
+                "transform_partition",
+                TRANSFORM_VERSION,
+                {stats["file"]: stats["hash"]},
+                options,
+            )
+            if restore_outputs(cache_dir, key, output_folder):
+                continue
+
+        jobs[partition] = (Path(dataset) / stats["file"], output_folder, key)
+
+    quality = transform_options["quality"]
+    workers = worker_count(max_workers, len(jobs))
+    if workers == 1:
+        for input_file, output_folder, _ in jobs.values():
+            quality.merge(
+                transform_partition(
+                    input_file, output_folder, data_format, csv_engine, **transform_options
+                )
+            )
+    else:
+        # The stages run in the worker processes, they aren't profiled
+        options = dict(transform_options, profile=None, quality=None)
+        profile = transform_options["profile"]
+        with stage(profile, "parallel"), ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [
+                executor.submit(
+                    transform_partition,
+                    input_file,
+                    output_folder,
+                    data_format,
+                    csv_engine,
+                    **options,
+                )
+                for input_file, output_folder, _ in jobs.values()
+            ]
+            for future in futures:
+                quality.merge(future.result())
+
+    if cache_dir:
+        for _, output_folder, key in jobs.values():
+            store_outputs(cache_dir, key, output_folder)
+
+
+def transform_partition(
+    input_file, output_folder, data_format="csv", csv_engine="c", **transform_options
+):
+    """
+    Read, transform and write one partition.
+
+    Parameters:
+      input_file (Path): data file of the partition
+      output_folder (Path): folder of the transformed partition
+      data_format (str): format of the transformed data file
+      csv_engine (str): parser of csv files, c or pyarrow
+      transform_options: other arguments of transform_data
 
-    df_list = []
-    for filename in arr:
-        print("reading file: %s ..." % filename)
-        input_df = pd.read_csv((Path(clean_data) / filename))
-        df_list.append(input_df)
+    Returns:
+      dict: the quality counters of the partition
+    """
+    print("reading partition: %s ..." % input_file)
+    partition_df = read_data(input_file, csv_engine)
+    final_df, counts = transform_counted(partition_df, **transform_options)
+    write_data(final_df, output_folder, "transformed_data", data_format)
+    return counts
 
-    # Transform the data
-    combined_df = df_list[1]
-    final_df = transform_data(combined_df)
 
-    # Output data
-    final_df.to_csv((Path(args.transformed_data) / "transformed_data.csv"))
+def transform_counted(data, **transform_options):
+    """
+    Transform a data frame with its own quality counters, e.g. in a worker process.
+
+    Parameters:
+      data (pandas.DataFrame): incoming data frame
+      transform_options: other arguments of transform_data
+
+    Returns:
+      (DataFrame, dict): the transformed data frame and its quality counters
+    """
+    quality = DataQuality()
+    final_df = transform_data(data, **dict(transform_options, quality=quality))
+    return final_df, quality.counts
+
+
+def worker_count(max_workers, tasks):
+    """
+    Compute the number of processes of a pool.
+
+    Parameters:
+      max_workers (int): requested number of processes, 0 or None for the number of cores
+      tasks (int): number of tasks, no more processes than tasks are started
+
+    Returns:
+      int: number of processes, 1 to run serially
+    """
+    return max(1, min(max_workers or os.cpu_count(), tasks))
+
+
+def transform_parallel(combined_df, max_workers=1, **transform_options):
+    """
+    Transform contiguous row ranges of a data frame in a process pool.
+
+    Every row is filtered and transformed independently of the others, so the ranges are
+    transformed separately and concatenated in their order, giving the same result as
+    transforming the whole frame.
+
+    Parameters:
+      combined_df (pandas.DataFrame): incoming data frame
+      max_workers (int): number of processes, 0 uses the number of cores, 1 transforms serially
+      transform_options: other arguments of transform_data
+
+    Returns:
+        DataFrame: transformed data frame
+    """
+    workers = worker_count(max_workers, len(combined_df))
+    if workers == 1:
+        return transform_data(combined_df, **transform_options)
+
+    rows = len(combined_df)
+    bounds = [rows * worker // workers for worker in range(workers + 1)]
+    print("transforming %d row ranges in parallel" % workers)
+    with stage(transform_options.get("profile"), "parallel"):
+        # The stages run in the worker processes, they aren't profiled
+        options = dict(transform_options, profile=None, quality=None)
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [
+                executor.submit(transform_counted, combined_df.iloc[start:end], **options)
+                for start, end in zip(bounds, bounds[1:])
+            ]
+            parts = []
+            for future in futures:
+                part, counts = future.result()
+                parts.append(part)
+                transform_options["quality"].merge(counts)
+
+        # Ranges without any row left don't take part in the dtypes of the result, and the
+        # category columns of the ranges are cast again to the union of their categories
+        parts = [part for part in parts if len(part)] or parts[:1]
+        return apply_dtype_plan(pd.concat(parts, ignore_index=True))
 
 
 # These functions filter out coordinates for locations that are outside the city border.
@@ -56,7 +351,14 @@ def main(clean_data, transformed_data):
 # and define the minimum and maximum bounds for each field
 
 
-def transform_data(combined_df):
+def transform_data(
+    combined_df,
+    datetime_format=None,
+    mode="reference",
+    profile=None,
+    geo_fences=None,
+    quality=None,
+):
     """
     Transform a dataframe to prepare it for training.
 
@@ -64,42 +366,55 @@ def transform_data(combined_df):
 
     Parameters:
       combined_df (pandas.DataFrame): incoming data frame
+      datetime_format (str): strptime format of the datetime columns, inferred once when not set
+      mode (str): one of TRANSFORM_MODES, low_copy gives the same result with fewer copies
+      profile (MemoryProfile): records the peak memory of each stage, disabled when not set
+      geo_fences (tuple): GeoFence list of the city border filter, the default config when not set
+      quality (DataQuality): counts the rows affected by each rule, not kept when not set
 
     Returns:
         DataFrame: transformed data frame
     """
-    combined_df = combined_df.astype(
-        {
-            "pickup_longitude": "float64",
-            "pickup_latitude": "float64",
-            "dropoff_longitude": "float64",
-            "dropoff_latitude": "float64",
-        }
-    )
-
-    latlong_filtered_df = combined_df[
-        (combined_df.pickup_longitude <= -73.72)
-        & (combined_df.pickup_longitude >= -74.09)
-        & (combined_df.pickup_latitude <= 40.88)
-        & (combined_df.pickup_latitude >= 40.53)
-        & (combined_df.dropoff_longitude <= -73.72)
-        & (combined_df.dropoff_longitude >= -74.72)
-        & (combined_df.dropoff_latitude <= 40.88)
-        & (combined_df.dropoff_latitude >= 40.53)
-    ]
-
-    latlong_filtered_df.reset_index(inplace=True, drop=True)
+    if geo_fences is None:
+        geo_fences = load_geo_fences(str(DEFAULT_TRANSFORM_CONFIG))
+    if quality is None:
+        quality = DataQuality()
+    if mode == "low_copy":
+        return transform_data_low_copy(
+            combined_df, datetime_format, profile, geo_fences, quality
+        )
+
+    with stage(profile, "cast"):
+        combined_df = combined_df.astype(
+            {column: "float64" for column in COORDINATE_COLUMNS}
+        )
+        count_input(combined_df, quality)
+
+    with stage(profile, "geo_filter"):
+        in_bounds, removed = geo_fence_mask(combined_df, geo_fences)
+        count_geo_fences(removed, quality)
+        latlong_filtered_df = combined_df[in_bounds]
+
+        latlong_filtered_df.reset_index(inplace=True, drop=True)
 
     # These functions replace undefined values and rename to use meaningful names.
-    replaced_stfor_vals_df = latlong_filtered_df.replace(
-        {"store_forward": "0"}, {"store_forward": "N"}
-    ).fillna({"store_forward": "N"})
+    with stage(profile, "replace"):
+        store_forward = latlong_filtered_df["store_forward"]
+        quality.count(
+            "store_forward_replaced", (store_forward.isna() | (store_forward == "0")).sum()
+        )
+        distance = latlong_filtered_df["distance"]
+        quality.count("distance_replaced", (distance.isna() | (distance == ".00")).sum())
+
+        replaced_stfor_vals_df = latlong_filtered_df.replace(
+            {"store_forward": "0"}, {"store_forward": "N"}
+        ).fillna({"store_forward": "N"})
 
-    replaced_distance_vals_df = replaced_stfor_vals_df.replace(
-        {"distance": ".00"}, {"distance": 0}
-    ).fillna({"distance": 0})
+        replaced_distance_vals_df = replaced_stfor_vals_df.replace(
+            {"distance": ".00"}, {"distance": 0}
+        ).fillna({"distance": 0})
 
-    normalized_df = replaced_distance_vals_df.astype({"distance": "float64"})
+        normalized_df = replaced_distance_vals_df.astype({"distance": "float64"})
 
     # These functions transform the renamed data to be used finally for training.
 
@@ -112,42 +427,20 @@ def transform_data(combined_df):
     # use the drop_columns() function to delete the original fields as the newly generated features are preferred.
     # Rename the rest of the fields to use meaningful descriptions.
 
-    temp = pd.DatetimeIndex(normalized_df["pickup_datetime"], dtype="datetime64[ns]")
-    normalized_df["pickup_date"] = temp.date
-    normalized_df["pickup_weekday"] = temp.dayofweek
-    normalized_df["pickup_month"] = temp.month
-    normalized_df["pickup_monthday"] = temp.day
-    normalized_df["pickup_time"] = temp.time
-    normalized_df["pickup_hour"] = temp.hour
-    normalized_df["pickup_minute"] = temp.minute
-    normalized_df["pickup_second"] = temp.second
-
-    temp = pd.DatetimeIndex(normalized_df["dropoff_datetime"], dtype="datetime64[ns]")
-    normalized_df["dropoff_date"] = temp.date
-    normalized_df["dropoff_weekday"] = temp.dayofweek
-    normalized_df["dropoff_month"] = temp.month
-    normalized_df["dropoff_monthday"] = temp.day
-    normalized_df["dropoff_time"] = temp.time
-    normalized_df["dropoff_hour"] = temp.hour
-    normalized_df["dropoff_minute"] = temp.minute
-    normalized_df["dropoff_second"] = temp.second
-
-    del normalized_df["pickup_datetime"]
-    del normalized_df["dropoff_datetime"]
-
-    normalized_df.reset_index(inplace=True, drop=True)
+    # The weekday, month, day of the month, hour, minute and second of both datetimes are
+    # computed at once from their epoch values, the dates and times are never materialized.
+    with stage(profile, "datetime"):
+        features = datetime_features(normalized_df, DATETIME_COLUMNS, datetime_format)
+        normalized_df = pd.concat(
+            [normalized_df.drop(columns=DATETIME_COLUMNS), features],
+            axis=1,
+        )
+
+        normalized_df.reset_index(inplace=True, drop=True)
 
     print(normalized_df.head)
     print(normalized_df.dtypes)
 
-    # Drop the pickup_date, dropoff_date, pickup_time, dropoff_time columns because they're
-    # no longer needed (granular time features like hour,
-    # minute and second are more useful for model training).
-    del normalized_df["pickup_date"]
-    del normalized_df["dropoff_date"]
-    del normalized_df["pickup_time"]
-    del normalized_df["dropoff_time"]
-
     # Change the store_forward column to binary values
     normalized_df["store_forward"] = np.where(
         (normalized_df.store_forward == "N"), 0, 1
@@ -159,20 +452,205 @@ def transform_data(combined_df):
     # This step will significantly improve machine learning model accuracy,
     # because data points with a zero cost or distance represent major outliers that throw off prediction accuracy.
 
-    final_df = normalized_df[(normalized_df.distance > 0) & (normalized_df.cost > 0)]
-    final_df.reset_index(inplace=True, drop=True)
+    with stage(profile, "outlier_filter"):
+        positive_distance = normalized_df.distance > 0
+        positive_cost = normalized_df.cost > 0
+        quality.count("zero_distance_removed", (~positive_distance).sum())
+        quality.count("zero_cost_removed", (positive_distance & ~positive_cost).sum())
+        final_df = normalized_df[positive_distance & positive_cost]
+        final_df.reset_index(inplace=True, drop=True)
+        quality.count("rows_out", len(final_df))
+
+    # Store the features with compact dtypes
+    print("memory usage: %d bytes" % final_df.memory_usage(deep=True).sum())
+    with stage(profile, "dtype_plan"):
+        final_df = apply_dtype_plan(final_df)
+    print("compact memory usage: %d bytes" % final_df.memory_usage(deep=True).sum())
     print(final_df.head)
 
     return final_df
 
 
+def transform_data_low_copy(
+    combined_df, datetime_format=None, profile=None, geo_fences=(), quality=None
+):
+    """
+    Transform a dataframe to prepare it for training, copying the rows only once.
+
+    Produces the same result as the reference transform_data. The city border and the outlier
+    filters are combined into a single mask computed on the incoming columns, the kept rows are
+    copied once, and the replacements and casts then modify the filtered frame column by column.
+
+    Parameters:
+      combined_df (pandas.DataFrame): incoming data frame, it isn't modified
+      datetime_format (str): strptime format of the datetime columns, inferred once when not set
+      profile (MemoryProfile): records the peak memory of each stage, disabled when not set
+      geo_fences (tuple): GeoFence list of the city border filter
+      quality (DataQuality): counts the rows affected by each rule, not kept when not set
+
+    Returns:
+        DataFrame: transformed data frame
+    """
+    if quality is None:
+        quality = DataQuality()
+    with stage(profile, "mask"):
+        count_input(combined_df, quality)
+        keep, removed = geo_fence_mask(combined_df, geo_fences)
+        count_geo_fences(removed, quality)
+
+        # The replacements are counted on the rows within the geo-fences, as in transform_data
+        store_forward = combined_df["store_forward"]
+        replaced = (store_forward.isna() | (store_forward == "0")).to_numpy()
+        quality.count("store_forward_replaced", (replaced & keep).sum())
+        distance = combined_df["distance"]
+        replaced = (distance.isna() | (distance == ".00")).to_numpy()
+        quality.count("distance_replaced", (replaced & keep).sum())
+
+        # Undefined distances are replaced by 0, which the outlier filter drops anyway
+        if not pd.api.types.is_numeric_dtype(distance):
+            distance = distance.replace({".00": 0}).fillna(0).astype("float64")
+        positive_distance = distance.to_numpy(dtype="float64") > 0
+        positive_cost = combined_df["cost"].to_numpy(dtype="float64") > 0
+        quality.count("zero_distance_removed", (keep & ~positive_distance).sum())
+        quality.count("zero_cost_removed", (keep & positive_distance & ~positive_cost).sum())
+        keep &= positive_distance & positive_cost
+
+    with stage(profile, "filter"):
+        final_df = combined_df.take(np.flatnonzero(keep))
+        final_df.reset_index(inplace=True, drop=True)
+        quality.count("rows_out", len(final_df))
+
+    with stage(profile, "normalize"):
+        for column in COORDINATE_COLUMNS + ["distance"]:
+            if final_df[column].dtype != "float64":
+                final_df[column] = final_df[column].astype("float64")
+
+        # Undefined and "0" store_forward values mean N, which is stored as 0
+        store_forward = final_df["store_forward"]
+        final_df["store_forward"] = np.where(
+            store_forward.isna() | store_forward.isin(["N", "0"]), 0, 1
+        )
+
+    with stage(profile, "datetime"):
+        features = datetime_features(final_df, DATETIME_COLUMNS, datetime_format)
+        for column in DATETIME_COLUMNS:
+            del final_df[column]
+        for column in features.columns:
+            final_df[column] = features[column].to_numpy()
+        del features
+
+    # Store the features with compact dtypes
+    print("memory usage: %d bytes" % final_df.memory_usage(deep=True).sum())
+    with stage(profile, "dtype_plan"):
+        apply_dtype_plan(final_df, inplace=True)
+    print("compact memory usage: %d bytes" % final_df.memory_usage(deep=True).sum())
+    print(final_df.head)
+
+    return final_df
+
+
+def count_input(combined_df, quality):
+    """
+    Count the incoming rows and the missing values of the QUALITY_COLUMNS.
+
+    Parameters:
+      combined_df (pandas.DataFrame): incoming data frame
+      quality (DataQuality): the counters
+    """
+    quality.count("rows_in", len(combined_df))
+    for column, nulls in combined_df[QUALITY_COLUMNS].isna().sum().items():
+        quality.count("null_%s" % column, nulls)
+
+
+def count_geo_fences(removed, quality):
+    """
+    Count the rows removed by each geo-fence.
+
+    Parameters:
+      removed (dict): fence name to the number of rows it removed
+      quality (DataQuality): the counters
+    """
+    for name, rows in removed.items():
+        quality.count("geo_fence_%s_removed" % name, rows)
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser("transform")
     parser.add_argument("--clean_data", type=str, help="Path to prepped data")
     parser.add_argument("--transformed_data", type=str, help="Path of output data")
+    parser.add_argument(
+        "--data_format",
+        type=str,
+        choices=DATA_FORMATS,
+        default="csv",
+        help="Format of the data written for the next step",
+    )
+    parser.add_argument(
+        "--cache_dir",
+        type=str,
+        default=None,
+        help="Local folder caching outputs by input content for runs on the same machine, "
+        "disabled when not set",
+    )
+    parser.add_argument(
+        "--csv_engine",
+        type=str,
+        choices=CSV_ENGINES,
+        default="c",
+        help="Parser of csv files, pyarrow parses with multiple threads",
+    )
+    parser.add_argument(
+        "--reader_threads",
+        type=int,
+        default=None,
+        help="Number of threads of the pyarrow readers, defaults to the number of cores",
+    )
+    parser.add_argument(
+        "--datetime_format",
+        type=str,
+        default=None,
+        help="strptime format of the trip datetimes, inferred from the first value when not set",
+    )
+
+    parser.add_argument(
+        "--transform_mode",
+        type=str,
+        choices=TRANSFORM_MODES,
+        default="reference",
+        help="Implementation of the transform, low_copy gives the same output with fewer copies",
+    )
+    parser.add_argument(
+        "--profile_memory",
+        action="store_true",
+        help="Print the peak memory of each transform stage",
+    )
+    parser.add_argument(
+        "--transform_config",
+        type=str,
+        default=str(DEFAULT_TRANSFORM_CONFIG),
+        help="yaml file declaring the geo-fences of the city border filter",
+    )
+    parser.add_argument(
+        "--max_workers",
+        type=int,
+        default=1,
+        help="Number of processes transforming row ranges or partitions, 0 uses the number of cores",
+    )
 
     args = parser.parse_args()
 
     clean_data = args.clean_data
     transformed_data = args.transformed_data
-    main(clean_data, transformed_data)
+    main(
+        clean_data,
+        transformed_data,
+        args.data_format,
+        args.cache_dir,
+        args.csv_engine,
+        args.reader_threads,
+        args.datetime_format,
+        args.transform_mode,
+        args.profile_memory,
+        args.transform_config,
+        args.max_workers,
+    )
@@ -0,0 +1,40 @@
+import pandas as pd
+from pandas.testing import assert_frame_equal
+from src.nyc_src.common.data_io import DataWriter, read_data, read_data_chunks, read_row_groups
+from src.nyc_src.common.schema import apply_dtype_plan, read_options
+
+RAW_ROWS = """vendorID,lpepPickupDatetime,lpepDropoffDatetime,passengerCount,tripDistance,pickupLongitude,\
+pickupLatitude,dropoffLongitude,dropoffLatitude,storeAndFwdFlag,fareAmount
+2,2016-01-03 21:02:35,2016-01-03 21:05:52,1,0.83,-73.98,40.69,-73.97,40.69,N,4.5
+2,,2016-01-19 21:54:37,,1.27,-73.94,40.80,-73.95,40.81,,6.0
+1,2016-01-20 08:00:00,,3,NA,,40.80,-73.95,40.81,Y,
+,2016-01-21 09:00:00,2016-01-21 09:10:00,2,2.5,-73.94,40.80,-73.95,40.81,NULL,9.0
+"""
+
+
+def test_csv_engines_read_the_same_frame(tmp_path):
+    path = tmp_path / "greenTaxiData.csv"
+    path.write_text(RAW_ROWS)
+
+    c_data = read_data(path, "c", **read_options("green"))
+    pyarrow_data = read_data(path, "pyarrow", **read_options("green"))
+
+    assert c_data["storeAndFwdFlag"].isna().sum() == 2
+    assert_frame_equal(pyarrow_data[c_data.columns], c_data)
+
+
+def test_parquet_readers_keep_the_compact_dtypes(tmp_path):
+    data = apply_dtype_plan(
+        pd.DataFrame({"vendor": [1, 2, 2, 1], "passengers": [1, 3, 2, 1], "distance": [0.5, 1.25, 3.0, 8.0]})
+    )
+    writer = DataWriter(tmp_path, "features", "parquet")
+    writer.write(data[:2].copy())
+    writer.write(data[2:].copy())
+    writer.close()
+
+    for read in [
+        read_data(writer.path),
+        pd.concat(read_data_chunks(writer.path, 2), ignore_index=True),
+        read_row_groups(writer.path, [0, 1]),
+    ]:
+        assert_frame_equal(read, data)
@@ -0,0 +1,51 @@
+import numpy as np
+import pandas as pd
+from src.nyc_src.common.datetime_features import civil_from_days, datetime_features
+
+
+def test_format_is_inferred_again_for_another_format():
+    iso = pd.DataFrame({"pickup_datetime": ["2016-01-03 21:02:35", "2016-02-29 00:00:01"]})
+    us = pd.DataFrame({"pickup_datetime": ["01/03/2016 09:02:35 PM", "02/29/2016 12:00:01 AM"]})
+
+    first = datetime_features(iso, ["pickup_datetime"])
+    second = datetime_features(us, ["pickup_datetime"])
+
+    pd.testing.assert_frame_equal(first, second)
+    assert second["pickup_hour"].tolist() == [21, 0]
+
+
+def test_features_match_the_pandas_datetime_accessors():
+    rng = np.random.default_rng(0)
+    seconds = rng.integers(
+        pd.Timestamp("1899-12-25").value // 10**9, pd.Timestamp("2101-03-01").value // 10**9, 5000
+    )
+    # Leap days, including the century years that are or are not leap years
+    special = ["1900-02-28 23:59:59", "1900-03-01 00:00:00", "2000-02-29 12:00:00", "2024-02-29 00:00:00"]
+    values = pd.Series(pd.to_datetime(seconds, unit="s")).dt.strftime("%Y-%m-%d %H:%M:%S")
+    values = pd.concat([values, pd.Series(special)], ignore_index=True)
+    data = pd.DataFrame({"pickup_datetime": values, "dropoff_datetime": values[::-1].to_numpy()})
+
+    features = datetime_features(data, ["pickup_datetime", "dropoff_datetime"])
+
+    for column in ["pickup_datetime", "dropoff_datetime"]:
+        parsed = pd.to_datetime(data[column]).dt
+        prefix = column.replace("_datetime", "")
+        for part, expected in [
+            ("weekday", parsed.weekday),
+            ("month", parsed.month),
+            ("monthday", parsed.day),
+            ("hour", parsed.hour),
+            ("minute", parsed.minute),
+            ("second", parsed.second),
+        ]:
+            np.testing.assert_array_equal(features[f"{prefix}_{part}"], expected, err_msg=f"{prefix}_{part}")
+
+
+def test_civil_from_days_matches_the_calendar():
+    days = np.arange(-800000, 800000, 7, dtype=np.int64)
+
+    month, monthday = civil_from_days(days)
+
+    dates = pd.DatetimeIndex(days.astype("datetime64[D]"))
+    np.testing.assert_array_equal(month, dates.month)
+    np.testing.assert_array_equal(monthday, dates.day)
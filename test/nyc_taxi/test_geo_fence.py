@@ -0,0 +1,70 @@
+from pathlib import Path
+import numpy as np
+import pandas as pd
+import pytest
+from src.nyc_src.common import geo_fence
+from src.nyc_src.common.geo_fence import GeoFence, geo_fence_mask, load_geo_fences
+
+FENCES = (
+    GeoFence("pickup_city", "pickup_longitude", "pickup_latitude", boxes=((-74.09, -73.72, 40.53, 40.88),)),
+    GeoFence(
+        "dropoff_boroughs",
+        "dropoff_longitude",
+        "dropoff_latitude",
+        boxes=((-74.05, -73.9, 40.6, 40.75), (-73.95, -73.75, 40.7, 40.9)),
+    ),
+    # A concave polygon, the notch between its arms is outside of it
+    GeoFence(
+        "dropoff_polygon",
+        "dropoff_longitude",
+        "dropoff_latitude",
+        polygon=((-74.1, 40.5), (-73.7, 40.5), (-73.7, 40.9), (-73.85, 40.9), (-73.85, 40.7), (-73.95, 40.7),
+                 (-73.95, 40.9), (-74.1, 40.9)),
+    ),
+)
+
+
+def trips(rows, seed=0):
+    rng = np.random.default_rng(seed)
+    data = pd.DataFrame(
+        {
+            "pickup_longitude": rng.uniform(-74.2, -73.6, rows),
+            "pickup_latitude": rng.uniform(40.4, 41.0, rows),
+            "dropoff_longitude": rng.uniform(-74.2, -73.6, rows),
+            "dropoff_latitude": rng.uniform(40.4, 41.0, rows),
+        }
+    )
+    # Points on the edges of the boxes, and missing coordinates
+    data.loc[:9, "pickup_longitude"] = -74.09
+    data.loc[10:19, "pickup_latitude"] = 40.88
+    data.loc[20:29, "dropoff_longitude"] = np.nan
+    return data
+
+
+@pytest.mark.parametrize(
+    "fences",
+    [FENCES, FENCES[:1], load_geo_fences(str(Path(geo_fence.__file__).parent / "transform_config.yml"))],
+)
+def test_numexpr_and_numpy_give_the_same_mask(fences, monkeypatch):
+    pytest.importorskip("numexpr")
+    data = trips(20000)
+
+    numexpr_mask, numexpr_removed = geo_fence_mask(data, fences)
+    monkeypatch.setattr(geo_fence, "numexpr", None)
+    numpy_mask, numpy_removed = geo_fence_mask(data, fences)
+
+    np.testing.assert_array_equal(numexpr_mask, numpy_mask)
+    assert numexpr_removed == numpy_removed
+    assert 0 < numpy_mask.sum() < len(data)
+    assert sum(numpy_removed.values()) == len(data) - numpy_mask.sum()
+
+
+def test_polygon_notch_is_outside():
+    data = pd.DataFrame(
+        {"dropoff_longitude": [-73.9, -73.9, -74.0, -73.8], "dropoff_latitude": [40.8, 40.6, 40.8, 40.8]}
+    )
+
+    mask, removed = geo_fence_mask(data, FENCES[2:])
+
+    assert mask.tolist() == [False, True, True, True]
+    assert removed == {"dropoff_polygon": 1}
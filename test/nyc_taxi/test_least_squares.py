@@ -0,0 +1,49 @@
+import json
+import numpy as np
+from numpy.testing import assert_allclose
+from sklearn.linear_model import LinearRegression
+from src.nyc_src.common.least_squares import LeastSquares
+
+
+def test_merged_chunks_solve_like_linear_regression():
+    rng = np.random.default_rng(0)
+    x = rng.normal(size=(1000, 4)) * [1.0, 10.0, 100.0, 0.1] + [0.0, 40.7, -73.9, 5.0]
+    y = x @ [2.0, -1.0, 0.5, 3.0] + 7.0 + rng.normal(size=1000)
+
+    statistics = LeastSquares(4)
+    statistics.update(x[:100], y[:100])
+    other = LeastSquares(4)
+    for start in range(100, 1000, 300):
+        other.update(x[start:start + 300], y[start:start + 300])
+    statistics.merge(other)
+    coef, intercept = statistics.solve()
+
+    model = LinearRegression().fit(x, y)
+    assert statistics.rows == 1000
+    assert_allclose(coef, model.coef_, rtol=1e-9)
+    assert_allclose(intercept, model.intercept_, rtol=1e-9)
+    assert_allclose(statistics.r2_score(coef), model.score(x, y), rtol=1e-9)
+
+
+def test_constant_feature_gets_the_minimum_norm_solution():
+    rng = np.random.default_rng(1)
+    x = np.column_stack([rng.normal(size=200), np.full(200, 3.0)])
+    y = 4.0 * x[:, 0] + 1.0
+
+    statistics = LeastSquares(2)
+    statistics.update(x, y)
+    coef, intercept = statistics.solve()
+
+    model = LinearRegression().fit(x, y)
+    assert_allclose(coef, model.coef_, atol=1e-9)
+    assert_allclose(intercept, model.intercept_, rtol=1e-9)
+
+
+def test_statistics_survive_a_json_round_trip():
+    rng = np.random.default_rng(2)
+    statistics = LeastSquares(3)
+    statistics.update(rng.normal(size=(50, 3)), rng.normal(size=50))
+
+    restored = LeastSquares.from_dict(json.loads(json.dumps(statistics.to_dict())))
+
+    assert_allclose(restored.solve()[0], statistics.solve()[0], rtol=0)
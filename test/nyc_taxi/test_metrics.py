@@ -0,0 +1,111 @@
+import numpy as np
+import pandas as pd
+from numpy.testing import assert_allclose
+from sklearn.metrics import mean_absolute_error, mean_squared_error, r2_score
+from src.nyc_src.common.metrics import (
+    DEFAULT_SLICE_CONFIG,
+    BootstrapMetrics,
+    RegressionMetrics,
+    SlicedMetrics,
+    load_slice_config,
+)
+
+
+def scored_rows(rows, seed=0):
+    rng = np.random.default_rng(seed)
+    actual = rng.gamma(2.0, 6.0, rows)
+    return pd.DataFrame(
+        {
+            "vendor": rng.integers(1, 3, rows),
+            "pickup_hour": rng.integers(0, 24, rows),
+            "distance": rng.exponential(4.0, rows),
+            "actual_cost": actual,
+            "predicted_cost": actual + rng.normal(0.0, 3.0, rows),
+        }
+    )
+
+
+def expected_metrics(data):
+    actual, predicted = data["actual_cost"], data["predicted_cost"]
+    mse = mean_squared_error(actual, predicted)
+    return {
+        "rows": len(data),
+        "mse": mse,
+        "rmse": np.sqrt(mse),
+        "mae": mean_absolute_error(actual, predicted),
+        "r2": r2_score(actual, predicted),
+    }
+
+
+def test_merged_chunks_give_the_metrics_of_the_whole_data():
+    data = scored_rows(1000)
+
+    metrics = RegressionMetrics()
+    for start in range(0, 600, 150):
+        metrics.update(data["actual_cost"][start:start + 150], data["predicted_cost"][start:start + 150])
+    other = RegressionMetrics()
+    other.update(data["actual_cost"][600:], data["predicted_cost"][600:])
+    metrics.merge(other)
+
+    expected = expected_metrics(data)
+    expected.pop("rows")
+    assert metrics.rows == len(data)
+    assert_allclose(list(metrics.results().values()), list(expected.values()), rtol=1e-10)
+    assert metrics.histogram.sum() == len(data)
+
+
+def test_merged_slices_give_the_metrics_of_each_group():
+    data = scored_rows(2000, seed=1)
+    config = load_slice_config(str(DEFAULT_SLICE_CONFIG))
+
+    metrics = SlicedMetrics(config)
+    for start in range(0, len(data), 700):
+        chunk = SlicedMetrics(config)
+        chunk.update(data[start:start + 700].reset_index(drop=True))
+        metrics.merge(chunk)
+    results = metrics.results()
+
+    for label, group in data.groupby("vendor"):
+        assert_allclose(
+            list(results["vendor"][str(label)].values()), list(expected_metrics(group).values()), rtol=1e-10
+        )
+    for (vendor, hour), group in data.groupby(["vendor", "pickup_hour"]):
+        assert_allclose(
+            list(results["vendor_pickup_hour"][f"{vendor}|{hour}"].values()),
+            list(expected_metrics(group).values()),
+            rtol=1e-10,
+        )
+    band = np.searchsorted(config.bands["distance"], data["distance"], side="right")
+    assert_allclose(
+        list(results["distance_band"]["2-5"].values()), list(expected_metrics(data[band == 3]).values()), rtol=1e-10
+    )
+
+
+def bootstrap(data, chunk_size, workers):
+    # Each worker accumulates consecutive chunks of its part of the rows, the parts are merged in order
+    metrics = BootstrapMetrics(resamples=200, memory_mb=1, seed=7)
+    for part in np.array_split(np.arange(len(data)), workers):
+        worker = BootstrapMetrics(resamples=200, memory_mb=1, seed=7)
+        for start in range(part[0], part[-1] + 1, chunk_size):
+            chunk = data[start:min(start + chunk_size, part[-1] + 1)]
+            worker.update(chunk["actual_cost"], chunk["predicted_cost"], start)
+        metrics.merge(worker)
+    return metrics
+
+
+def test_bootstrap_does_not_depend_on_chunks_and_workers():
+    data = scored_rows(5000, seed=2)
+
+    reference = bootstrap(data, chunk_size=len(data), workers=1)
+    assert bootstrap(data, chunk_size=len(data), workers=1).results() == reference.results()
+    for chunk_size, workers in [(1000, 1), (333, 1), (5000, 3), (777, 4)]:
+        metrics = bootstrap(data, chunk_size, workers)
+        # The rows get the same weights, only the float32 sums of the blocks round differently
+        assert_allclose(metrics.weight, reference.weight, rtol=0)
+        for name in ["mse", "rmse", "r2"]:
+            assert_allclose(metrics.results()[name], reference.results()[name], rtol=1e-5)
+
+    intervals = reference.results()
+    overall = expected_metrics(data)
+    assert intervals["mse"][0] < overall["mse"] < intervals["mse"][1]
+    assert intervals["r2"][0] < overall["r2"] < intervals["r2"][1]
@@ -0,0 +1,23 @@
+import numpy as np
+import pandas as pd
+import pytest
+from src.nyc_src.common.data_io import DataWriter, read_row_groups
+from src.nyc_src.predict.predict import prediction_parts
+
+
+@pytest.mark.parametrize("data_format", ["csv", "parquet"])
+def test_parts_cover_the_test_files_in_order(tmp_path, data_format):
+    rows = pd.DataFrame({"cost": np.arange(1000, dtype="float64")})
+    for name, first, last in [("test_data-a", 0, 450), ("test_data-b", 450, 1000)]:
+        writer = DataWriter(tmp_path, name, data_format)
+        for start in range(first, last, 100):
+            writer.write(rows[start:min(start + 100, last)].copy())
+        writer.close()
+
+    parts = list(prediction_parts(tmp_path, chunk_size=200))
+
+    read = [part if isinstance(part, pd.DataFrame) else read_row_groups(*part) for _, _, part in parts]
+    assert [number for number, _, _ in parts] == list(range(len(parts)))
+    assert [first_row for _, first_row, _ in parts] == list(np.cumsum([0] + [len(part) for part in read[:-1]]))
+    assert pd.concat(read)["cost"].tolist() == rows["cost"].tolist()
+    assert max(len(part) for part in read) == 200
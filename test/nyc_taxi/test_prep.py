@@ -0,0 +1,31 @@
+import json
+import pytest
+from src.nyc_src.common.data_io import INDEX_FILE
+from src.nyc_src.prep.prep import main as prep
+from src.nyc_src.transform.transform import main as transform
+
+RAW_GREEN_FILE = "mlops/nyc_taxi/data/greenTaxiData.csv"
+
+
+@pytest.mark.parametrize("partitioned", [False, True])
+def test_streaming_prep_indexes_only_the_outputs_it_wrote(tmp_path, partitioned):
+    raw_data = tmp_path / "raw"
+    raw_data.mkdir()
+    with open(RAW_GREEN_FILE) as raw_file:
+        lines = [next(raw_file) for _ in range(301)]
+    (raw_data / "greenTaxiData.csv").write_text("".join(lines))
+    prep_data = tmp_path / "prep"
+    prep_data.mkdir()
+
+    prep(
+        str(raw_data),
+        str(prep_data),
+        chunk_size=100,
+        outputs=("green", "yellow"),
+        partitioned=partitioned,
+    )
+
+    with open(prep_data / INDEX_FILE) as index_file:
+        assert list(json.load(index_file)) == ["green"]
+    with pytest.raises(ValueError, match="run the prep step with merged in its --outputs"):
+        transform(str(prep_data), str(tmp_path / "transformed"))
@@ -0,0 +1,58 @@
+import pickle
+import numpy as np
+import pandas as pd
+from numpy.testing import assert_allclose
+from src.nyc_src.common.schema import FEATURE_COLUMNS
+from src.nyc_src.train.train import TRAINING_STATE_FILE, train_streaming
+
+
+def write_training_file(path, rows, seed):
+    rng = np.random.default_rng(seed)
+    data = pd.DataFrame({column: rng.integers(0, 12, rows) for column in FEATURE_COLUMNS})
+    data["distance"] = rng.exponential(3.0, rows)
+    data["vendor"] = rng.integers(1, 3, rows)
+    data["cost"] = 2.5 + 2.0 * data["distance"] + 0.1 * data["pickup_hour"] + rng.normal(size=rows)
+    data.to_csv(path, index=False)
+
+
+def train(tmp_path, name, training_data, previous_model=None):
+    model_output = tmp_path / name / "model"
+    test_data = tmp_path / name / "test"
+    model_output.mkdir(parents=True)
+    test_data.mkdir()
+    train_streaming(
+        str(training_data),
+        str(test_data),
+        str(model_output),
+        str(tmp_path / name / "metadata.json"),
+        chunk_size=70,
+        previous_model=str(previous_model) if previous_model else None,
+    )
+    with open(model_output / "model.sav", "rb") as model_file:
+        return model_output, pickle.load(model_file)
+
+
+def test_warm_start_reuses_statistics_and_fits_like_a_cold_start(tmp_path, monkeypatch, capsys):
+    monkeypatch.setenv("MLFLOW_TRACKING_URI", (tmp_path / "mlruns").as_uri())
+    training_data = tmp_path / "training_data"
+    training_data.mkdir()
+    write_training_file(training_data / "month=1.csv", 300, seed=0)
+    first_output, _ = train(tmp_path, "first", training_data)
+
+    write_training_file(training_data / "month=2.csv", 200, seed=1)
+    capsys.readouterr()
+    warm_output, warm_model = train(tmp_path, "warm", training_data, first_output)
+    out = capsys.readouterr().out
+    assert "reusing the statistics and test rows of 1 files, reading 1 files" in out
+    assert out.count("reading file:") == 1
+    _, cold_model = train(tmp_path, "cold", training_data)
+
+    assert (warm_output / TRAINING_STATE_FILE).is_file()
+    assert_allclose(warm_model.coef_, cold_model.coef_, rtol=1e-12)
+    assert_allclose(warm_model.intercept_, cold_model.intercept_, rtol=1e-12)
+    cold_test_files = sorted((tmp_path / "cold" / "test").iterdir())
+    assert [path.name for path in sorted((tmp_path / "warm" / "test").iterdir())] == [
+        path.name for path in cold_test_files
+    ]
+    for path in cold_test_files:
+        assert (tmp_path / "warm" / "test" / path.name).read_bytes() == path.read_bytes()